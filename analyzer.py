@@ -1,10 +1,14 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from abc import ABC, abstractmethod
 from typing import List
 from dataclasses import dataclass
 from enum import Enum
-from decimal import Decimal
+import metrics
+
+# Stored analysis results of an older version are recomputed, bump on any change of the results
+ANALYZER_VERSION = 1
 
 @dataclass
 class Point:
@@ -79,6 +83,7 @@ class Pattern(ABC):
         self.target_price: float = 0.0
         self.stop_loss: float = 0.0
         self.satisfied: bool = False
+        self.tolerance: float = 0.02
 
     @abstractmethod
     def validate(self) -> bool:
@@ -110,13 +115,62 @@ class DoubleTop(Pattern):
         self.valley: Point = None
 
     def validate(self) -> bool:
-        pass
+        """
+        two peaks of similar height with a valley below both of them
+        """
+        if self.first_peak is None or self.second_peak is None or self.valley is None:
+            return False
+        top = max(self.first_peak.price, self.second_peak.price)
+        difference = abs(self.first_peak.price - self.second_peak.price) / top
+        self.satisfied = difference <= self.tolerance and self.valley.price < min(self.first_peak.price, self.second_peak.price)
+        if self.satisfied:
+            self.confidence = 1.0 - difference / self.tolerance if self.tolerance else 1.0
+            self.target_price = self.calculate_target()
+            self.stop_loss = self.calculate_stop_loss()
+        return self.satisfied
 
     def calculate_target(self) -> float:
-        pass
+        """
+        measured move: the pattern height projected below the neckline
+        """
+        top = max(self.first_peak.price, self.second_peak.price)
+        return self.valley.price - (top - self.valley.price)
 
     def calculate_stop_loss(self) -> float:
-        pass
+        return max(self.first_peak.price, self.second_peak.price)
+
+class DoubleBottom(Pattern):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pattern_type = PatternType.DOUBLE_BOTTOM
+        self.first_bottom: Point = None
+        self.second_bottom: Point = None
+        self.peak: Point = None
+
+    def validate(self) -> bool:
+        """
+        two bottoms of similar depth with a peak above both of them
+        """
+        if self.first_bottom is None or self.second_bottom is None or self.peak is None:
+            return False
+        bottom = min(self.first_bottom.price, self.second_bottom.price)
+        difference = abs(self.first_bottom.price - self.second_bottom.price) / bottom
+        self.satisfied = difference <= self.tolerance and self.peak.price > max(self.first_bottom.price, self.second_bottom.price)
+        if self.satisfied:
+            self.confidence = 1.0 - difference / self.tolerance if self.tolerance else 1.0
+            self.target_price = self.calculate_target()
+            self.stop_loss = self.calculate_stop_loss()
+        return self.satisfied
+
+    def calculate_target(self) -> float:
+        """
+        measured move: the pattern height projected above the neckline
+        """
+        bottom = min(self.first_bottom.price, self.second_bottom.price)
+        return self.peak.price + (self.peak.price - bottom)
+
+    def calculate_stop_loss(self) -> float:
+        return min(self.first_bottom.price, self.second_bottom.price)
 
 #
 # class StockPatternAnalyzer:
@@ -142,11 +196,18 @@ class StockPatternAnalyzer:
         self.data = data
         self.start_date = pd.to_datetime(start_date)
         self.end_date = pd.to_datetime(end_date)
-        self.filtered_data = self.data[(self.data['date'] >= self.start_date) & (self.data['date'] <= self.end_date)]
+        self.filtered_data = self.data
+        if start_date is not None:
+            self.filtered_data = self.filtered_data[self.filtered_data['date'] >= self.start_date]
+        if end_date is not None:
+            self.filtered_data = self.filtered_data[self.filtered_data['date'] <= self.end_date]
+
+        # Work on float prices instead of the Decimal objects returned by MySQL
+        self.close = pd.to_numeric(self.filtered_data['close_price'], errors='coerce').to_numpy(dtype=float)
 
         # TODO: Dynamically calculate support and resistance levels
-        self.support = Decimal(self.filtered_data['low_price'].min())  # Convert to Decimal
-        self.resistance = Decimal(self.filtered_data['high_price'].max())  # Convert to Decimal
+        self.support = float(pd.to_numeric(self.filtered_data['low_price'], errors='coerce').min())
+        self.resistance = float(pd.to_numeric(self.filtered_data['high_price'], errors='coerce').max())
 
         # TODO: There are several patterns in a interval, furthermore, there are nested mini pattern in a bit pattern
 
@@ -156,38 +217,236 @@ class StockPatternAnalyzer:
     def is_consolidation(self):
         if self.filtered_data.empty:
             return False
-        within_range = (self.filtered_data['close_price'] >= self.support) & (self.filtered_data['close_price'] <= self.resistance)
-        return within_range.all()
+        within_range = (self.close >= self.support) & (self.close <= self.resistance)
+        return bool(within_range.all())
 
     def count_touches(self):
         if self.filtered_data.empty:
             return {"resistance_touches": 0, "support_touches": 0}
 
-        # Convert the float multipliers to Decimal
-        resistance_touches = ((self.filtered_data['close_price'] >= self.resistance * Decimal('0.99')) &
-                              (self.filtered_data['close_price'] <= self.resistance * Decimal('1.01'))).sum()
-        support_touches = ((self.filtered_data['close_price'] >= self.support * Decimal('0.99')) &
-                           (self.filtered_data['close_price'] <= self.support * Decimal('1.01'))).sum()
+        resistance_touches = ((self.close >= self.resistance * 0.99) &
+                              (self.close <= self.resistance * 1.01)).sum()
+        support_touches = ((self.close >= self.support * 0.99) &
+                           (self.close <= self.support * 1.01)).sum()
 
-        return {"resistance_touches": resistance_touches, "support_touches": support_touches}
+        return {"resistance_touches": int(resistance_touches), "support_touches": int(support_touches)}
 
     def is_breakout(self):
         if self.filtered_data.empty:
             return False
-        return (self.filtered_data['close_price'] > self.resistance).any()
+        return bool((self.close > self.resistance).any())
 
     def is_breakdown(self):
         if self.filtered_data.empty:
             return False
-        return (self.filtered_data['close_price'] < self.support).any()
+        return bool((self.close < self.support).any())
+
+    def income(self):
+        """
+        Latest revenue/profit known at the last bar of the range, None unless the data
+        carries the as-of income columns of fundamentals.join_income
+        """
+        if self.filtered_data.empty or 'revenue' not in self.filtered_data:
+            return None
+        last = self.filtered_data.iloc[-1]
+        return {
+            "income_date": last['income_date'],
+            "revenue": float(last['revenue']),
+            "profit": float(last['profit']),
+            "margin": float(last['margin']),
+            "revenue_change": float(last['revenue_change'])
+        }
 
+    @metrics.measured('analyze')
     def analyze(self):
+        touches = self.count_touches()
         return {
             "support": self.support,
             "resistance": self.resistance,
             "is_consolidation": self.is_consolidation(),
-            "resistance_touches": self.count_touches()["resistance_touches"],
-            "support_touches": self.count_touches()["support_touches"],
+            "resistance_touches": touches["resistance_touches"],
+            "support_touches": touches["support_touches"],
             "is_breakout": self.is_breakout(),
             "is_breakdown": self.is_breakdown()
-        }
\ No newline at end of file
+        }
+
+def _sliding_extreme(values, window, ufunc):
+    """
+    Trailing sliding-window extreme in O(n) (van Herk / Gil-Werman).
+    The array is cut into blocks of `window` bars, each window is then covered by
+    the suffix of one block and the prefix of the next one.
+    NaN is ignored as long as the window holds at least one valid value.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n == 0 or window <= 1:
+        return values.copy()
+    window = min(window, n)
+
+    pad = (-n) % window
+    blocks = np.concatenate([values, np.full(pad, np.nan)]).reshape(-1, window)
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+
+    result = np.empty(n)
+    # Warm-up bars only see the history available so far
+    result[:window - 1] = ufunc.accumulate(values[:window - 1])
+    result[window - 1:] = ufunc(suffix[:n - window + 1], prefix[window - 1:n])
+    return result
+
+def sliding_max(values, window):
+    """
+    max over the last `window` values for every position
+    """
+    return _sliding_extreme(values, window, np.fmax)
+
+def sliding_min(values, window):
+    """
+    min over the last `window` values for every position
+    """
+    return _sliding_extreme(values, window, np.fmin)
+
+def rolling_sum(values, window):
+    """
+    sum over the last `window` values for every position, computed from one cumsum
+    """
+    values = np.asarray(values, dtype=float)
+    cumsum = np.concatenate([[0.0], np.cumsum(values)])
+    start = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+    return cumsum[1:] - cumsum[start]
+
+class RollingPatternAnalyzer:
+    """
+    Support/resistance signals for every bar over a trailing lookback window.
+    The whole history is processed in a single pass on float arrays, so the
+    signals of each bar already take the bars before the requested range into account.
+    """
+    def __init__(self, data, start_date=None, end_date=None, lookback=20, tolerance=0.01):
+        self.data = data
+        self.start_date = pd.to_datetime(start_date) if start_date is not None else None
+        self.end_date = pd.to_datetime(end_date) if end_date is not None else None
+        self.lookback = lookback
+        self.tolerance = tolerance
+
+        self.dates = pd.to_datetime(data['date']).to_numpy()
+        self.high = pd.to_numeric(data['high_price'], errors='coerce').to_numpy(dtype=float)
+        self.low = pd.to_numeric(data['low_price'], errors='coerce').to_numpy(dtype=float)
+        self.close = pd.to_numeric(data['close_price'], errors='coerce').to_numpy(dtype=float)
+
+    @metrics.measured('analyze')
+    def analyze(self) -> pd.DataFrame:
+        support = sliding_min(self.low, self.lookback)
+        resistance = sliding_max(self.high, self.lookback)
+
+        # A touch is a close within the tolerance band of the level of its own window
+        resistance_touch = np.abs(self.close - resistance) <= resistance * self.tolerance
+        support_touch = np.abs(self.close - support) <= support * self.tolerance
+
+        # Break compares the close with the levels of the window before the bar
+        previous_resistance = np.concatenate([[np.nan], resistance[:-1]])
+        previous_support = np.concatenate([[np.nan], support[:-1]])
+
+        result = pd.DataFrame({
+            'date': self.dates,
+            'close_price': self.close,
+            'support': support,
+            'resistance': resistance,
+            'support_touches': rolling_sum(support_touch, self.lookback).astype(int),
+            'resistance_touches': rolling_sum(resistance_touch, self.lookback).astype(int),
+            'is_breakout': self.close > previous_resistance,
+            'is_breakdown': self.close < previous_support,
+        })
+
+        if self.start_date is not None:
+            result = result[result['date'] >= self.start_date]
+        if self.end_date is not None:
+            result = result[result['date'] <= self.end_date]
+        return result.reset_index(drop=True)
+
+class PatternDetector:
+    """
+    Find double tops and double bottoms in the whole history.
+    A pattern is reported on the bar whose close confirms it by crossing the neckline,
+    at the earliest once the second swing point is known, order bars after it.
+    """
+    def __init__(self, data: pd.DataFrame, lookback=40, order=3, tolerance=0.02):
+        self.data = data
+        self.lookback = lookback
+        self.order = order  # bars on each side a swing point has to dominate
+        self.tolerance = tolerance
+        self.patterns: List[Pattern] = []
+
+        self.dates = pd.to_datetime(data['date']).to_numpy()
+        self.high = pd.to_numeric(data['high_price'], errors='coerce').to_numpy(dtype=float)
+        self.low = pd.to_numeric(data['low_price'], errors='coerce').to_numpy(dtype=float)
+        self.close = pd.to_numeric(data['close_price'], errors='coerce').to_numpy(dtype=float)
+
+    @metrics.measured('analyze')
+    def analyze(self) -> List[Pattern]:
+        self.patterns = []
+        if len(self.data) < 2 * self.order + 1:
+            return self.patterns
+        self._find_double_tops()
+        self._find_double_bottoms()
+        self.patterns.sort(key=lambda pattern: pattern.end_time)
+        return self.patterns
+
+    def _swing_points(self, values, ufunc):
+        """
+        index of the bars that are the extreme of the centered window around them
+        """
+        window = 2 * self.order + 1
+        extreme = _sliding_extreme(values, window, ufunc)
+        # The trailing window ending at i + order is the centered window of i
+        centered = np.full(len(values), np.nan)
+        centered[:len(values) - self.order] = extreme[self.order:]
+        return np.flatnonzero(values == centered)
+
+    def _first_cross(self, start, threshold, below):
+        """
+        first bar from start on whose close crosses the neckline, -1 if it never happens
+        """
+        end = min(start + self.lookback, len(self.close))
+        closes = self.close[start:end]
+        crossed = closes < threshold if below else closes > threshold
+        if not crossed.any():
+            return -1
+        return start + int(np.argmax(crossed))
+
+    def _find_double_tops(self):
+        peaks = self._swing_points(self.high, np.fmax)
+        for first, second in zip(peaks[:-1], peaks[1:]):
+            if second - first <= self.order or second - first > self.lookback:
+                continue
+            valley_index = first + int(np.nanargmin(self.low[first:second + 1]))
+            # The second swing point only shows once the order bars after it have closed
+            confirm = self._first_cross(second + self.order + 1, self.low[valley_index], below=True)
+            if confirm < 0:
+                continue
+
+            pattern = DoubleTop(self.dates[first], self.dates[confirm], None, None)
+            pattern.tolerance = self.tolerance
+            pattern.first_peak = Point(self.dates[first], self.high[first])
+            pattern.second_peak = Point(self.dates[second], self.high[second])
+            pattern.valley = Point(self.dates[valley_index], self.low[valley_index])
+            if pattern.validate():
+                self.patterns.append(pattern)
+
+    def _find_double_bottoms(self):
+        bottoms = self._swing_points(self.low, np.fmin)
+        for first, second in zip(bottoms[:-1], bottoms[1:]):
+            if second - first <= self.order or second - first > self.lookback:
+                continue
+            peak_index = first + int(np.nanargmax(self.high[first:second + 1]))
+            # The second swing point only shows once the order bars after it have closed
+            confirm = self._first_cross(second + self.order + 1, self.high[peak_index], below=False)
+            if confirm < 0:
+                continue
+
+            pattern = DoubleBottom(self.dates[first], self.dates[confirm], None, None)
+            pattern.tolerance = self.tolerance
+            pattern.first_bottom = Point(self.dates[first], self.low[first])
+            pattern.second_bottom = Point(self.dates[second], self.low[second])
+            pattern.peak = Point(self.dates[peak_index], self.high[peak_index])
+            if pattern.validate():
+                self.patterns.append(pattern)
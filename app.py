@@ -1,282 +1,85 @@
+import os
+import re
 import sys
+import time
 import signal
-from datetime import datetime, timedelta
+import subprocess
+import threading
+from datetime import datetime
 import multiprocessing
+from multiprocessing.managers import SyncManager
 import readline
-from fetcher import StockDataFetcher
-from analyzer import StockPatternAnalyzer
-from plotter import StockDataPlotter
-import mysql.connector
 import platform
-import pandas as pd
-import traceback
+from scheduler import JobScheduler
+import metrics
+from sharedmem import SharedFrameStore, SHARED_MEMORY_MAX_BYTES
+from profiler import profile_job, list_reports
 
-def update_worker(stock_no: str, db_config, debug_mode=False, include_income=False):
+def start_worker(db_config, progress_queue=None, frame_store=None):
     """
-    Worker for updating stock data
+    Pool initializer, the heavy worker module is imported here and not in the shell
     """
-    def log(message):
-        if debug_mode:
-            print(message)
-            
-    try:
-        start_date = datetime(2010, 1, 1)
-        end_date = datetime.now()
-        fetcher = StockDataFetcher(db_config, stock_no, start_date, end_date)
-        fetcher.connect_db()
-
-        try:
-            cursor = fetcher.db_connection.cursor()
-            cursor.execute(fetcher.queries['basic']['Check stock exists'], (stock_no,))
-            count = cursor.fetchone()[0]
-            cursor.close()
-
-            if count == 0:
-                log(f"No data found for stock {stock_no}, fetching from TWSE...")
-                fetcher.update_stock_data()
-            else:
-                cursor = fetcher.db_connection.cursor()
-                cursor.execute(fetcher.queries['basic']['Get last update date for stock'], (stock_no,))
-                last_update = cursor.fetchone()[0]
-                cursor.close()
+    import workers
+    workers.warm_worker(db_config, progress_queue, frame_store)
 
-                current_date = datetime.now().date()
-                if last_update and last_update < current_date:
-                    print(f"Updating price data for stock {stock_no} from {last_update}")
-                    fetcher.start_date = datetime.combine(last_update, datetime.min.time()) + timedelta(days=1)
-                    fetcher.update_stock_data()
+def run_command(target, args, metrics_sink=None):
+    """
+    Entry point of a command in its own process, exits with 1 when the worker failed
+    """
+    metrics.set_sink(metrics_sink)
+    try:
+        succeeded = target(*args) is not False
+    finally:
+        metrics.flush()
+    if not succeeded:
+        sys.exit(1)
 
-        except mysql.connector.Error as e:
-            print(f"Database error: {e}")
+def ignore_interrupt():
+    # Ctrl+C is handled by the shell, the manager has to outlive it until cleanup
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-        if include_income:
-            try:
-                cursor = fetcher.db_connection.cursor()
-                cursor.execute(fetcher.queries['income']['Check income exists'], (stock_no,))
-                count = cursor.fetchone()[0]
-                cursor.close()
-
-                if count == 0:
-                    log(f"No income data found for stock {stock_no}, fetching from MOPS...")
-                    fetcher.update_income_data()
-                else:
-                    cursor = fetcher.db_connection.cursor()
-                    cursor.execute(fetcher.queries['income']['Get last income update'], (stock_no,))
-                    last_update = cursor.fetchone()[0]
-                    cursor.close()
-
-                    current_date = datetime.now().date()
-                    if last_update and last_update < current_date:
-                        print(f"Updating income data for stock {stock_no} from {last_update}")
-                        fetcher.start_date = datetime.combine(last_update, datetime.min.time()) + timedelta(days=1)
-                        fetcher.update_income_data()
-
-            except mysql.connector.Error as e:
-                print(f"Database error when updating income: {e}")
-        
-        fetcher.disconnect_db()
-        print()
-        sys.stdout.flush()
-    except Exception as e:
-        print(f"Error updating stock {stock_no}: {e}")
-        traceback.print_exc()
-        sys.stdout.flush()
-
-def plot_worker(stock_no, start_date, end_date, db_config, period='D', plot_income=False):
-    try:
-        fetcher = StockDataFetcher(db_config, stock_no, start_date, end_date)
-        fetcher.connect_db()
-        
-        if plot_income:
-            data = fetcher.get_income_data_from_db()
-            if data.empty:
-                print(f"No income data found for stock {stock_no}")
-                return
-            
-            plotter = StockDataPlotter()
-            plotter.plot_income_chart(data, start_date, end_date,
-                                    title=f'Monthly Income Chart - {stock_no}')
-        else:
-            data = fetcher.get_aggregated_data_from_db(period)
-            period_text = {'D': 'Daily', 'W': 'Weekly', 'M': 'Monthly'}[period]
-            plotter = StockDataPlotter()
-            plotter.plot_kline_with_volume(data, start_date, end_date,
-                                         title=f'{period_text} K-Line Chart - {stock_no}')
-        
-        fetcher.disconnect_db()
-        sys.stdout.flush()
-    except Exception as e:
-        print(f"Error plotting stock {stock_no}: {e}")
-        sys.stdout.flush()
+def open_chart(path, title=None):
+    """
+    Show a rendered chart in a short-lived viewer process, neither the shell nor
+    the worker that drew it waits for the window to be closed
+    """
+    code = 'import sys; from plotter import StockDataPlotter; StockDataPlotter.show_image(*sys.argv[1:])'
+    subprocess.Popen([sys.executable, '-c', code, path] + ([title] if title else []),
+                     cwd=os.path.dirname(os.path.abspath(__file__)))
 
-def analyze_worker(stock_no, start_date, end_date, db_config, period='D'):
+def with_income(target, args):
     """
-    Worker for analyzing stock patterns
-    period: 'D' for daily, 'W' for weekly, 'M' for monthly
+    Arguments of an update job changed to also update the income
     """
-    try:
-        fetcher = StockDataFetcher(db_config, stock_no, start_date, end_date)
-        fetcher.connect_db()
-        data = fetcher.get_aggregated_data_from_db(period)
-        fetcher.disconnect_db()
-
-        period_text = {'D': 'Daily', 'W': 'Weekly', 'M': 'Monthly'}[period]
-        print(f"\n{period_text} Analysis result for {stock_no}:")
-
-        analyzer = StockPatternAnalyzer(data, start_date, end_date)
-        analysis_result = analyzer.analyze()
-        print(f"Support: {analysis_result['support']}")
-        print(f"Resistance: {analysis_result['resistance']}")
-        print(f"Is consolidation: {analysis_result['is_consolidation']}")
-        print(f"Support touches: {analysis_result['support_touches']}")
-        print(f"Resistance touches: {analysis_result['resistance_touches']}")
-        print(f"Is breakout: {analysis_result['is_breakout']}")
-        print(f"Is breakdown: {analysis_result['is_breakdown']}")
-
-        plotter = StockDataPlotter()
-        plotter.plot_kline_with_volume(
-            data, start_date, end_date,
-            support=analysis_result['support'],
-            resistance=analysis_result['resistance'],
-            title=f'{period_text} K-Line Chart with Analysis - {stock_no}'
-        )
-
-        sys.stdout.flush()
-    except Exception as e:
-        print(f"Error analyzing stock {stock_no}: {e}")
-        sys.stdout.flush()
-
-def list_worker(db_config, stock_no=None, start_date=None, end_date=None, period='D', include_income=False):
-    try:
-        fetcher = StockDataFetcher(db_config, stock_no or "", None, None)
-        fetcher.connect_db()
-        
-        if stock_no:
-            if include_income:
-                income_data = fetcher.get_income_data_from_db()
-                
-                if income_data.empty:
-                    print(f"\nNo income data found for stock {stock_no}")
-                    return
-
-                if start_date:
-                    income_data = income_data[income_data['date'] >= pd.to_datetime(start_date)]
-                if end_date:
-                    income_data = income_data[income_data['date'] <= pd.to_datetime(end_date)]
-                
-                print(f"\nMonthly Income Records for Stock {stock_no}:")
-                if start_date and end_date:
-                    print(f"Period: {start_date} to {end_date}")
-                
-                print("\nDate       | Revenue      | Profit")
-                print("-" * 50)
-                
-                for _, row in income_data.iterrows():
-                    date_str = row['date'].strftime('%Y-%m')
-                    print(f"{date_str:10} | {row['revenue']:12,d} | {row['profit']:12,d}")
-                
-                print("\nSummary Statistics:")
-                print("-" * 40)
-                print(f"Total Months: {len(income_data)}")
-                print(f"Average Revenue: {income_data['revenue'].mean():,.0f}")
-                print(f"Average Profit: {income_data['profit'].mean():,.0f}")
-                print(f"Total Revenue: {income_data['revenue'].sum():,.0f}")
-                print(f"Total Profit: {income_data['profit'].sum():,.0f}")
-            else:
-                data = fetcher.get_aggregated_data_from_db(period)
-                
-                # Filter by date range if provided
-                if start_date:
-                    data = data[data['date'] >= pd.to_datetime(start_date)]
-                if end_date:
-                    data = data[data['date'] <= pd.to_datetime(end_date)]
-                
-                if data.empty:
-                    print(f"\nNo data found for stock {stock_no}")
-                    return
-                
-                # Display header
-                period_text = {'D': 'Daily', 'W': 'Weekly', 'M': 'Monthly'}[period]
-                print(f"\n{period_text} Trading Records for Stock {stock_no}:")
-                if start_date and end_date:
-                    print(f"Period: {start_date} to {end_date}")
-                else:
-                    print("Latest records:")
-                
-                # Display data table
-                print("\nDate       | Volume      | Open  | High  | Low   | Close")
-                print("-" * 65)
-                
-                # Sort by date in descending order and limit to 10 if no date range
-                data = data.sort_values('date', ascending=False)
-                if not (start_date and end_date):
-                    data = data.head(10)
-                
-                # Display records with appropriate date format
-                date_format = '%Y-%m' if period == 'M' else '%Y-%m-%d'
-                for _, row in data.iterrows():
-                    date_str = row['date'].strftime(date_format)
-                    # Add padding for monthly format to align with header
-                    if period == 'M':
-                        date_str = f"{date_str}    "
-                    print(f"{date_str} | {row['volume']:11,.0f} | "
-                          f"{float(row['open_price']):5.2f} | {float(row['high_price']):5.2f} | "
-                          f"{float(row['low_price']):5.2f} | {float(row['close_price']):5.2f}")
-                
-                # Display summary statistics
-                print(f"\n{period_text} Summary Statistics:")
-                print("-" * 40)
-                
-                print(f"Total {period_text} Periods: {len(data)}")
-                print(f"Price Range: {float(data['low_price'].min()):.2f} - {float(data['high_price'].max()):.2f}")
-                print(f"Average Closing Price: {float(data['close_price'].mean()):.2f}")
-                print(f"Total Volume: {data['volume'].sum():,.0f}")
-                print(f"Average {period_text} Volume: {data['volume'].mean():,.0f}")
-                
-        else:
-            if include_income:
-                cursor = fetcher.db_connection.cursor()
-                cursor.execute(fetcher.queries['income']['List all income summary'])
-                results = cursor.fetchall()
-                cursor.close()
-
-                if not results:
-                    print("\nNo income data in database")
-                    return
-                    
-                print("\nStock Income Summary:")
-                print("Stock No | First Date | Last Date  | Records | Avg Revenue  | Avg Profit")
-                print("-" * 75)
-                for row in results:
-                    print(f"{row[0]:<8} | {row[1]} | {row[2]} | {row[3]:>7} | "
-                          f"{row[4]:>11,.0f} | {row[5]:>10,.0f}")
-            else:
-                cursor = fetcher.db_connection.cursor()
-                cursor.execute(fetcher.queries['basic']['List all stocks summary'])
-                
-                results = cursor.fetchall()
-                if not results:
-                    print("\nNo data in database")
-                    return
-                    
-                print("\nStock data in database:")
-                print("Stock No | First Date  | Last Date   | Records | Price Range")
-                print("-" * 65)
-                for row in results:
-                    print(f"{row[0]:<8} | {row[1]} | {row[2]} | {row[3]:>7} | {row[4]:6.2f} - {row[5]:6.2f}")
-                
-                cursor.close()
-                
-        fetcher.disconnect_db()
-        sys.stdout.flush()
-            
-    except Exception as e:
-        print(f"Error listing stocks: {e}")
-        traceback.print_exc()
-        sys.stdout.flush()
+    if target is profile_job:
+        label, worker, worker_args = args
+        return label, worker, with_income(worker, worker_args)
+    return args[:-1] + (True,)
+
+# Period flags, -p <period> also takes quarters, years and N trading days like 5D
+PERIOD_FLAGS = {'-d': 'D', '-w': 'W', '-m': 'M', '-q': 'Q', '-y': 'Y'}
+PERIOD_PATTERN = re.compile(r'[DWMQY]|[1-9][0-9]*D')
+
+# Commands taking period options
+PERIOD_COMMANDS = ('plot', 'analyze', 'list', 'indicators', 'scan', 'backtest', 'render')
+
+# Commands taking -v, the latest revenue and profit joined onto the prices
+VALUATION_COMMANDS = ('list', 'analyze', 'scan')
+
+# Commands that read every stock when no stock number is given
+ALL_STOCK_COMMANDS = ('list', 'backtest', 'render', 'panel', 'corr', 'scan', 'export', 'import')
+
+# Commands writing prices, the others on the same stocks wait for them in batch mode
+WRITE_COMMANDS = ('update', 'import', 'watch')
+
+# Commands that wait for all earlier ones in batch mode
+REPORT_COMMANDS = ('status', 'stats')
+
+# Commands of the shell itself, they run no worker and cannot be profiled
+SHELL_COMMANDS = ('exit', 'status', 'stats', 'debug', 'shm', 'profile')
 
 class StockApp:
-    def __init__(self):
+    def __init__(self, interactive=True):
         self.db_config = {
             "host": "localhost",
             "user": "root",
@@ -286,10 +89,31 @@ class StockApp:
         self.processes = []
         self.process_info = {}
         self.debug_mode = False # debug mode is closed by default
+        # Workers run under the profiler when profile mode is on or for one 'profile <command>'
+        self.profile_mode = False
+        self.profile_next = False
+        self.session_start = datetime.now()
+        # Batch mode saves charts instead of opening windows and keeps no history
+        self.interactive = interactive
         signal.signal(signal.SIGINT, self.signal_handler)
+
+        # Pre-warmed workers for the interactive commands, started by start_background
+        # once the prompt is up: imports, queries and database connection are then
+        # already in place when a job arrives
+        self.pool_size = max(4, multiprocessing.cpu_count())
+        self.progress_queue = None
+        self.pool = None
+        self.scheduler = None
+
+        # Prices loaded by one worker are shared with the others through shared memory
+        self.shared_memory_limit = SHARED_MEMORY_MAX_BYTES
+        self.manager = None
+        self.frame_store = None
         
         # Command history, like the
         self.history_file = ".stock_app_history"
+        if not interactive:
+            return
         try:
             readline.read_history_file(self.history_file)
 
@@ -308,15 +132,61 @@ class StockApp:
                 print("pip install pyreadline3")
         
     def __del__(self) -> None:
+        if not self.interactive:
+            return
         try:
             readline.write_history_file(self.history_file)
         except Exception as e:
             print(f"Error saving history: {e}")
 
+    @property
+    def workers(self):
+        """
+        The worker module, pandas, matplotlib and MySQL come with it on first use
+        """
+        import workers
+        return workers
+
+    def start_background(self, preload=True) -> None:
+        """
+        Deferred initialization: start the worker pool and preload the heavy
+        libraries of the shell in a thread while the user types the first command
+        """
+        if self.pool is None:
+            self.progress_queue = multiprocessing.Queue()
+            self.manager = SyncManager()
+            self.manager.start(ignore_interrupt)
+            self.frame_store = SharedFrameStore.create(self.manager, self.shared_memory_limit)
+            self.pool = multiprocessing.Pool(processes=self.pool_size, initializer=start_worker,
+                                             initargs=(self.db_config, self.progress_queue, self.frame_store))
+            self.scheduler = JobScheduler(self.pool, self.pool_size, self.progress_queue,
+                                          on_complete=self.job_finished)
+        if preload:
+            threading.Thread(target=self.preload, daemon=True).start()
+
+    def job_finished(self, job) -> None:
+        """
+        Completion hook of the scheduler, opens the chart a worker returned
+        """
+        if not (isinstance(job.result, dict) and 'chart' in job.result):
+            return
+        try:
+            open_chart(job.result['chart'], job.result.get('title'))
+        except Exception as e:
+            print(f"Error opening chart {job.result['chart']}: {e}")
+
+    def preload(self) -> None:
+        try:
+            started = datetime.now()
+            self.workers
+            self.log(f"Preloaded libraries in {(datetime.now() - started).total_seconds():.2f}s")
+        except Exception as e:
+            print(f"Error preloading libraries: {e}")
+
     def signal_handler(self, signum, frame) -> None:
         print("\nReceived Ctrl+C, cleaning up...")
         self.cleanup()
-        sys.exit(0)
+        sys.exit(0 if self.interactive else 130)
 
     def cleanup(self) -> None:
         """
@@ -329,6 +199,21 @@ class StockApp:
                 process.join()
         self.processes = []
 
+        if self.pool is not None:
+            self.scheduler.cancel_pending()
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+        if self.manager is not None:
+            try:
+                self.frame_store.clear()
+            except Exception as e:
+                print(f"Error releasing shared memory: {e}")
+            self.manager.shutdown()
+            self.manager = None
+            self.frame_store = None
+
     def log(self, message) -> None:
         """
         according to debug mode to determine the log is shown or not
@@ -336,20 +221,55 @@ class StockApp:
         if self.debug_mode:
             print(message)
 
-    def update_stock(self, stock_no, include_income=False) -> None:
-        process = multiprocessing.Process(
-            target=update_worker,
-            args=(stock_no, self.db_config, self.debug_mode, include_income)
-        )
+    def submit_job(self, job_type, stock_no, target, args, key=None, merge=None):
+        """
+        Queue a command for the warm worker pool, returns its job
+        key: jobs with the same key are coalesced, by default the same command and arguments
+        merge: see JobScheduler.submit
+        """
+        self.start_background(preload=False)
+        target, args = self.profiled(job_type, stock_no, target, args)
+        job, coalesced = self.scheduler.submit(job_type, stock_no, target, args, key, merge)
+        if coalesced:
+            print(f"Same {job_type} for {stock_no} is already {job.status} (Job: {job.job_id})")
+        else:
+            print(f"Queued {job_type} job (Job: {job.job_id}, {job.status})")
+        return job
+
+    def start_process(self, process_type, stock_no, target, args):
+        """
+        Run a command that starts a pool of its own in a separate process, returns the process
+        """
+        # The progress queue also carries the metrics of the process back to the shell
+        self.start_background(preload=False)
+        target, args = self.profiled(process_type, stock_no, target, args)
+        process = multiprocessing.Process(target=run_command, args=(target, args, self.progress_queue))
         self.processes.append(process)
         process.start()
         self.process_info[process.pid] = {
-            'type': 'update',
+            'type': process_type,
             'stock_no': stock_no,
             'start_time': datetime.now(),
             'status': 'running'
         }
-        print(f"Started update process (PID: {process.pid})")
+        print(f"Started {process_type} process (PID: {process.pid})")
+        return process
+
+    def profiled(self, command_type, stock_no, target, args):
+        """
+        Target and arguments of a worker, wrapped by the profiler when profiling
+        """
+        if not (self.profile_mode or self.profile_next):
+            return target, args
+        return profile_job, (f"{command_type}-{stock_no or 'all'}", target, args)
+
+    def update_stock(self, stock_no, include_income=False):
+        # Repeated updates of a stock are merged into the queued or running one,
+        # which then also updates the income when any of them asked for it
+        merge = lambda target, args: with_income(target, args) if include_income else args
+        return self.submit_job('update', stock_no, self.workers.update_worker,
+                        (stock_no, self.db_config, self.debug_mode, include_income),
+                        key=('update', stock_no), merge=merge)
 
     def check_processes(self) -> None:
         """
@@ -361,11 +281,16 @@ class StockApp:
                 active_processes.append(process)
             else:
                 if process.pid in self.process_info:
-                    self.process_info[process.pid]['status'] = 'completed'
+                    status = 'completed' if process.exitcode == 0 else 'failed'
+                    self.process_info[process.pid]['status'] = status
                     if not self.debug_mode:
-                        print(f"Process {process.pid} ({self.process_info[process.pid]['type']}) completed")
+                        print(f"Process {process.pid} ({self.process_info[process.pid]['type']}) {status}")
         self.processes = active_processes
 
+        for job in self.scheduler.poll() if self.scheduler else []:
+            if not self.debug_mode:
+                print(f"Job {job.job_id} ({job.job_type}) {job.status} in {job.elapsed:.1f}s")
+
     def show_status(self) -> None:
         """
         show all pid and the corresponding status
@@ -378,35 +303,157 @@ class StockApp:
             start_time = info['start_time'].strftime('%Y-%m-%d %H:%M:%S')
             print(f"{pid:<8} | {info['type']:<8} | {info['stock_no']:<5} | {start_time} | {info['status']}")
 
+        print("\nJobs:")
+        print("Job   | Type      | Stock | Pri | Status    | Elapsed | Progress")
+        print("-" * 80)
+        for job in self.scheduler.jobs.values() if self.scheduler else []:
+            merged = f" (+{job.coalesced})" if job.coalesced else ""
+            print(f"{job.job_id:<5} | {job.job_type:<9} | {job.stock_no:<5} | {job.priority:>3} | "
+                  f"{job.status:<9} | {job.elapsed:6.1f}s | {job.describe_progress()}{merged}")
+
+        self.show_shared_memory()
+        self.show_profiles()
+
+    def show_profiles(self) -> None:
+        """
+        Profile reports written in this session
+        """
+        reports = list_reports(since=self.session_start)
+        if not reports and not self.profile_mode:
+            return
+        print(f"\nProfiles (profile mode {'on' if self.profile_mode else 'off'}):")
+        for path, summary in reports:
+            print(f"  {path}: {summary}")
+
+    def show_shared_memory(self) -> None:
+        if self.frame_store is None:
+            print(f"\nShared prices: not started, limit {self.shared_memory_limit / 2**20:.0f} MB")
+            return
+        segments, used = self.frame_store.usage()
+        print(f"\nShared prices: {segments} segments, {used / 2**20:.1f} of {self.shared_memory_limit / 2**20:.0f} MB")
+
+    def set_shared_memory_limit(self, megabytes) -> None:
+        """
+        Change the memory cap of the shared prices, evicts unused segments over it
+        """
+        self.shared_memory_limit = megabytes * 2**20
+        if self.frame_store is not None:
+            self.frame_store.max_bytes = self.shared_memory_limit
+        self.show_shared_memory()
+
     def plot_stock(self, stock_no, start_date=None, end_date=None, period='D', plot_income=False):
-        process = multiprocessing.Process(
-            target=plot_worker,
-            args=(stock_no, start_date, end_date, self.db_config, period, plot_income)
-        )
-        self.processes.append(process)
-        process.start()
-        self.process_info[process.pid] = {
-            'type': 'plot',
-            'stock_no': stock_no,
-            'start_time': datetime.now(),
-            'status': 'running'
-        }
-        print(f"Started plotting process (PID: {process.pid})")
+        return self.submit_job('plot', stock_no, self.workers.plot_worker,
+                               (stock_no, start_date, end_date, self.db_config, period, plot_income, self.interactive))
 
-    def analyze_stock(self, stock_no, start_date=None, end_date=None, period='D') -> None:
-        process = multiprocessing.Process(
-            target=analyze_worker,
-            args=(stock_no, start_date, end_date, self.db_config, period)
-        )
-        self.processes.append(process)
-        process.start()
-        self.process_info[process.pid] = {
-            'type': 'analyze',
-            'stock_no': stock_no,
-            'start_time': datetime.now(),
-            'status': 'running'
-        }
-        print(f"Started analysis process (PID: {process.pid})")
+    def analyze_stock(self, stock_no, start_date=None, end_date=None, period='D', lookback=None, valuation=False):
+        return self.submit_job('analyze', stock_no, self.workers.analyze_worker,
+                               (stock_no, start_date, end_date, self.db_config, period, lookback, self.interactive,
+                                valuation))
+
+    def show_indicators(self, stock_no, start_date=None, end_date=None, period='D'):
+        return self.submit_job('indicator', stock_no, self.workers.indicator_worker,
+                               (stock_no, start_date, end_date, self.db_config, period))
+
+    def list_stocks(self, stock_no=None, start_date=None, end_date=None, period='D', include_income=False,
+                    limit=None, after=None, valuation=False):
+        return self.submit_job('list', stock_no or 'all', self.workers.list_worker,
+                               (self.db_config, stock_no, start_date, end_date, period, include_income, limit, after,
+                                valuation))
+
+    def build_panel(self, start_date=None, end_date=None, snapshot=None):
+        return self.start_process('panel', 'all', self.workers.panel_worker,
+                                  (self.db_config, start_date, end_date, snapshot))
+
+    def correlate(self, start_date=None, end_date=None, snapshot=None):
+        return self.start_process('corr', 'all', self.workers.correlation_worker,
+                                  (self.db_config, start_date, end_date, snapshot))
+
+    def export_data(self, path='snapshot', mmap=False):
+        return self.start_process('export', 'all', self.workers.export_worker, (self.db_config, path, mmap))
+
+    def import_data(self, path='snapshot'):
+        return self.start_process('import', 'all', self.workers.import_worker, (self.db_config, path))
+
+    def watch(self, stock_numbers, interval=None):
+        stock_no = stock_numbers[0] if len(stock_numbers) == 1 else 'many'
+        args = (self.db_config, stock_numbers) + ((interval,) if interval else ())
+        return self.start_process('watch', stock_no, self.workers.watch_worker, args)
+
+    def render_charts(self, stock_numbers=None, periods=('D',), image_format='png', start_date=None, end_date=None):
+        stock_no = stock_numbers[0] if stock_numbers and len(stock_numbers) == 1 else 'many' if stock_numbers else 'all'
+        return self.start_process('render', stock_no, self.workers.render_worker,
+                                  (self.db_config, stock_numbers, periods, image_format, start_date, end_date))
+
+    def backtest(self, stock_no=None, period='D', horizon=20):
+        return self.start_process('backtest', stock_no or 'all', self.workers.backtest_worker,
+                                  (self.db_config, stock_no, period, horizon))
+
+    def scan(self, start_date=None, end_date=None, period='D', valuation=False):
+        return self.start_process('scan', 'all', self.workers.scan_worker,
+                                  (self.db_config, period, start_date, end_date, valuation))
+
+    def show_stats(self, reset=False, export=None) -> None:
+        """
+        Latency per pipeline stage and counters, gathered from every worker
+        """
+        self.check_processes()
+        registry = metrics.REGISTRY
+        uptime = max(datetime.now().timestamp() - registry.started, 1e-9)
+
+        print("\nStage      | Calls   | Total s  | Avg ms   | p50 ms   | p99 ms   | Max ms   | Calls/s")
+        print("-" * 90)
+        for stage in registry.stages():
+            histogram = registry.histograms[stage]
+            average = histogram.total / histogram.count if histogram.count else 0.0
+            print(f"{stage:<10} | {histogram.count:7d} | {histogram.total:8.2f} | {average * 1000:8.1f} | "
+                  f"{histogram.quantile(0.5) * 1000:8.1f} | {histogram.quantile(0.99) * 1000:8.1f} | "
+                  f"{histogram.max * 1000:8.1f} | {histogram.count / uptime:7.2f}")
+
+        if registry.counters:
+            print("\nCounter              | Total        | Per second")
+            print("-" * 50)
+            for name, value in sorted(registry.counters.items()):
+                print(f"{name:<20} | {value:12,.0f} | {value / uptime:10.2f}")
+
+        # Throughput of the database writes while they run, not over the whole session
+        written = registry.counters.get('rows_written', 0)
+        if written and 'db_write' in registry.histograms:
+            print(f"\nRows written per second of db_write: {written / registry.histograms['db_write'].total:,.0f}")
+
+        if export:
+            try:
+                registry.export(export)
+                print(f"Metrics written to {export}")
+            except OSError as e:
+                print(f"Error writing metrics: {e}")
+        if reset:
+            registry.reset()
+            print("Metrics reset")
+
+    def set_debug_mode(self, enabled) -> None:
+        self.debug_mode = enabled
+        print(f"Debug mode: {'on' if self.debug_mode else 'off'}")
+
+    def profile(self, enabled=None, name=None, kwargs=None):
+        """
+        Switch profile mode, or run one command under the profiler
+        """
+        if name is not None:
+            self.profile_next = True
+            try:
+                return self.execute_command(name, kwargs)
+            finally:
+                self.profile_next = False
+        if enabled is not None:
+            self.profile_mode = enabled
+            print(f"Profile mode: {'on' if self.profile_mode else 'off'}")
+        self.show_profiles()
+
+    def shared_memory(self, limit=None) -> None:
+        if limit is None:
+            self.show_shared_memory()
+        else:
+            self.set_shared_memory_limit(limit)
 
     def parse_date(self, date_str):
         if date_str:
@@ -417,140 +464,499 @@ class StockApp:
                 return None
         return None
 
+    def print_commands(self) -> None:
+        print("  update [-i] <stock_number>")
+        print("  plot <stock_number> [start_date] [end_date] [-i] [period]")
+        print("  analyze <stock_number> [start_date] [end_date] [period] [-r <lookback>] [-v]")
+        print("  list [-i|-v] [stock_number] [start_date] [end_date] [period] [--limit <rows>] [--after <key>]")
+        print("  indicators <stock_number> [start_date] [end_date] [period]")
+        print("  backtest [stock_number] [period] [-t <bars>]")
+        print("  panel [start_date] [end_date] [--snapshot <dir>]")
+        print("  corr [start_date] [end_date] [--snapshot <dir>]")
+        print("  watch <stock_number ...> [--interval <seconds>]")
+        print("  export [dir] [--mmap]")
+        print("  import [dir]")
+        print("  scan [start_date] [end_date] [period] [-v]")
+        print("  render [stock_number ...] [-i] [period ...] [-f png|svg]")
+        print("  shm [limit <MB>]")
+        print("  stats [reset|export <file.json|file.prom>]")
+        print("  debug on|off")
+        print("  profile on|off|<command ...>")
+        print("  status")
+        print("  exit")
+
+    def parse_periods(self, command):
+        """
+        Remove the period options from a split command line and return their periods
+        in the given order, prints the accepted periods and returns None for an invalid one
+        """
+        periods = []
+        index = 1
+        while index < len(command):
+            if command[index] in PERIOD_FLAGS:
+                periods.append(PERIOD_FLAGS[command.pop(index)])
+            elif command[index] == '-p':
+                period = command[index + 1].upper() if index + 1 < len(command) else ''
+                if not PERIOD_PATTERN.fullmatch(period):
+                    print("Period must be D, W, M, Q, Y or a number of trading days like 5D")
+                    return None
+                periods.append('D' if period == '1D' else period)
+                del command[index:index + 2]
+            else:
+                index += 1
+        return periods
+
+    def parse_command(self, line):
+        """
+        Parse one command line into the command name and the keyword arguments of
+        its method, prints the usage and returns None when the line is invalid
+        """
+        command = line.split()
+        if not command:
+            return None
+
+        if command[0] == "profile":
+            if len(command) == 1:
+                return "profile", {}
+            if len(command) == 2 and command[1] in ['on', 'off']:
+                return "profile", {'enabled': command[1] == 'on'}
+            if command[1] in SHELL_COMMANDS:
+                print("Usage: profile on|off|<command ...>, only commands that run a worker can be profiled")
+                return None
+            parsed = self.parse_command(' '.join(command[1:]))
+            if parsed is None:
+                return None
+            return "profile", {'name': parsed[0], 'kwargs': parsed[1]}
+
+        include_income = False
+        if '-i' in command:
+            include_income = True
+            command.remove('-i')
+
+        # Latest income known on every bar, for the commands that can show it
+        valuation = False
+        if command[0] in VALUATION_COMMANDS and '-v' in command:
+            valuation = True
+            command.remove('-v')
+
+        # Period options, every command taking them takes one period except render
+        periods = []
+        if command[0] in PERIOD_COMMANDS:
+            periods = self.parse_periods(command)
+            if periods is None:
+                return None
+            if len(periods) > 1 and command[0] != 'render':
+                print("Only one period can be given")
+                return None
+        period = periods[0] if periods else 'D'
+
+        if command[0] in ("exit", "status"):
+            return command[0], {}
+
+        elif command[0] == "stats":
+            if len(command) == 1:
+                return "stats", {}
+            if len(command) == 2 and command[1] == 'reset':
+                return "stats", {'reset': True}
+            if len(command) == 3 and command[1] == 'export':
+                return "stats", {'export': command[2]}
+            print("Usage: stats [reset|export <file.json|file.prom>]")
+            return None
+
+        elif command[0] == "debug":
+            if len(command) != 2 or command[1] not in ['on', 'off']:
+                print("Usage: debug on|off")
+                return None
+            return "debug", {'enabled': command[1] == 'on'}
+
+        elif command[0] == "shm":
+            if len(command) == 1:
+                return "shm", {}
+            if len(command) == 3 and command[1] == 'limit' and command[2].isdigit():
+                return "shm", {'limit': int(command[2])}
+            print("Usage: shm [limit <MB>]")
+            return None
+
+        elif command[0] == "update":
+            if len(command) != 2:
+                print("Usage: update [-i] <stock_number>")
+                return None
+            return "update", {'stock_no': command[1], 'include_income': include_income}
+
+        elif command[0] == "plot":
+            if len(command) < 2 or len(command) > 4:
+                print(f"Usage: {command[0]} <stock_number> [start_date] [end_date] [-i] [period]")
+                return None
+
+            start_date = self.parse_date(command[2]) if len(command) > 2 else None
+            end_date = self.parse_date(command[3]) if len(command) > 3 else None
+            return "plot", {'stock_no': command[1], 'start_date': start_date, 'end_date': end_date,
+                            'period': period, 'plot_income': include_income}
+
+        elif command[0] in ["analyze"]:
+            # Extract rolling lookback if present
+            lookback = None
+            if '-r' in command:
+                index = command.index('-r')
+                if index + 1 >= len(command) or not command[index + 1].isdigit() or int(command[index + 1]) < 2:
+                    print("Lookback must be an integer greater than 1")
+                    return None
+                lookback = int(command[index + 1])
+                del command[index:index + 2]
+
+            if len(command) < 2 or len(command) > 4:
+                print(f"Usage: {command[0]} <stock_number> [start_date] [end_date] [period] [-r <lookback>] [-v]")
+                return None
+
+            start_date = self.parse_date(command[2]) if len(command) > 2 else None
+            end_date = self.parse_date(command[3]) if len(command) > 3 else None
+            return "analyze", {'stock_no': command[1], 'start_date': start_date, 'end_date': end_date,
+                               'period': period, 'lookback': lookback, 'valuation': valuation}
+
+        elif command[0] == "list":
+            # Extract paging options if present
+            paging = {'--limit': None, '--after': None}
+            for option in paging:
+                if option in command:
+                    index = command.index(option)
+                    if index + 1 >= len(command):
+                        print(f"{option} needs a value")
+                        return None
+                    value = command[index + 1]
+                    if option == '--limit' and (not value.isdigit() or int(value) < 1):
+                        print("Limit must be a positive integer")
+                        return None
+                    paging[option] = int(value) if option == '--limit' else value
+                    del command[index:index + 2]
+
+            if len(command) > 4:
+                print("Usage: list [-i|-v] [stock_number] [start_date] [end_date] [period] [--limit <rows>] [--after <key>]")
+                return None
+
+            stock_no = command[1] if len(command) > 1 else None
+            start_date = self.parse_date(command[2]) if len(command) > 2 else None
+            end_date = self.parse_date(command[3]) if len(command) > 3 else None
+            after = paging['--after']
+            if after is not None and stock_no:
+                # The rows of a stock continue before the last date listed
+                after = self.parse_date(after)
+                if after is None:
+                    return None
+            return "list", {'stock_no': stock_no, 'start_date': start_date, 'end_date': end_date,
+                            'period': period, 'include_income': include_income,
+                            'limit': paging['--limit'], 'after': after, 'valuation': valuation}
+
+        elif command[0] == "indicators":
+            if len(command) < 2 or len(command) > 4:
+                print("Usage: indicators <stock_number> [start_date] [end_date] [period]")
+                return None
+
+            start_date = self.parse_date(command[2]) if len(command) > 2 else None
+            end_date = self.parse_date(command[3]) if len(command) > 3 else None
+            return "indicators", {'stock_no': command[1], 'start_date': start_date, 'end_date': end_date,
+                                  'period': period}
+
+        elif command[0] in ("panel", "corr"):
+            # Read the prices from an exported snapshot instead of the database
+            snapshot = None
+            if '--snapshot' in command:
+                index = command.index('--snapshot')
+                if index + 1 >= len(command):
+                    print("--snapshot needs the snapshot directory")
+                    return None
+                snapshot = command[index + 1]
+                del command[index:index + 2]
+
+            if len(command) > 3:
+                print(f"Usage: {command[0]} [start_date] [end_date] [--snapshot <dir>]")
+                return None
+
+            start_date = self.parse_date(command[1]) if len(command) > 1 else None
+            end_date = self.parse_date(command[2]) if len(command) > 2 else None
+            return command[0], {'start_date': start_date, 'end_date': end_date, 'snapshot': snapshot}
+
+        elif command[0] == "watch":
+            interval = None
+            if '--interval' in command:
+                index = command.index('--interval')
+                try:
+                    interval = float(command[index + 1])
+                    if interval <= 0:
+                        raise ValueError
+                except (IndexError, ValueError):
+                    print("Interval must be a positive number of seconds")
+                    return None
+                del command[index:index + 2]
+
+            if len(command) < 2:
+                print("Usage: watch <stock_number ...> [--interval <seconds>]")
+                return None
+            return "watch", {'stock_numbers': command[1:], 'interval': interval}
+
+        elif command[0] == "export":
+            mmap = '--mmap' in command
+            if mmap:
+                command.remove('--mmap')
+            if len(command) > 2:
+                print("Usage: export [dir] [--mmap]")
+                return None
+            return "export", {'path': command[1] if len(command) > 1 else 'snapshot', 'mmap': mmap}
+
+        elif command[0] == "import":
+            if len(command) > 2:
+                print("Usage: import [dir]")
+                return None
+            return "import", {'path': command[1] if len(command) > 1 else 'snapshot'}
+
+        elif command[0] == "scan":
+            if len(command) > 3:
+                print("Usage: scan [start_date] [end_date] [period] [-v]")
+                return None
+
+            start_date = self.parse_date(command[1]) if len(command) > 1 else None
+            end_date = self.parse_date(command[2]) if len(command) > 2 else None
+            return "scan", {'start_date': start_date, 'end_date': end_date, 'period': period, 'valuation': valuation}
+
+        elif command[0] == "render":
+            # Every period adds one chart per stock
+            periods = list(dict.fromkeys(periods))
+            if include_income:
+                periods.append('I')
+            if not periods:
+                periods = ['D']
+
+            image_format = 'png'
+            if '-f' in command:
+                index = command.index('-f')
+                if index + 1 >= len(command) or command[index + 1] not in ('png', 'svg'):
+                    print("Image format must be png or svg")
+                    return None
+                image_format = command[index + 1]
+                del command[index:index + 2]
+
+            return "render", {'stock_numbers': command[1:] or None, 'periods': periods,
+                              'image_format': image_format}
+
+        elif command[0] == "backtest":
+            horizon = 20
+            if '-t' in command:
+                index = command.index('-t')
+                if index + 1 >= len(command) or not command[index + 1].isdigit() or int(command[index + 1]) < 1:
+                    print("Timeout must be a positive integer")
+                    return None
+                horizon = int(command[index + 1])
+                del command[index:index + 2]
+
+            if len(command) > 2:
+                print("Usage: backtest [stock_number] [period] [-t <bars>]")
+                return None
+
+            return "backtest", {'stock_no': command[1] if len(command) > 1 else None,
+                                'period': period, 'horizon': horizon}
+
+        print("Unknown command. Available commands:")
+        self.print_commands()
+        return None
+
+    def execute_command(self, name, kwargs):
+        """
+        Run a parsed command, returns its job or process when it runs in the background
+        """
+        handlers = {
+            'update': self.update_stock,
+            'plot': self.plot_stock,
+            'analyze': self.analyze_stock,
+            'list': self.list_stocks,
+            'indicators': self.show_indicators,
+            'backtest': self.backtest,
+            'panel': self.build_panel,
+            'corr': self.correlate,
+            'watch': self.watch,
+            'export': self.export_data,
+            'import': self.import_data,
+            'render': self.render_charts,
+            'scan': self.scan,
+            'debug': self.set_debug_mode,
+            'profile': self.profile,
+            'shm': self.shared_memory,
+            'status': self.show_status,
+            'stats': self.show_stats,
+        }
+        return handlers[name](**kwargs)
+
     def run(self):
         print("Welcome to Stock Analysis App")
         print("Available commands:")
         print(" - update [-i] <stock_number>          # -i for income data")
-        print(" - plot <stock_number> [start_date] [end_date] [-i|-m|-w]")
-        print(" - analyze <stock_number> [start_date] [end_date] [-m|-w]  # Pattern analysis")
-        print(" - list [-i] [stock_number] [start_date] [end_date] [-m|-w]")
+        print(" - plot <stock_number> [start_date] [end_date] [-i] [period]")
+        print(" - analyze <stock_number> [start_date] [end_date] [period] [-r <lookback>] [-v]  # Pattern analysis")
+        print(" - list [-i|-v] [stock_number] [start_date] [end_date] [period] [--limit <rows>] [--after <key>]")
+        print(" - indicators <stock_number> [start_date] [end_date] [period]  # MA/EMA/RSI/MACD/Bollinger")
+        print(" - backtest [stock_number] [period] [-t <bars>]  # Replay patterns against target/stop loss")
+        print(" - panel [start_date] [end_date] [--snapshot <dir>]  # Build the multi-stock price panel cache")
+        print(" - corr [start_date] [end_date] [--snapshot <dir>]   # Return correlation and beta of all stocks")
+        print(" - watch <stock_number ...> [--interval <seconds>]  # Intraday quotes and alerts, the bar is saved at the close")
+        print(" - export [dir] [--mmap]                # Snapshot of the database, partitioned by stock and year")
+        print(" - import [dir]                         # Load a snapshot into the database in parallel")
+        print(" - scan [start_date] [end_date] [period] [-v]     # Analyze all stocks, only changed ones are recomputed")
+        print(" - render [stock_number ...] [-i] [period ...] [-f png|svg]  # Chart files for many stocks")
+        print(" - shm [limit <MB>]                    # Shared memory used by loaded prices")
+        print(" - stats [reset|export <file>]         # Latency per stage (HTTP, DB, render, ...)")
         print(" - debug on|off")
+        print(" - profile on|off|<command ...>        # CPU and memory profile of commands")
         print(" - status")
         print(" - exit")
         print("Date format: YYYY-MM-DD")
         print("Options:")
         print("  -i: Include income data")
-        print("  -m: Monthly aggregation")
-        print("  -w: Weekly aggregation")
+        print("  -v: Latest revenue, profit and margin known on each bar (list, analyze, scan)")
+        print("  period: -d, -w, -m, -q, -y for daily (default), weekly, monthly, quarterly or yearly bars,")
+        print("          or -p <period> with D, W, M, Q, Y or N trading days like 5D")
+        print("  -r: Rolling support/resistance over the last <lookback> bars")
+        print("  -t: Bars before a backtested pattern times out (default 20)")
+        print("  --limit/--after: Rows per page of list, newest first, and the last date (stock number")
+        print("                   for all stocks) of the page before, printed at the end of each page")
+        print("  -f: Image format of rendered charts (png or svg)")
         print("\nTip: Use Up/Down arrows to navigate command history")
 
+        # The prompt is ready, everything else is loaded in the background
+        self.start_background()
+
         while True:
             try:
                 self.check_processes()
                 command = input("\n> ").strip()
-                
+
                 if command:
                     readline.add_history(command)
-                
-                command = command.split()
-                if not command:
-                    continue
 
-                include_income = False
-                if '-i' in command:
-                    include_income = True
-                    command.remove('-i')
+                parsed = self.parse_command(command)
+                if parsed is None:
+                    continue
 
-                if command[0] == "exit":
+                name, kwargs = parsed
+                if name == "exit":
                     print("Cleaning up and exiting...")
                     self.cleanup()
                     break
-
-                elif command[0] == "debug":
-                    if len(command) != 2 or command[1] not in ['on', 'off']:
-                        print("Usage: debug on|off")
-                        continue
-                    self.debug_mode = (command[1] == 'on')
-                    print(f"Debug mode: {'on' if self.debug_mode else 'off'}")
-
-                elif command[0] == "status":
-                    self.show_status()
-
-                elif command[0] == "update":
-                    if len(command) != 2:
-                        print("Usage: update [-i] <stock_number>")
-                        continue
-                    self.update_stock(command[1], include_income)
-
-                elif command[0] == "plot":
-                    # Extract period flag if present
-                    period = 'D'  # default daily
-                    if '-m' in command:
-                        period = 'M'
-                        command.remove('-m')
-                    elif '-w' in command:
-                        period = 'W'
-                        command.remove('-w')
-
-                    if len(command) < 2 or len(command) > 4:
-                        print(f"Usage: {command[0]} <stock_number> [start_date] [end_date] [-i|-m|-w]")
-                        continue
-
-                    start_date = self.parse_date(command[2]) if len(command) > 2 else None
-                    end_date = self.parse_date(command[3]) if len(command) > 3 else None
-                    self.plot_stock(command[1], start_date, end_date, period, include_income)
-
-                elif command[0] in ["analyze"]:
-                    # Extract period flag if present
-                    period = 'D'  # default daily
-                    if '-m' in command:
-                        period = 'M'
-                        command.remove('-m')
-                    elif '-w' in command:
-                        period = 'W'
-                        command.remove('-w')
-
-                    if len(command) < 2 or len(command) > 4:
-                        print(f"Usage: {command[0]} <stock_number> [start_date] [end_date] [-m|-w]")
-                        continue
-
-                    start_date = self.parse_date(command[2]) if len(command) > 2 else None
-                    end_date = self.parse_date(command[3]) if len(command) > 3 else None
-                    self.analyze_stock(command[1], start_date, end_date, period)
-
-                elif command[0] == "list":
-                    # Extract period flag if present
-                    period = 'D'  # default daily
-                    if '-m' in command:
-                        period = 'M'
-                        command.remove('-m')
-                    elif '-w' in command:
-                        period = 'W'
-                        command.remove('-w')
-
-                    if len(command) > 4:
-                        print("Usage: list [-i] [stock_number] [start_date] [end_date] [-m|-w]")
-                        continue
-                        
-                    stock_no = command[1] if len(command) > 1 else None
-                    start_date = self.parse_date(command[2]) if len(command) > 2 else None
-                    end_date = self.parse_date(command[3]) if len(command) > 3 else None
-                    self.list_stocks(stock_no, start_date, end_date, period, include_income)
-
-                else:
-                    print("Unknown command. Available commands:")
-                    print("  update [-i] <stock_number>")
-                    print("  plot <stock_number> [start_date] [end_date] [-i|-m|-w]")
-                    print("  analyze <stock_number> [start_date] [end_date] [-m|-w]")
-                    print("  list [-i] [stock_number] [start_date] [end_date] [-m|-w]")
-                    print("  debug on|off")
-                    print("  status")
-                    print("  exit")
+                self.execute_command(name, kwargs)
 
             except Exception as e:
                 print(f"Error: {e}")
 
-    def list_stocks(self, stock_no=None, start_date=None, end_date=None, period='D', include_income=False):
-        process = multiprocessing.Process(
-            target=list_worker,
-            args=(self.db_config, stock_no, start_date, end_date, period, include_income)
-        )
-        self.processes.append(process)
-        process.start()
-        self.process_info[process.pid] = {
-            'type': 'list',
-            'stock_no': stock_no or 'all',
-            'start_time': datetime.now(),
-            'status': 'running'
-        }
-        print(f"Started listing process (PID: {process.pid})")
\ No newline at end of file
+    @staticmethod
+    def command_stocks(name, kwargs):
+        """
+        Stocks a parsed command works on: a set, None for every stock or an empty
+        set for the commands of the shell itself
+        """
+        if kwargs.get('stock_no'):
+            return {kwargs['stock_no']}
+        if kwargs.get('stock_numbers'):
+            return set(kwargs['stock_numbers'])
+        if name in ALL_STOCK_COMMANDS:
+            return None
+        return set()
+
+    @staticmethod
+    def step_status(handle):
+        """
+        running, completed or failed for the job or process of a batch step
+        """
+        if handle is None:
+            return 'completed'
+        if isinstance(handle, multiprocessing.Process):
+            if handle.is_alive():
+                return 'running'
+            return 'completed' if handle.exitcode == 0 else 'failed'
+        if handle.status in ('queued', 'running'):
+            return 'running'
+        return 'completed' if handle.status == 'completed' else 'failed'
+
+    def run_batch(self, lines, poll_interval=0.2, metrics_path=None) -> int:
+        """
+        Run commands without the prompt and wait for all of them.
+        A command on a stock waits for the earlier updates of that stock, an update
+        waits for the earlier commands on its stock, and commands on every stock
+        wait for all earlier updates. An import counts as an update of every stock.
+        Everything else runs in parallel.
+        Returns 0 when every command succeeded, 1 when one failed or was skipped
+        because a command it waited for failed, and 2 when a line is invalid.
+        metrics_path: write the metrics of the run to this JSON or .prom file
+        """
+        steps = []
+        for line in lines:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parsed = self.parse_command(line)
+            if parsed is None:
+                print(f"Invalid command: {line}")
+                return 2
+            name, kwargs = parsed
+            if name == "exit":
+                break
+
+            # A profiled command waits like the command itself
+            command, arguments = (kwargs['name'], kwargs['kwargs']) if name == "profile" and 'name' in kwargs \
+                else (name, kwargs)
+            stocks = self.command_stocks(command, arguments)
+            # A plain 'profile' lists the reports like status does
+            report = name in REPORT_COMMANDS or (name == "profile" and not kwargs)
+            after = []
+            for index, earlier in enumerate(steps):
+                # Reports describe everything run before them
+                if report:
+                    after.append(index)
+                    continue
+                if (command not in WRITE_COMMANDS and earlier['command'] not in WRITE_COMMANDS) or stocks == set() or earlier['stocks'] == set():
+                    continue
+                if stocks is None or earlier['stocks'] is None or stocks & earlier['stocks']:
+                    after.append(index)
+            steps.append({'line': line, 'name': name, 'command': command, 'kwargs': kwargs, 'stocks': stocks,
+                          'report': report, 'after': after, 'handle': None, 'status': 'waiting', 'start_time': None})
+        if not steps:
+            return 0
+
+        started = datetime.now()
+        try:
+            while any(step['status'] in ('waiting', 'running') for step in steps):
+                self.check_processes()
+                for number, step in enumerate(steps, 1):
+                    if step['status'] == 'running':
+                        step['status'] = self.step_status(step['handle'])
+                    elif step['status'] == 'waiting':
+                        waiting_for = [steps[index]['status'] for index in step['after']]
+                        failed = any(status in ('failed', 'skipped') for status in waiting_for)
+                        if failed and not step['report']:
+                            step['status'] = 'skipped'
+                        elif all(status not in ('waiting', 'running') for status in waiting_for):
+                            step['start_time'] = datetime.now()
+                            step['handle'] = self.execute_command(step['name'], step['kwargs'])
+                            step['status'] = self.step_status(step['handle'])
+                        else:
+                            continue
+                    else:
+                        continue
+
+                    if step['status'] == 'skipped':
+                        print(f"[{number}/{len(steps)}] {step['line']}: skipped, a command it waits for failed")
+                    elif step['status'] != 'running':
+                        elapsed = (datetime.now() - step['start_time']).total_seconds()
+                        print(f"[{number}/{len(steps)}] {step['line']}: {step['status']} in {elapsed:.1f}s")
+                sys.stdout.flush()
+                time.sleep(poll_interval)
+            # Metrics sent by the last commands before they exited
+            self.check_processes()
+            if metrics_path:
+                metrics.REGISTRY.export(metrics_path)
+        except Exception as e:
+            print(f"Error: {e}")
+            return 1
+        finally:
+            self.cleanup()
+
+        failed = [step for step in steps if step['status'] != 'completed']
+        print(f"\n{len(steps) - len(failed)} of {len(steps)} commands completed in "
+              f"{(datetime.now() - started).total_seconds():.1f}s")
+        return 1 if failed else 0
@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool, cpu_count
+from typing import List
+from analyzer import Pattern, PatternDetector
+from fetcher import StockDataFetcher
+import metrics
+
+OUTCOME_TARGET = 'target'
+OUTCOME_STOP = 'stop'
+OUTCOME_TIMEOUT = 'timeout'
+
+class PatternBacktester:
+    """
+    Replay detected patterns against the bars that follow them.
+    Each pattern is entered at the close of the bar that confirmed it and exited at
+    whichever comes first of its target price, its stop loss or the timeout.
+    """
+    def __init__(self, data: pd.DataFrame, horizon=20):
+        self.data = data
+        self.horizon = horizon
+
+        self.dates = pd.to_datetime(data['date']).to_numpy()
+        self.high = pd.to_numeric(data['high_price'], errors='coerce').to_numpy(dtype=float)
+        self.low = pd.to_numeric(data['low_price'], errors='coerce').to_numpy(dtype=float)
+        self.close = pd.to_numeric(data['close_price'], errors='coerce').to_numpy(dtype=float)
+
+    def run(self, patterns: List[Pattern]) -> pd.DataFrame:
+        """
+        Decide the outcome of every pattern with one first-passage search over a
+        (patterns x horizon) matrix of the following bars
+        """
+        if not patterns or len(self.dates) == 0:
+            return pd.DataFrame(columns=['pattern_type', 'start_time', 'end_time', 'entry_price',
+                                         'target_price', 'stop_loss', 'confidence', 'outcome',
+                                         'bars_held', 'return'])
+
+        end_times = np.array([pattern.end_time for pattern in patterns], dtype='datetime64[ns]')
+        target = np.array([pattern.target_price for pattern in patterns], dtype=float)
+        stop = np.array([pattern.stop_loss for pattern in patterns], dtype=float)
+
+        entry_index = np.searchsorted(self.dates, end_times)
+        entry_index = np.minimum(entry_index, len(self.dates) - 1)
+        entry_price = self.close[entry_index]
+        # Long when the target is above the entry, short otherwise
+        direction = np.where(target >= entry_price, 1.0, -1.0)
+
+        # Bars after the entry, out of range bars are masked as not reachable
+        index = entry_index[:, None] + 1 + np.arange(self.horizon)[None, :]
+        valid = index < len(self.dates)
+        index = np.minimum(index, len(self.dates) - 1)
+        high = self.high[index]
+        low = self.low[index]
+
+        long = direction[:, None] > 0
+        hit_target = valid & np.where(long, high >= target[:, None], low <= target[:, None])
+        hit_stop = valid & np.where(long, low <= stop[:, None], high >= stop[:, None])
+
+        never = self.horizon
+        first_target = np.where(hit_target.any(axis=1), hit_target.argmax(axis=1), never)
+        first_stop = np.where(hit_stop.any(axis=1), hit_stop.argmax(axis=1), never)
+
+        # A bar touching both levels is counted as a stop, we cannot tell which came first
+        outcome = np.full(len(patterns), OUTCOME_TIMEOUT, dtype=object)
+        outcome[first_target < first_stop] = OUTCOME_TARGET
+        outcome[(first_stop <= first_target) & (first_stop < never)] = OUTCOME_STOP
+
+        last_valid = valid.sum(axis=1) - 1
+        timeout_price = np.where(last_valid >= 0,
+                                 self.close[np.minimum(entry_index + 1 + np.maximum(last_valid, 0), len(self.dates) - 1)],
+                                 entry_price)
+        exit_price = np.select([outcome == OUTCOME_TARGET, outcome == OUTCOME_STOP],
+                               [target, stop], timeout_price)
+        bars_held = np.select([outcome == OUTCOME_TARGET, outcome == OUTCOME_STOP],
+                              [first_target + 1, first_stop + 1], last_valid + 1)
+
+        return pd.DataFrame({
+            'pattern_type': [pattern.pattern_type.value for pattern in patterns],
+            'start_time': [pattern.start_time for pattern in patterns],
+            'end_time': end_times,
+            'entry_price': entry_price,
+            'target_price': target,
+            'stop_loss': stop,
+            'confidence': [pattern.confidence for pattern in patterns],
+            'outcome': outcome,
+            'bars_held': bars_held,
+            'return': direction * (exit_price - entry_price) / entry_price,
+        })
+
+    @staticmethod
+    def summarize(results: pd.DataFrame) -> pd.DataFrame:
+        """
+        Win rate and expectancy (average return per trade) for each pattern type
+        """
+        if results.empty:
+            return pd.DataFrame(columns=['trades', 'wins', 'losses', 'timeouts',
+                                         'win_rate', 'avg_win', 'avg_loss', 'expectancy'])
+
+        grouped = results.groupby('pattern_type')
+        summary = pd.DataFrame({
+            'trades': grouped.size(),
+            'wins': grouped['outcome'].apply(lambda outcome: int((outcome == OUTCOME_TARGET).sum())),
+            'losses': grouped['outcome'].apply(lambda outcome: int((outcome == OUTCOME_STOP).sum())),
+            'timeouts': grouped['outcome'].apply(lambda outcome: int((outcome == OUTCOME_TIMEOUT).sum())),
+            'avg_win': grouped['return'].apply(lambda r: r[r > 0].mean() if (r > 0).any() else 0.0),
+            'avg_loss': grouped['return'].apply(lambda r: r[r <= 0].mean() if (r <= 0).any() else 0.0),
+            'expectancy': grouped['return'].mean(),
+        })
+        summary['win_rate'] = summary['wins'] / summary['trades']
+        return summary[['trades', 'wins', 'losses', 'timeouts', 'win_rate', 'avg_win', 'avg_loss', 'expectancy']]
+
+def backtest_stock(stock_no, db_config, period='D', horizon=20, lookback=40):
+    """
+    Detect and replay the patterns of one stock, runs inside a pool worker
+    """
+    try:
+        fetcher = StockDataFetcher(db_config, stock_no, None, None)
+        fetcher.connect_db()
+        data = fetcher.get_aggregated_data_from_db(period)
+        fetcher.disconnect_db()
+        if data.empty:
+            return None
+
+        patterns = PatternDetector(data, lookback=lookback).analyze()
+        results = PatternBacktester(data, horizon).run(patterns)
+        results.insert(0, 'stock_no', stock_no)
+        return results
+    except Exception as e:
+        print(f"Error backtesting stock {stock_no}: {e}")
+        return None
+    finally:
+        metrics.flush()
+
+def backtest_universe(stock_numbers, db_config, period='D', horizon=20, lookback=40, processes=None):
+    """
+    Backtest many stocks in a process pool and concatenate their trades
+    """
+    processes = processes or cpu_count()
+    args = [(stock_no, db_config, period, horizon, lookback) for stock_no in stock_numbers]
+    with Pool(processes=min(processes, max(len(args), 1)), initializer=metrics.set_sink,
+              initargs=(metrics.get_sink(),)) as pool:
+        results = [result for result in pool.starmap(backtest_stock, args, chunksize=4)
+                   if result is not None and not result.empty]
+    if not results:
+        return pd.DataFrame()
+    return pd.concat(results, ignore_index=True)
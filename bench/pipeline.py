@@ -0,0 +1,359 @@
+"""
+Timings of the data pipeline on synthetic stocks, recorded per commit.
+
+Run from the repository root:
+    python bench/pipeline.py [--scales 1,100,2000] [--stages ingest,aggregate,analyze,render] [--compare [REV]]
+
+Stages, each timed per stock:
+    ingest      update_stock_data against the local STOCK_DAY stand-in (bench/twse_server.py)
+    aggregate   weekly/monthly bars through get_aggregated_data_from_db, the daily query
+                and resample.py since there is no per-period SQL any more, and every
+                period resampled in memory from the daily arrays
+    analyze     StockPatternAnalyzer and RollingPatternAnalyzer
+    render      ChartRenderer.render_kline to PNG files
+
+ingest and the SQL aggregation need MySQL, they write to their own database
+(stock_data_bench by default) and are skipped when it cannot be reached.
+Every run is appended to .cache/bench/results.jsonl with the commit it ran on,
+--compare prints the change against the last run of another commit.
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import metrics
+from synthetic import universe, generate_prices
+from twse_server import start_server, parse_throttle
+
+RESULTS_PATH = os.path.join(ROOT, '.cache', 'bench', 'results.jsonl')
+STAGES = ('ingest', 'aggregate', 'analyze', 'render')
+
+BENCH_DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "",
+    "database": "stock_data_bench"
+}
+
+def git_revision():
+    """
+    Short commit hash of the tree, marked dirty when tracked files are modified
+    """
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return revision, bool(changes)
+
+def summarize(name, durations, **extra):
+    """
+    Result entry of one timed stage, latencies in milliseconds per stock
+    """
+    durations = np.asarray(durations, dtype=float)
+    total = float(durations.sum())
+    result = {
+        'stage': name,
+        'items': len(durations),
+        'seconds': total,
+        'p50_ms': float(np.percentile(durations, 50) * 1000) if len(durations) else 0.0,
+        'p99_ms': float(np.percentile(durations, 99) * 1000) if len(durations) else 0.0,
+        'per_second': len(durations) / total if total > 0 else 0.0,
+    }
+    result.update(extra)
+    # Pipeline stages timed by the code itself while this one ran
+    recorded = metrics.REGISTRY.drain()
+    if recorded:
+        result['counters'] = recorded['counters']
+        result['timed'] = {stage: {'count': state['count'], 'seconds': state['total']}
+                           for stage, state in recorded['histograms'].items()}
+    return result
+
+class BenchDatabase:
+    """
+    Connection to the benchmark database and the queries of the fetcher, None when
+    MySQL or the SQL files are not available
+    """
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.connection = None
+        self.queries = None
+        self.error = None
+
+    def open(self):
+        try:
+            import mysql.connector
+            from fetcher import StockDataFetcher
+            self.queries = StockDataFetcher(self.db_config, "", None, None).queries
+            server_config = {key: value for key, value in self.db_config.items() if key != 'database'}
+            self.connection = mysql.connector.connect(**server_config)
+            cursor = self.connection.cursor()
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.db_config['database']}")
+            cursor.execute(f"USE {self.db_config['database']}")
+            # The schema creates and selects stock_data, only its tables are used here
+            with open(os.path.join(ROOT, 'sql', 'schema.sql')) as f:
+                for statement in f.read().split(';'):
+                    if statement.strip() and not statement.strip().upper().startswith(('CREATE DATABASE', 'USE ')):
+                        cursor.execute(statement)
+            self.connection.commit()
+            cursor.close()
+            return True
+        except Exception as e:
+            self.error = str(e).splitlines()[0] if str(e) else type(e).__name__
+            return False
+
+    def fetcher(self, stock_no, start_date=None, end_date=None):
+        from fetcher import StockDataFetcher
+        fetcher = StockDataFetcher(self.db_config, stock_no, start_date, end_date)
+        fetcher.db_connection = self.connection
+        return fetcher
+
+    def clear(self, stocks):
+        cursor = self.connection.cursor()
+        cursor.executemany("DELETE FROM stock_prices WHERE stock_no = %s", [(stock_no,) for stock_no in stocks])
+        self.connection.commit()
+        cursor.close()
+
+    def load(self, stock_no, prices):
+        """
+        Bulk write of a synthetic history, not timed
+        """
+        rows = [(stock_no, row.date.date(), int(row.volume), int(row.turnover), float(row.open_price),
+                 float(row.high_price), float(row.low_price), float(row.close_price),
+                 f"{row.price_change:+.2f}", int(row.transaction_count))
+                for row in prices.itertuples(index=False)]
+        cursor = self.connection.cursor()
+        cursor.executemany(self.queries['basic']['Insert or update stock data'], rows)
+        self.connection.commit()
+        cursor.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+def bench_ingest(stocks, database, args):
+    """
+    Download of the last --ingest-months months of every stock from the local stand-in
+    """
+    end = datetime.strptime(args.end, '%Y-%m-%d')
+    start = (np.datetime64(args.end, 'M') - (args.ingest_months - 1)).astype(datetime)
+    max_requests, window = args.throttle if args.throttle else (None, 5.0)
+    server = start_server(stocks, args.start, args.end, max_requests=max_requests, window=window,
+                          latency=args.latency, seed=args.seed)
+    database.clear(stocks)
+    durations = []
+    rows = 0
+    try:
+        for stock_no in stocks:
+            fetcher = database.fetcher(stock_no, start, end)
+            fetcher.twse_url = server.url
+            fetcher.request_interval = args.request_interval
+            # The stand-in only plays TWSE, a miss must not fall back to yfinance
+            fetcher.fetch_tpex_data = lambda date_str: None
+            started = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                fetcher.update_stock_data()
+            durations.append(time.perf_counter() - started)
+            rows += fetcher.rows_written
+    finally:
+        server.shutdown()
+        server.server_close()
+    return summarize('ingest', durations, rows=rows, months=args.ingest_months,
+                     requests=server.served, throttled=server.throttled)
+
+# Periods resampled in memory, the SQL stage keeps weekly/monthly to compare with older runs
+NUMPY_PERIODS = (('W', 'weekly'), ('M', 'monthly'), ('Q', 'quarterly'), ('Y', 'yearly'), ('5D', '5day'))
+SQL_PERIODS = (('W', 'weekly'), ('M', 'monthly'))
+
+def bench_aggregate(stocks, database, args):
+    import pyramid
+    import resample
+    results = []
+    histories = {}
+    for stock_no in stocks:
+        histories[stock_no] = generate_prices(stock_no, args.start, args.end, args.seed)
+
+    for period, name in NUMPY_PERIODS:
+        durations = []
+        for stock_no, prices in histories.items():
+            started = time.perf_counter()
+            resample.resample(pyramid.to_arrays(prices), period)
+            durations.append(time.perf_counter() - started)
+        results.append(summarize(f'aggregate_{name}_numpy', durations))
+
+    if database.connection is None:
+        print(f"  aggregate (SQL) skipped: {database.error}")
+        return results
+
+    for stock_no, prices in histories.items():
+        database.load(stock_no, prices)
+    for period, name in SQL_PERIODS:
+        durations = []
+        rows = 0
+        for stock_no in stocks:
+            fetcher = database.fetcher(stock_no)
+            started = time.perf_counter()
+            rows += len(fetcher.get_aggregated_data_from_db(period))
+            durations.append(time.perf_counter() - started)
+        results.append(summarize(f'aggregate_{name}_sql', durations, rows=rows))
+    return results
+
+def bench_analyze(stocks, args):
+    from analyzer import StockPatternAnalyzer, RollingPatternAnalyzer
+    durations, rolling = [], []
+    for stock_no in stocks:
+        prices = generate_prices(stock_no, args.start, args.end, args.seed)
+        started = time.perf_counter()
+        StockPatternAnalyzer(prices, None, None).analyze()
+        durations.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        RollingPatternAnalyzer(prices, None, None, args.lookback).analyze()
+        rolling.append(time.perf_counter() - started)
+    return [summarize('analyze', durations), summarize('analyze_rolling', rolling, lookback=args.lookback)]
+
+def bench_render(stocks, args):
+    from plotter import ChartRenderer
+    if args.render_limit:
+        stocks = stocks[:args.render_limit]
+    renderer = ChartRenderer()
+    output_dir = tempfile.mkdtemp(prefix='bench-render-')
+    durations = []
+    try:
+        for stock_no in stocks:
+            prices = generate_prices(stock_no, args.start, args.end, args.seed)
+            started = time.perf_counter()
+            renderer.render_kline(prices, os.path.join(output_dir, f'{stock_no}.png'), title=stock_no)
+            durations.append(time.perf_counter() - started)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return [summarize('render', durations)]
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def baseline_run(runs, revision, compare):
+    """
+    Last run of the revision to compare with, by default the last one of another commit
+    """
+    for run in reversed(runs):
+        if compare == 'previous' and run['commit'] != revision:
+            return run
+        if compare != 'previous' and run['commit'].startswith(compare):
+            return run
+    return None
+
+def print_results(run, baseline=None):
+    print(f"\n{'Scale':>5} | {'Stage':<26} | {'Items':>5} | {'Total s':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'/s':>8}"
+          + (f" | vs {baseline['commit']}" if baseline else ''))
+    print("-" * (82 + (16 if baseline else 0)))
+    previous = {(result['scale'], result['stage']): result for result in baseline['results']} if baseline else {}
+    for result in run['results']:
+        line = (f"{result['scale']:>5} | {result['stage']:<26} | {result['items']:>5} | {result['seconds']:8.2f} | "
+                f"{result['p50_ms']:8.2f} | {result['p99_ms']:8.2f} | {result['per_second']:8.1f}")
+        before = previous.get((result['scale'], result['stage']))
+        if before and before['seconds'] > 0 and before['items'] == result['items']:
+            line += f" | {(result['seconds'] / before['seconds'] - 1) * 100:+.1f}%"
+        print(line)
+
+def parse_list(text):
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='1,100,2000', help="numbers of stocks, comma separated")
+    parser.add_argument('--stages', default=','.join(STAGES), help="stages to run, comma separated")
+    parser.add_argument('--start', default='2020-01-01', help="first day of the synthetic histories")
+    parser.add_argument('--end', default='2024-12-31', help="last day of the synthetic histories")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ingest-months', type=int, default=12, help="months downloaded per stock by ingest")
+    parser.add_argument('--request-interval', type=float, default=0.0,
+                        help="seconds the fetcher waits between requests, TWSE needs 3")
+    parser.add_argument('--throttle', type=parse_throttle,
+                        help="requests per seconds the stand-in allows, e.g. 3/5")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds the stand-in adds to every response")
+    parser.add_argument('--lookback', type=int, default=20, help="window of the rolling analyzer")
+    parser.add_argument('--render-limit', type=int, default=200, help="charts rendered per scale at most, 0 for all")
+    parser.add_argument('--db-host', default=BENCH_DB_CONFIG['host'])
+    parser.add_argument('--db-user', default=BENCH_DB_CONFIG['user'])
+    parser.add_argument('--db-password', default=BENCH_DB_CONFIG['password'])
+    parser.add_argument('--db-name', default=BENCH_DB_CONFIG['database'])
+    parser.add_argument('--output', default=RESULTS_PATH, help="results file, one JSON run per line")
+    parser.add_argument('--compare', nargs='?', const='previous',
+                        help="compare with the last run of a commit, by default the last other commit")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in parse_list(args.scales)]
+    stages = parse_list(args.stages)
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    revision, dirty = git_revision()
+    database = BenchDatabase({'host': args.db_host, 'user': args.db_user,
+                              'password': args.db_password, 'database': args.db_name})
+    if ('ingest' in stages or 'aggregate' in stages) and not database.open():
+        print(f"Database not available, ingest and SQL aggregation are skipped: {database.error}")
+
+    run = {
+        'commit': revision,
+        'dirty': dirty,
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        'range': [args.start, args.end],
+        'results': [],
+    }
+    print(f"Benchmark of {revision}{' (modified)' if dirty else ''}, {args.start} to {args.end}")
+    try:
+        for scale in scales:
+            stocks = universe(scale)
+            for stage in stages:
+                print(f"  {scale} stocks: {stage}")
+                sys.stdout.flush()
+                metrics.REGISTRY.reset()
+                if stage == 'ingest':
+                    if database.connection is None:
+                        print(f"  ingest skipped: {database.error}")
+                        continue
+                    results = [bench_ingest(stocks, database, args)]
+                elif stage == 'aggregate':
+                    results = bench_aggregate(stocks, database, args)
+                elif stage == 'analyze':
+                    results = bench_analyze(stocks, args)
+                else:
+                    results = bench_render(stocks, args)
+                for result in results:
+                    result['scale'] = scale
+                run['results'].extend(results)
+    finally:
+        database.close()
+
+    runs = load_results(args.output)
+    print_results(run, baseline_run(runs, revision, args.compare) if args.compare else None)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(run) + '\n')
+    print(f"\nResults appended to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
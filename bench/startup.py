@@ -0,0 +1,70 @@
+"""
+Cold-start regression check of the shell.
+
+Run from the repository root:
+    python bench/startup.py [--runs N] [--budget MS]
+
+Fails (exit code 1) when importing the shell pulls in a heavy library or when
+the median import time of app goes over the budget.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds `import app` may add on top of a bare interpreter start
+IMPORT_BUDGET_MS = 150
+
+# Only imported by the workers, never before the prompt is shown
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib', 'mplfinance', 'yfinance', 'mysql', 'requests', 'bs4']
+
+def run_python(code):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    return result.stdout, result.stderr
+
+def import_time_ms(stderr, module):
+    """
+    Cumulative import time of a top level module from the -X importtime report
+    """
+    for line in stderr.splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--budget', type=float, default=IMPORT_BUDGET_MS)
+    args = parser.parse_args()
+
+    code = f"import sys, json, app; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    times = []
+    loaded = []
+    for _ in range(args.runs):
+        stdout, stderr = run_python(code)
+        loaded = json.loads(stdout.strip().splitlines()[-1])
+        times.append(import_time_ms(stderr, 'app'))
+
+    median = statistics.median(times)
+    print(f"import app: median {median:.1f} ms, min {min(times):.1f} ms, max {max(times):.1f} ms "
+          f"over {args.runs} runs (budget {args.budget:.0f} ms)")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: heavy modules imported by the shell: {', '.join(loaded)}")
+        failed = True
+    if median > args.budget:
+        print(f"FAIL: import time over budget by {median - args.budget:.1f} ms")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Synthetic daily prices for benchmarks, in the layout of the stock_prices table.
+
+Every stock is a seeded random walk, so a stock number always gets the same bars
+and runs on different commits or machines see identical data.
+"""
+import zlib
+import numpy as np
+import pandas as pd
+
+FIRST_STOCK_NO = 1101
+
+# Columns of the STOCK_DAY JSON rows, in the order insert_data reads them
+STOCK_DAY_FIELDS = ["日期", "成交股數", "成交金額", "開盤價", "最高價", "最低價", "收盤價", "漲跌價差", "成交筆數"]
+
+def universe(count, first=FIRST_STOCK_NO):
+    """
+    count stock numbers, four digits like the listed TWSE stocks
+    """
+    return [str(first + index) for index in range(count)]
+
+def generate_prices(stock_no, start_date, end_date, seed=0):
+    """
+    Business day OHLCV bars of one stock between start_date and end_date, with the
+    columns of the fetcher frames plus turnover, price_change and transaction_count
+    """
+    dates = pd.bdate_range(start_date, end_date)
+    rng = np.random.default_rng([seed, zlib.crc32(stock_no.encode())])
+    count = len(dates)
+
+    first = rng.uniform(10, 500)
+    returns = rng.normal(0.0003, rng.uniform(0.01, 0.03), count)
+    close = first * np.exp(np.cumsum(returns))
+    open_ = np.concatenate(([first], close[:-1])) * np.exp(rng.normal(0, 0.004, count))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.008, count)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.008, count)))
+    volume = rng.lognormal(13, 0.8, count).astype(np.int64)
+
+    close = close.round(2)
+    return pd.DataFrame({
+        'date': dates,
+        'open_price': open_.round(2),
+        'high_price': high.round(2),
+        'low_price': low.round(2),
+        'close_price': close,
+        'volume': volume,
+        'turnover': (volume * close).astype(np.int64),
+        'price_change': np.diff(close, prepend=first).round(2),
+        'transaction_count': np.maximum(volume // 1000, 1),
+    })
+
+def stock_day_rows(prices, year, month):
+    """
+    Rows of one month as the STOCK_DAY endpoint returns them: R.O.C. dates and
+    numbers as strings with thousands separators
+    """
+    dates = prices['date']
+    month_prices = prices[(dates.dt.year == year) & (dates.dt.month == month)]
+    rows = []
+    for row in month_prices.itertuples(index=False):
+        rows.append([
+            f"{row.date.year - 1911}/{row.date.month:02d}/{row.date.day:02d}",
+            f"{row.volume:,}",
+            f"{row.turnover:,}",
+            f"{row.open_price:,.2f}",
+            f"{row.high_price:,.2f}",
+            f"{row.low_price:,.2f}",
+            f"{row.close_price:,.2f}",
+            f"{row.price_change:+.2f}",
+            f"{row.transaction_count:,}",
+        ])
+    return rows
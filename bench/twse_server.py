@@ -0,0 +1,246 @@
+"""
+Local stand-in of the TWSE STOCK_DAY endpoint serving synthetic prices, and of
+the MIS quote endpoint serving a synthetic trading session.
+
+Run from the repository root:
+    python bench/twse_server.py [--port 8765] [--stocks 100] [--throttle 3/5]
+
+and point the fetcher at it:
+    TWSE_URL=http://127.0.0.1:8765/exchangeReport/STOCK_DAY TWSE_REQUEST_INTERVAL=0 python main.py -c "update 1101"
+
+and the intraday watcher at the quotes, where every poll moves the session clock
+forward by --tick-seconds until the close:
+    TWSE_MIS_URL=http://127.0.0.1:8765/stock/api/getStockInfo.jsp python main.py -c "watch 1101 --interval 0.2"
+
+Like TWSE, a client polling faster than the throttle allows gets an HTML page
+instead of JSON.
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+import zlib
+from datetime import date, datetime, timedelta
+import numpy as np
+from collections import OrderedDict, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from synthetic import universe, generate_prices, stock_day_rows, STOCK_DAY_FIELDS
+
+STOCK_DAY_PATH = '/exchangeReport/STOCK_DAY'
+MIS_PATH = '/stock/api/getStockInfo.jsp'
+SESSION_OPEN = '09:00:00'
+SESSION_CLOSE = '13:30:00'
+NO_DATA = "很抱歉，沒有符合條件的資料!"
+BLOCKED_PAGE = "<html><body>您的請求過於頻繁，請稍後再試</body></html>"
+
+# Price histories kept generated, one per stock being ingested is enough
+CACHED_STOCKS = 256
+
+class StockDayHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path not in (STOCK_DAY_PATH, MIS_PATH):
+            self.send_error(404)
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.server.allow(self.client_address[0]):
+            self.reply(BLOCKED_PAGE.encode(), 'text/html; charset=utf-8')
+            return
+
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == MIS_PATH:
+            body = self.server.quotes(params.get('ex_ch', ''))
+        else:
+            body = self.server.stock_day(params.get('stockNo', ''), params.get('date', ''))
+        self.reply(json.dumps(body, ensure_ascii=False).encode(), 'application/json; charset=utf-8')
+
+    def reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StockDayServer(ThreadingHTTPServer):
+    """
+    stocks: stock numbers with data, the others answer with no data like unknown stocks do
+    max_requests/window: requests a client may send per window seconds, None for no throttling
+    latency: seconds added to every response
+    tick_seconds: session time that passes between two quote polls of a stock
+    session_date: day of the quotes, today by default
+    """
+    daemon_threads = True
+
+    def __init__(self, address, stocks, start_date, end_date, max_requests=None, window=5.0, latency=0.0, seed=0,
+                 tick_seconds=60, session_date=None):
+        super().__init__(address, StockDayHandler)
+        self.stocks = set(stocks)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.max_requests = max_requests
+        self.window = window
+        self.latency = latency
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.prices = OrderedDict()
+        self.recent = defaultdict(deque)
+        self.served = 0
+        self.throttled = 0
+        self.tick_seconds = tick_seconds
+        self.session_date = session_date or date.today().strftime('%Y%m%d')
+        self.sessions = {}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{STOCK_DAY_PATH}"
+
+    def allow(self, client):
+        """
+        Sliding window rate limit per client address
+        """
+        with self.lock:
+            if self.max_requests is None:
+                self.served += 1
+                return True
+            now = time.monotonic()
+            recent = self.recent[client]
+            while recent and recent[0] <= now - self.window:
+                recent.popleft()
+            if len(recent) >= self.max_requests:
+                self.throttled += 1
+                return False
+            recent.append(now)
+            self.served += 1
+            return True
+
+    def stock_day(self, stock_no, date_str):
+        """
+        JSON body of one month of a stock
+        """
+        if stock_no not in self.stocks or len(date_str) != 8 or not date_str.isdigit():
+            return {'stat': NO_DATA}
+        year, month = int(date_str[:4]), int(date_str[4:6])
+        rows = stock_day_rows(self.history(stock_no), year, month)
+        if not rows:
+            return {'stat': NO_DATA}
+        return {
+            'stat': 'OK',
+            'date': date_str,
+            'title': f"{year - 1911}年{month:02d}月 {stock_no} 各日成交資訊",
+            'fields': STOCK_DAY_FIELDS,
+            'data': rows,
+            'notes': [],
+        }
+
+    def quotes(self, channels):
+        """
+        MIS body with the next quote of every listed stock in 'tse_1101.tw|tse_1102.tw',
+        the synthetic stocks are all listed and their otc_ channels get no quote
+        """
+        quotes = []
+        for channel in channels.split('|'):
+            market, _, name = channel.partition('_')
+            stock_no = name.partition('.')[0]
+            if market == 'tse' and stock_no in self.stocks:
+                quotes.append(self.next_quote(stock_no))
+        return {'msgArray': quotes, 'rtcode': '0000', 'rtmessage': 'OK'}
+
+    def next_quote(self, stock_no):
+        """
+        Advance the session of a stock by one tick, a random walk from the last
+        synthetic close that stops at the close
+        """
+        with self.lock:
+            session = self.sessions.get(stock_no)
+        if session is None:
+            previous = float(self.history(stock_no)['close_price'].iloc[-1])
+            session = {'rng': np.random.default_rng([self.seed, zlib.crc32(stock_no.encode()), 1]),
+                       'step': 0, 'previous': previous, 'price': previous, 'volume': 0,
+                       'open': None, 'high': None, 'low': None, 'clock': None}
+        with self.lock:
+            session = self.sessions.setdefault(stock_no, session)
+            opened = datetime.strptime(f"{self.session_date} {SESSION_OPEN}", '%Y%m%d %H:%M:%S')
+            close = datetime.strptime(f"{self.session_date} {SESSION_CLOSE}", '%Y%m%d %H:%M:%S')
+            # After the last trade at the close the quote does not change any more
+            if session['clock'] is None or session['clock'] < close:
+                session['clock'] = min(opened + timedelta(seconds=session['step'] * self.tick_seconds), close)
+                session['step'] += 1
+                price = round(session['price'] * float(np.exp(session['rng'].normal(0, 0.003))), 2)
+                session['price'] = price
+                session['volume'] += int(session['rng'].lognormal(3, 1))
+                session['open'] = session['open'] or price
+                session['high'] = max(session['high'] or price, price)
+                session['low'] = min(session['low'] or price, price)
+            return {
+                'c': stock_no, 'n': stock_no, 'ch': f"{stock_no}.tw", 'ex': 'tse',
+                'z': f"{session['price']:.2f}", 'v': str(session['volume']),
+                'o': f"{session['open']:.2f}", 'h': f"{session['high']:.2f}", 'l': f"{session['low']:.2f}",
+                'y': f"{session['previous']:.2f}", 'd': self.session_date,
+                't': session['clock'].strftime('%H:%M:%S'),
+                'tlong': str(int(session['clock'].timestamp() * 1000)),
+            }
+
+    def history(self, stock_no):
+        with self.lock:
+            if stock_no in self.prices:
+                self.prices.move_to_end(stock_no)
+                return self.prices[stock_no]
+        prices = generate_prices(stock_no, self.start_date, self.end_date, self.seed)
+        with self.lock:
+            self.prices[stock_no] = prices
+            while len(self.prices) > CACHED_STOCKS:
+                self.prices.popitem(last=False)
+        return prices
+
+def start_server(stocks, start_date, end_date, port=0, **options):
+    """
+    Serve in a background thread, port 0 picks a free one. Stop with server.shutdown().
+    """
+    server = StockDayServer(('127.0.0.1', port), stocks, start_date, end_date, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_throttle(text):
+    """
+    'N/S' as N requests per S seconds
+    """
+    count, _, seconds = text.partition('/')
+    return int(count), float(seconds or 5)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--stocks', type=int, default=100, help="number of stocks with data, from 1101 up")
+    parser.add_argument('--start', default='2020-01-01')
+    parser.add_argument('--end', default='2024-12-31')
+    parser.add_argument('--throttle', type=parse_throttle, help="requests per seconds allowed, e.g. 3/5")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--tick-seconds', type=int, default=60, help="session seconds between two quote polls")
+    parser.add_argument('--session-date', help="YYYYMMDD of the quotes, today by default")
+    args = parser.parse_args()
+
+    max_requests, window = args.throttle if args.throttle else (None, 5.0)
+    server = StockDayServer(('127.0.0.1', args.port), universe(args.stocks), args.start, args.end,
+                            max_requests=max_requests, window=window, latency=args.latency,
+                            tick_seconds=args.tick_seconds, session_date=args.session_date)
+    host, port = server.server_address[:2]
+    print(f"Serving {args.stocks} synthetic stocks from {args.start} to {args.end} at {server.url}")
+    print(f"Quotes of the session {server.session_date} at http://{host}:{port}{MIS_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{server.served} requests served, {server.throttled} throttled")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
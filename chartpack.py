@@ -0,0 +1,98 @@
+import os
+import shutil
+import mysql.connector
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from fetcher import StockDataFetcher
+from plotter import ChartRenderer, ChartCache
+from pyramid import PyramidCache
+from resample import resample_frame, period_text
+import metrics
+
+OUTPUT_DIR = 'charts'
+
+# Created once per pool worker by _init_worker
+_renderer = None
+_connection = None
+# (stock_no, last update, daily frame) of the last stock rendered by this worker
+_daily = None
+
+def _init_worker(db_config, metrics_sink=None):
+    global _renderer, _connection
+    metrics.set_sink(metrics_sink)
+    _renderer = ChartRenderer()
+    _connection = mysql.connector.connect(**db_config)
+
+def _chart_text(period):
+    return 'Income' if period == 'I' else period_text(period)
+
+def _daily_data(fetcher, last_update):
+    """
+    Daily prices of the fetcher's stock, kept for the next job: the periods of
+    a stock come in one chunk, so they are all resampled from a single fetch
+    """
+    global _daily
+    if _daily is None or _daily[:2] != (fetcher.stock_no, last_update):
+        _daily = (fetcher.stock_no, last_update, fetcher.get_aggregated_data_from_db('D'))
+    return _daily[2]
+
+def _render_job(job):
+    """
+    Render one stock and period with the renderer and connection of this worker
+    """
+    stock_no, period, db_config, output_dir, image_format, start_date, end_date = job
+    global _connection
+    try:
+        if not _connection.is_connected():
+            _connection = mysql.connector.connect(**db_config)
+        fetcher = StockDataFetcher(db_config, stock_no, start_date, end_date)
+        fetcher.db_connection = _connection
+
+        save_path = os.path.join(output_dir, f"{stock_no}_{period}.{image_format}")
+        last_update = fetcher.get_last_income_update() if period == 'I' else fetcher.get_last_update_date()
+        if last_update is None:
+            return stock_no, period, None
+
+        # Unchanged stocks are copied from the chart cache instead of rendered again
+        cache = ChartCache()
+        key = ChartCache.key(stock_no, period, start_date, end_date, None, last_update, image_format)
+        cached = cache.get(key, image_format)
+        if cached is None:
+            if period == 'I':
+                data = fetcher.get_income_data_from_db()
+                render = lambda target: _renderer.render_income(data, target, title=f'Monthly Income Chart - {stock_no}')
+            else:
+                data = resample_frame(_daily_data(fetcher, last_update), period)
+                render = lambda target: _renderer.render_kline(
+                    data, target, start_date, end_date,
+                    title=f'{_chart_text(period)} K-Line Chart - {stock_no}',
+                    pyramid=PyramidCache().get(stock_no, period, data))
+            if data.empty:
+                return stock_no, period, None
+            cached = cache.fetch(key, render, image_format)
+
+        shutil.copyfile(cached, save_path)
+        return stock_no, period, save_path
+    except Exception as e:
+        print(f"Error rendering {stock_no} ({_chart_text(period)}): {e}")
+        return stock_no, period, None
+    finally:
+        metrics.flush()
+
+def render_chart_pack(stock_numbers, periods, db_config, output_dir=None, image_format='png',
+                      start_date=None, end_date=None, processes=None):
+    """
+    Render the charts of many stocks and periods to image files in a process pool.
+    Returns the output directory and a list of (stock_no, period, path or None).
+    """
+    output_dir = output_dir or os.path.join(OUTPUT_DIR, datetime.now().strftime('%Y-%m-%d'))
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = [(stock_no, period, db_config, output_dir, image_format, start_date, end_date)
+            for stock_no in stock_numbers for period in periods]
+    processes = min(processes or cpu_count(), max(len(jobs), 1))
+    with Pool(processes=processes, initializer=_init_worker,
+              initargs=(db_config, metrics.get_sink())) as pool:
+        # One chunk per stock, see _daily_data
+        results = list(pool.imap_unordered(_render_job, jobs, chunksize=max(len(periods), 1)))
+    return output_dir, results
@@ -0,0 +1,141 @@
+import os
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from panel import PricePanel
+
+OUTPUT_DIR = 'correlation'
+
+# Opened once per pool worker by _init_worker
+_returns = None
+_results = None
+
+def _init_worker(path):
+    global _returns, _results
+    _returns = np.load(os.path.join(path, 'returns.npy'), mmap_mode='r')
+    _results = {
+        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r+')
+        for name in ('corr', 'beta', 'nobs')
+    }
+
+def _block_statistics(x, y, min_periods):
+    """
+    Pairwise correlation, beta of x on y and overlap count between the rows of x and y.
+    Every pair only uses the days both stocks traded: the sums are masked
+    matrix products, so a block costs a handful of BLAS calls.
+    """
+    x_mask = ~np.isnan(x)
+    y_mask = ~np.isnan(y)
+    x_value = np.where(x_mask, x, 0.0)
+    y_value = np.where(y_mask, y, 0.0)
+    x_mask = x_mask.astype(np.float64)
+    y_mask = y_mask.astype(np.float64)
+
+    n = x_mask @ y_mask.T
+    sum_x = x_value @ y_mask.T
+    sum_y = x_mask @ y_value.T
+    sum_xx = (x_value * x_value) @ y_mask.T
+    sum_yy = x_mask @ (y_value * y_value).T
+    sum_xy = x_value @ y_value.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = n * sum_xy - sum_x * sum_y
+        variance_x = n * sum_xx - sum_x * sum_x
+        variance_y = n * sum_yy - sum_y * sum_y
+        corr = covariance / np.sqrt(variance_x * variance_y)
+        beta = covariance / variance_y
+
+    too_short = n < min_periods
+    corr[too_short] = np.nan
+    beta[too_short] = np.nan
+    return corr, beta, n
+
+def _run_block(task):
+    """
+    Compute one (row block, column block) pair and write it and its mirror to the result files
+    """
+    row_start, row_end, column_start, column_end, min_periods = task
+    x = np.asarray(_returns[row_start:row_end], dtype=np.float64)
+    y = np.asarray(_returns[column_start:column_end], dtype=np.float64)
+    corr, beta, n = _block_statistics(x, y, min_periods)
+
+    _results['corr'][row_start:row_end, column_start:column_end] = corr
+    _results['beta'][row_start:row_end, column_start:column_end] = beta
+    _results['nobs'][row_start:row_end, column_start:column_end] = n
+    if row_start != column_start:
+        # Correlation is symmetric, beta of y on x uses the variance of x instead
+        _, beta_t, _ = _block_statistics(y, x, min_periods)
+        _results['corr'][column_start:column_end, row_start:row_end] = corr.T
+        _results['beta'][column_start:column_end, row_start:row_end] = beta_t
+        _results['nobs'][column_start:column_end, row_start:row_end] = n.T
+    for result in _results.values():
+        result.flush()
+    return row_end - row_start, column_end - column_start
+
+class CorrelationMatrix:
+    """
+    Pairwise return correlation and beta of every stock in the panel.
+    The returns are written once to disk and memory mapped by the pool workers,
+    which each fill (block_size x block_size) tiles of the float32 result files,
+    so the memory used does not grow with the size of the universe.
+    """
+    def __init__(self, output_dir=OUTPUT_DIR, block_size=256, min_periods=60, processes=None):
+        self.output_dir = output_dir
+        self.block_size = block_size
+        self.min_periods = min_periods
+        self.processes = processes or cpu_count()
+
+    def compute(self, panel: PricePanel):
+        os.makedirs(self.output_dir, exist_ok=True)
+        returns = panel.returns('close').astype(np.float32, copy=False)
+        count = returns.shape[0]
+
+        np.save(os.path.join(self.output_dir, 'symbols.npy'), panel.symbols.astype(str))
+        np.save(os.path.join(self.output_dir, 'returns.npy'), returns)
+        for name, dtype in (('corr', np.float32), ('beta', np.float32), ('nobs', np.int32)):
+            result = np.lib.format.open_memmap(os.path.join(self.output_dir, f'{name}.npy'),
+                                               mode='w+', dtype=dtype, shape=(count, count))
+            del result
+
+        # Upper triangle of the block grid, the workers mirror the lower one
+        starts = range(0, count, self.block_size)
+        tasks = [(i, min(i + self.block_size, count), j, min(j + self.block_size, count), self.min_periods)
+                 for i in starts for j in starts if j >= i]
+        with Pool(processes=min(self.processes, max(len(tasks), 1)),
+                  initializer=_init_worker, initargs=(self.output_dir,)) as pool:
+            for _ in pool.imap_unordered(_run_block, tasks):
+                pass
+
+        os.remove(os.path.join(self.output_dir, 'returns.npy'))
+        return self.load(self.output_dir)
+
+    @staticmethod
+    def load(path=OUTPUT_DIR):
+        """
+        Open a computed result, the matrices are memory mapped
+        """
+        return {
+            'symbols': np.load(os.path.join(path, 'symbols.npy')),
+            'corr': np.load(os.path.join(path, 'corr.npy'), mmap_mode='r'),
+            'beta': np.load(os.path.join(path, 'beta.npy'), mmap_mode='r'),
+            'nobs': np.load(os.path.join(path, 'nobs.npy'), mmap_mode='r'),
+        }
+
+    @staticmethod
+    def top_pairs(result, count=10, block_size=256):
+        """
+        Most correlated distinct pairs, scanned block by block
+        """
+        corr = result['corr']
+        candidates = []
+        for start in range(0, corr.shape[0], block_size):
+            block = np.array(corr[start:start + block_size], dtype=np.float64)
+            rows, columns = np.indices(block.shape)
+            rows += start
+            # Keep each pair once and drop the diagonal
+            block[columns <= rows] = np.nan
+            flat = np.where(np.isnan(block), -np.inf, block).ravel()
+            best = np.argpartition(flat, -min(count, len(flat)))[-count:]
+            candidates.extend((flat[i], rows.ravel()[i], columns.ravel()[i]) for i in best if np.isfinite(flat[i]))
+        candidates.sort(reverse=True)
+        symbols = result['symbols']
+        return [(symbols[i], symbols[j], value) for value, i, j in candidates[:count]]
@@ -4,11 +4,23 @@ import requests
 import time
 from datetime import datetime, timedelta
 import os
+import sys
 import yfinance as yf
+import metrics
+from resample import resample_frame
 
 class SQLLoader:
+    # Queries already read in this process, keyed by filename
+    _cache = {}
+
     @staticmethod
     def load_query(filename):
+        if filename not in SQLLoader._cache:
+            SQLLoader._cache[filename] = SQLLoader._read_query(filename)
+        return SQLLoader._cache[filename]
+
+    @staticmethod
+    def _read_query(filename):
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         file_path = os.path.join(base_dir, 'stock', 'sql', 'queries', filename)
         
@@ -38,17 +50,24 @@ class StockDataFetcher:
         self.start_date = start_date
         self.end_date = end_date
         self.db_connection = None
-        self.twse_url = "https://www.twse.com.tw/exchangeReport/STOCK_DAY"
+        # Overridable to ingest from a local stand-in of the exchange, see bench/twse_server.py
+        self.twse_url = os.environ.get('TWSE_URL', "https://www.twse.com.tw/exchangeReport/STOCK_DAY")
         self.tpex_url = "https://www.tpex.org.tw/web/stock/aftertrading/daily_trading_info/st43_result.php"
         self.mops_url = "https://mops.twse.com.tw/mops/web/t05st10_ifrs"  # 營收資料的URL
+        # Seconds between two monthly requests, TWSE blocks clients polling faster
+        self.request_interval = float(os.environ.get('TWSE_REQUEST_INTERVAL', 3))
+
+        # Called with the progress counters of update_stock_data
+        self.progress_callback = None
+        self.months_fetched = 0
+        self.rows_written = 0
         
         # Load SQL queries
         try:
             self.queries = {
                 'basic': SQLLoader.load_query('basic.sql'),
-                'monthly': SQLLoader.load_query('monthly.sql'),
-                'weekly': SQLLoader.load_query('weekly.sql'),
-                'income': SQLLoader.load_query('income.sql')
+                'income': SQLLoader.load_query('income.sql'),
+                'analysis': SQLLoader.load_query('analysis.sql')
             }
         except Exception as e:
             print(f"Error loading SQL queries: {e}")
@@ -117,11 +136,15 @@ class StockDataFetcher:
         }
         
         try:
-            response = requests.get(self.twse_url, params=params)
+            with metrics.timed('http'):
+                response = requests.get(self.twse_url, params=params)
+            metrics.count('http_requests')
             if response.status_code != 200:
+                metrics.count('http_errors')
                 return None
             
-            data = response.json()
+            with metrics.timed('decode'):
+                data = response.json()
             if data.get('stat') != 'OK':
                 return None
                 
@@ -186,6 +209,17 @@ class StockDataFetcher:
         cursor.close()
         return last_date
 
+    def get_data_version(self):
+        """
+        Version of the stock's prices from its last bar and its number of bars, unlike
+        the last update date it changes when the bar of the day is written again
+        """
+        cursor = self.db_connection.cursor()
+        cursor.execute(self.queries['basic']['Get data version'], (self.stock_no, self.stock_no))
+        row = cursor.fetchone()
+        cursor.close()
+        return None if row is None else ':'.join(str(value) for value in row)
+
     def update_stock_data(self):
         """
         Download and update data
@@ -210,7 +244,7 @@ class StockDataFetcher:
                 monthly_data = self.fetch_stock_data(date_str)
                 if monthly_data:
                     try:
-                        self.insert_data(monthly_data)
+                        self.rows_written += self.insert_data(monthly_data)
                         print(f"Successfully inserted data for {self.stock_no} - {date_str}")
                     except Exception as e:
                         print(f"Error inserting data: {e}")
@@ -218,8 +252,13 @@ class StockDataFetcher:
                     print(f"No data available for {self.stock_no} in {date_str}")
             except Exception as e:
                 print(f"Error fetching data: {e}")
+
+            self.months_fetched += 1
+            if self.progress_callback:
+                self.progress_callback(months=self.months_fetched, rows=self.rows_written, month=date_str)
             
-            time.sleep(3)
+            with metrics.timed('throttle'):
+                time.sleep(self.request_interval)
             current_date = (first_day + timedelta(days=32)).replace(day=1)
 
     def disconnect_db(self):
@@ -229,12 +268,16 @@ class StockDataFetcher:
 
     def insert_data(self, records):
         """
-        Insert data to SQL
+        Insert data to SQL, returns the number of rows written
         """
         cursor = self.db_connection.cursor()
+        written = 0
+        # Parsing and writing alternate per record, their times are summed up per call
+        decode_seconds = write_seconds = 0.0
         
         for record in records:
             try:
+                started = time.perf_counter()
                 # Convert R.O.C. to A.D.
                 date_parts = record[0].split('/')
                 year = int(date_parts[0]) + 1911
@@ -250,17 +293,27 @@ class StockDataFetcher:
                 close_price = float(record[6].replace(",", "")) if record[6] != "--" else None
                 price_change = record[7]
                 transaction_count = int(record[8].replace(",", ""))
+                parsed = time.perf_counter()
+                decode_seconds += parsed - started
 
                 cursor.execute(self.queries['basic']['Insert or update stock data'], 
                              (self.stock_no, date, volume, turnover, open_price, high_price,
                               low_price, close_price, price_change, transaction_count))
+                write_seconds += time.perf_counter() - parsed
+                written += 1
                 
             except Exception as e:
                 print(f"Error processing record {record}: {e}")
+                metrics.count('record_errors')
                 continue
 
+        started = time.perf_counter()
         self.db_connection.commit()
         cursor.close()
+        metrics.observe('decode', decode_seconds)
+        metrics.observe('db_write', write_seconds + time.perf_counter() - started)
+        metrics.count('rows_written', written)
+        return written
 
     def get_data_from_db(self):
         cursor = self.db_connection.cursor(dictionary=True)
@@ -272,25 +325,86 @@ class StockDataFetcher:
         return df
 
     def get_aggregated_data_from_db(self, period='D'):
+        """
+        Bars of any period (see resample.py) built from one scan of the daily rows
+        """
+        with metrics.timed('query'):
+            data = self._get_daily_data_from_db()
+        return resample_frame(data, period)
+
+    def _get_daily_data_from_db(self):
         cursor = self.db_connection.cursor(dictionary=True)
-        
-        if period == 'D':
-            cursor.execute(self.queries['basic']['Get daily data'], 
-                         (self.stock_no,))
-        elif period == 'M':
-            cursor.execute(self.queries['monthly'], 
-                         (self.stock_no, self.stock_no, self.stock_no))
-        else:  # Weekly
-            cursor.execute(self.queries['weekly'], 
-                         (self.stock_no, self.stock_no, self.stock_no, self.stock_no))
-        
+        cursor.execute(self.queries['basic']['Get daily data'], (self.stock_no,))
         data = cursor.fetchall()
         cursor.close()
+        metrics.count('rows_read', len(data))
         df = pd.DataFrame(data)
         if not df.empty:
             df['date'] = pd.to_datetime(df['date'])
         return df
 
+    def _stream(self, query, params, chunk_size=1000):
+        """
+        Rows of a query read through an unbuffered cursor, chunk_size rows at a time,
+        so the result is never held in memory as a whole
+        """
+        cursor = self.db_connection.cursor(buffered=False)
+        try:
+            with metrics.timed('query'):
+                cursor.execute(query, params)
+            while True:
+                started = time.perf_counter()
+                rows = cursor.fetchmany(chunk_size)
+                metrics.observe('query', time.perf_counter() - started)
+                if not rows:
+                    break
+                metrics.count('rows_read', len(rows))
+                yield from rows
+        finally:
+            # A reader that stops early leaves rows on the wire, drop them
+            if self.db_connection.unread_result:
+                self.db_connection.consume_results()
+            cursor.close()
+
+    def stream_daily_data(self, start_date=None, end_date=None, limit=None, before=None, chunk_size=1000):
+        """
+        Daily rows of the stock from the newest to the oldest as
+        (date, open, high, low, close, volume) tuples.
+        limit: rows to read, None streams the whole range
+        before: keyset cursor, only the rows older than this date are read, the last
+        date of the previous page continues a listing
+        The rows are read with a date range over the (stock_no, date) index, so every
+        page costs the same however deep it is.
+        """
+        start = start_date.date() if isinstance(start_date, datetime) else start_date or datetime(1900, 1, 1).date()
+        end = end_date.date() if isinstance(end_date, datetime) else end_date or datetime.now().date()
+        upper = end + timedelta(days=1)
+        if before is not None:
+            upper = min(upper, before.date() if isinstance(before, datetime) else before)
+
+        yield from self._stream(self.queries['basic']['Get daily page'],
+                                (self.stock_no, start, upper, limit or sys.maxsize), chunk_size)
+
+    def stream_stock_summaries(self, limit=None, after='', chunk_size=500):
+        """
+        (stock_no, first date, last date, records, min price, max price) of every stock,
+        read in chunks of stocks seeked by stock number, limit=None streams all of them
+        after: keyset cursor, only the stocks numbered after it are read, the last stock
+        of the previous page continues a listing
+        """
+        after = after or ''
+        remaining = limit or sys.maxsize
+        while remaining > 0:
+            count = 0
+            for row in self._stream(self.queries['basic']['List stocks summary page'],
+                                    (after, min(chunk_size, remaining))):
+                count += 1
+                after = row[0]
+                yield row
+            remaining -= count
+            if count < chunk_size:
+                break
+
     def fetch_income_data(self, year, month):
         """
         Fetch income data from yfinance
@@ -373,8 +487,9 @@ class StockDataFetcher:
         Fetch the data from database
         """
         cursor = self.db_connection.cursor(dictionary=True)
-        cursor.execute(self.queries['income']['Get monthly income data'], (self.stock_no,))
-        data = cursor.fetchall()
+        with metrics.timed('query'):
+            cursor.execute(self.queries['income']['Get monthly income data'], (self.stock_no,))
+            data = cursor.fetchall()
         cursor.close()
         df = pd.DataFrame(data)
         if not df.empty:
@@ -0,0 +1,232 @@
+import os
+import numpy as np
+import pandas as pd
+import mysql.connector
+from fetcher import SQLLoader
+
+CACHE_DIR = os.path.join('.cache', 'fundamentals')
+
+# Columns added to the price bars by the as-of join
+INCOME_FIELDS = ('income_date', 'revenue', 'profit', 'margin', 'revenue_change')
+
+# Monthly revenue is published by the 10th of the next month, a report is
+# only known to the prices from then on
+PUBLICATION_DAY = 10
+
+# Stock and day packed into one sortable key, days are shifted to be positive
+GROUP_SPAN = 1 << 32
+DAY_OFFSET = 1 << 31
+
+def _day_numbers(dates):
+    return np.asarray(pd.to_datetime(dates), dtype='datetime64[D]').astype(np.int64) + DAY_OFFSET
+
+def publication_dates(income_dates, publication_day=PUBLICATION_DAY):
+    """
+    Day on which each monthly report is known: the publication_day of the month after it
+    """
+    months = np.asarray(pd.to_datetime(income_dates), dtype='datetime64[M]')
+    return (months + 1).astype('datetime64[D]') + (publication_day - 1)
+
+def asof_indexes(dates, income_dates, groups=None, income_groups=None):
+    """
+    Index of the latest income row dated on or before every price date, -1 where there is none.
+    The income rows are sorted by date, or by group then date when groups (integer stock codes)
+    are given, and a price only matches the income of its own group.
+    The prices need no order, all of them are matched with one searchsorted.
+    """
+    left = _day_numbers(dates)
+    right = _day_numbers(income_dates)
+    if groups is not None:
+        groups = np.asarray(groups, dtype=np.int64)
+        income_groups = np.asarray(income_groups, dtype=np.int64)
+        left = groups * GROUP_SPAN + left
+        right = income_groups * GROUP_SPAN + right
+    index = np.searchsorted(right, left, side='right') - 1
+    if groups is not None:
+        # The row found may be the last one of the stock before
+        found = index >= 0
+        found[found] = income_groups[index[found]] == groups[found]
+        index[~found] = -1
+    return index
+
+def _income_arrays(income: pd.DataFrame):
+    """
+    Date, revenue, profit, margin and revenue change against the previous report of an income frame
+    """
+    dates = pd.to_datetime(income['date']).to_numpy(dtype='datetime64[ns]')
+    revenue = pd.to_numeric(income['revenue'], errors='coerce').to_numpy(dtype=float)
+    profit = pd.to_numeric(income['profit'], errors='coerce').to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin = np.where(revenue != 0, profit / revenue, np.nan)
+        change = np.full(len(revenue), np.nan)
+        change[1:] = revenue[1:] / revenue[:-1] - 1.0
+    change[~np.isfinite(change)] = np.nan
+    return {'income_date': dates, 'revenue': revenue, 'profit': profit, 'margin': margin, 'revenue_change': change}
+
+def _take(values, index):
+    """
+    values[index] with NaN/NaT where index is -1
+    """
+    missing = np.datetime64('NaT') if values.dtype.kind == 'M' else np.nan
+    if len(values) == 0:
+        return np.full(len(index), missing, dtype=values.dtype)
+    taken = values[np.maximum(index, 0)]
+    taken[index < 0] = missing
+    return taken
+
+def join_income(prices: pd.DataFrame, income: pd.DataFrame, publication_day=PUBLICATION_DAY) -> pd.DataFrame:
+    """
+    Price bars of one stock with the latest income known on every bar.
+    An income row counts as known from its publication date on (see publication_dates),
+    bars before the first one get NaN.
+    """
+    result = prices.reset_index(drop=True).copy()
+    if income is None or income.empty:
+        for field in INCOME_FIELDS:
+            result[field] = pd.NaT if field == 'income_date' else np.nan
+        return result
+    income = income.sort_values('date')
+    arrays = _income_arrays(income)
+    index = asof_indexes(result['date'], publication_dates(arrays['income_date'], publication_day))
+    for field in INCOME_FIELDS:
+        result[field] = _take(arrays[field], index)
+    return result
+
+def income_fingerprint(income: pd.DataFrame):
+    """
+    Income rows as a tuple of (date, revenue, profit), compared to find the rows that changed
+    """
+    if income is None or income.empty:
+        return ()
+    income = income.sort_values('date')
+    values = lambda column: [None if pd.isna(value) else int(value) for value in income[column]]
+    dates = pd.to_datetime(income['date']).dt.strftime('%Y-%m-%d')
+    return tuple(zip(dates, values('revenue'), values('profit')))
+
+def _first_change(before, after):
+    """
+    Date of the first income row that differs between two fingerprints, None when they are equal
+    """
+    for old, new in zip(before, after):
+        if old != new:
+            return min(old[0], new[0])
+    if len(before) != len(after):
+        return max(before, after, key=len)[min(len(before), len(after))][0]
+    return None
+
+def extend_income(cached: pd.DataFrame, prices: pd.DataFrame, income: pd.DataFrame,
+                  publication_day=PUBLICATION_DAY) -> pd.DataFrame:
+    """
+    Continue a cached join with the bars of prices after it.
+    The last cached bar is joined again because it may still move, and so is every bar
+    from the date of the first income row added or changed since the cache was built.
+    Falls back to a full join when the cache does not match the prices or was joined
+    with another publication day.
+    """
+    fingerprint = income_fingerprint(income)
+    join = lambda bars: join_income(bars, income, publication_day)
+    if (cached is None or len(cached) < 2 or 'income' not in cached.attrs
+            or cached.attrs.get('publication_day') != publication_day):
+        result = join(prices)
+        result.attrs.update(income=fingerprint, publication_day=publication_day)
+        return result
+
+    dates = pd.to_datetime(prices['date']).to_numpy()
+    close = pd.to_numeric(prices['close_price'], errors='coerce').to_numpy(dtype=float)
+    previous = cached.iloc[-2]
+    start = int(np.searchsorted(dates, np.datetime64(cached['date'].iloc[-1])))
+    # The bar before the new ones has to be the same as the cached one
+    if (start == 0 or start > len(dates) or dates[start - 1] != np.datetime64(previous['date'])
+            or close[start - 1] != float(previous['close_price'])):
+        result = join(prices)
+        result.attrs.update(income=fingerprint, publication_day=publication_day)
+        return result
+
+    changed = _first_change(cached.attrs['income'], fingerprint)
+    if changed is not None:
+        start = min(start, int(np.searchsorted(dates, np.datetime64(changed))))
+    tail = join(prices.iloc[start:])
+    result = pd.concat([cached.iloc[:start], tail], ignore_index=True)
+    result.attrs.update(income=fingerprint, publication_day=publication_day)
+    return result
+
+def load_income_universe(db_config):
+    """
+    Income rows of every stock with one query, sorted by stock and date
+    """
+    queries = SQLLoader.load_query('income.sql')
+    connection = mysql.connector.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(queries['Get all income data'])
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        connection.close()
+    income = pd.DataFrame(rows, columns=['stock_no', 'date', 'revenue', 'profit'])
+    income['date'] = pd.to_datetime(income['date'])
+    return income
+
+def join_universe(stock_numbers, dates, income: pd.DataFrame, publication_day=PUBLICATION_DAY) -> pd.DataFrame:
+    """
+    Latest income known at each (stock, date) pair, for any number of stocks in one pass.
+    A report is known from its publication date on, as in join_income.
+    income: rows of many stocks with a stock_no column, see load_income_universe
+    Returns a frame with a row per pair in the given order.
+    """
+    stock_numbers = np.asarray(stock_numbers, dtype=str)
+    income_stocks = income['stock_no'].to_numpy(dtype=str)
+    codes = np.unique(np.concatenate([stock_numbers, income_stocks]), return_inverse=True)[1]
+    groups, income_groups = codes[:len(stock_numbers)], codes[len(stock_numbers):]
+
+    # Every stock's reports in date order, the previous row of a stock's first report is another stock
+    order = np.lexsort((_day_numbers(income['date']), income_groups))
+    income_groups = income_groups[order]
+    arrays = _income_arrays(income.iloc[order])
+    first = np.r_[True, income_groups[1:] != income_groups[:-1]] if len(order) else np.empty(0, dtype=bool)
+    arrays['revenue_change'][first] = np.nan
+
+    index = asof_indexes(dates, publication_dates(arrays['income_date'], publication_day),
+                         groups, income_groups)
+    result = pd.DataFrame({'stock_no': stock_numbers, 'date': pd.to_datetime(dates)})
+    for field in INCOME_FIELDS:
+        result[field] = _take(arrays[field], index)
+    return result
+
+class FundamentalsCache:
+    """
+    Price bars joined with income persisted per stock and period, extended when
+    either the prices or the income of the stock change
+    """
+    def __init__(self, cache_dir=CACHE_DIR, publication_day=PUBLICATION_DAY):
+        self.cache_dir = cache_dir
+        self.publication_day = publication_day
+
+    def path(self, stock_no, period):
+        return os.path.join(self.cache_dir, f"{stock_no}_{period}.pkl")
+
+    def load(self, stock_no, period):
+        try:
+            return pd.read_pickle(self.path(stock_no, period))
+        except (FileNotFoundError, EOFError):
+            return None
+        except Exception as e:
+            print(f"Error loading fundamentals cache for {stock_no}: {e}")
+            return None
+
+    def save(self, stock_no, period, joined):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(stock_no, period)
+        # Write to a temporary file first so an interrupted update never leaves a broken cache
+        joined.to_pickle(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def update(self, stock_no, period, prices, income):
+        """
+        Extend the cached join with the new bars and income rows and persist it
+        """
+        if prices.empty:
+            return None
+        joined = extend_income(self.load(stock_no, period), prices, income, self.publication_day)
+        self.save(stock_no, period, joined)
+        return joined
@@ -0,0 +1,185 @@
+import os
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.path.join('.cache', 'indicators')
+
+class IndicatorCalculator:
+    """
+    MA / EMA / RSI / MACD / Bollinger bands on the OHLCV frames of the fetcher.
+    Every recursive indicator keeps its running state as a column of the result
+    (the EMAs, the RSI average gain/loss and the MACD signal), so the series can be
+    extended from the last row without touching the earlier history.
+    """
+    def __init__(self, ma_windows=(5, 20, 60), ema_windows=(12, 26), rsi_window=14,
+                 macd=(12, 26, 9), bollinger=(20, 2.0)):
+        self.ma_windows = tuple(ma_windows)
+        self.ema_windows = tuple(ema_windows)
+        self.rsi_window = rsi_window
+        self.macd = tuple(macd)
+        self.bollinger = tuple(bollinger)
+
+    @property
+    def params(self):
+        return {
+            'ma_windows': self.ma_windows,
+            'ema_windows': self.ema_windows,
+            'rsi_window': self.rsi_window,
+            'macd': self.macd,
+            'bollinger': self.bollinger,
+        }
+
+    @property
+    def history(self):
+        """
+        number of closes before the first new bar needed by the rolling windows
+        """
+        return max(self.ma_windows + (self.bollinger[0],)) - 1
+
+    @staticmethod
+    def _ema(values, alpha, seed=None):
+        """
+        exponential moving average, continued from seed when it is given
+        """
+        if seed is not None and not np.isnan(seed):
+            values = np.concatenate([[seed], values])
+            return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()[1:]
+        return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+
+    def _calculate(self, dates, close, previous=None, history=None):
+        """
+        Indicators for the bars of close.
+        previous: last row of the already computed series (the running state)
+        history: closes right before the first bar, for the rolling windows
+        """
+        result = pd.DataFrame({'date': dates, 'close': close})
+        offset = 0 if previous is None else int(previous['position']) + 1
+        position = offset + np.arange(len(close))
+        result['position'] = position
+
+        # Rolling windows see the tail of the previous closes
+        history = np.empty(0) if history is None else np.asarray(history, dtype=float)
+        window_close = pd.Series(np.concatenate([history, close]))
+        for window in self.ma_windows:
+            ma = window_close.rolling(window).mean().to_numpy()[len(history):]
+            result[f'ma_{window}'] = ma
+
+        for window in self.ema_windows:
+            seed = None if previous is None else previous[f'ema_{window}']
+            result[f'ema_{window}'] = self._ema(close, 2.0 / (window + 1), seed)
+
+        # RSI with Wilder's smoothing, the average gain/loss are its state
+        prior_close = np.nan if previous is None else previous['close']
+        change = np.diff(np.concatenate([[prior_close], close]))
+        gain = np.where(change > 0, change, 0.0)
+        loss = np.where(change < 0, -change, 0.0)
+        if previous is None:
+            gain, loss = gain[1:], loss[1:]
+        alpha = 1.0 / self.rsi_window
+        avg_gain = self._ema(gain, alpha, None if previous is None else previous['rsi_avg_gain'])
+        avg_loss = self._ema(loss, alpha, None if previous is None else previous['rsi_avg_loss'])
+        if previous is None:
+            avg_gain = np.concatenate([[np.nan], avg_gain])
+            avg_loss = np.concatenate([[np.nan], avg_loss])
+        result['rsi_avg_gain'] = avg_gain
+        result['rsi_avg_loss'] = avg_loss
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = np.where(avg_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + avg_gain / avg_loss))
+        rsi[position < self.rsi_window] = np.nan
+        result[f'rsi_{self.rsi_window}'] = rsi
+
+        fast, slow, signal = self.macd
+        fast_ema = self._ema(close, 2.0 / (fast + 1), None if previous is None else previous['macd_fast'])
+        slow_ema = self._ema(close, 2.0 / (slow + 1), None if previous is None else previous['macd_slow'])
+        macd = fast_ema - slow_ema
+        macd_signal = self._ema(macd, 2.0 / (signal + 1), None if previous is None else previous['macd_signal'])
+        result['macd_fast'] = fast_ema
+        result['macd_slow'] = slow_ema
+        result['macd'] = macd
+        result['macd_signal'] = macd_signal
+        result['macd_hist'] = macd - macd_signal
+
+        window, width = self.bollinger
+        mid = window_close.rolling(window).mean().to_numpy()[len(history):]
+        std = window_close.rolling(window).std(ddof=0).to_numpy()[len(history):]
+        result['bb_mid'] = mid
+        result['bb_upper'] = mid + width * std
+        result['bb_lower'] = mid - width * std
+        return result
+
+    @staticmethod
+    def _prepare(data):
+        dates = pd.to_datetime(data['date']).to_numpy()
+        close = pd.to_numeric(data['close_price'], errors='coerce').to_numpy(dtype=float)
+        return dates, close
+
+    def compute(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Indicators for the whole history
+        """
+        dates, close = self._prepare(data)
+        result = self._calculate(dates, close)
+        result.attrs['params'] = self.params
+        return result
+
+    def extend(self, cached: pd.DataFrame, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Continue cached indicators with the bars of data after them.
+        The last cached bar is recomputed as well, because the latest daily bar and
+        the current week/month are still moving until the period is over.
+        Falls back to a full computation when the cache does not match the data.
+        """
+        if cached is None or len(cached) < 2 or cached.attrs.get('params') != self.params:
+            return self.compute(data)
+
+        dates, close = self._prepare(data)
+        kept = cached.iloc[:-1]
+        previous = kept.iloc[-1]
+
+        start = int(np.searchsorted(dates, np.datetime64(cached['date'].iloc[-1])))
+        # The bar before the new ones has to be the same as the cached one
+        if start == 0 or start > len(dates) or dates[start - 1] != previous['date'] or close[start - 1] != previous['close']:
+            return self.compute(data)
+
+        history = close[max(start - self.history, 0):start]
+        tail = self._calculate(dates[start:], close[start:], previous, history)
+        result = pd.concat([kept, tail], ignore_index=True)
+        result.attrs['params'] = self.params
+        return result
+
+class IndicatorCache:
+    """
+    Indicators persisted per stock and period, extended on every update
+    """
+    def __init__(self, cache_dir=CACHE_DIR, calculator=None):
+        self.cache_dir = cache_dir
+        self.calculator = calculator or IndicatorCalculator()
+
+    def path(self, stock_no, period):
+        return os.path.join(self.cache_dir, f"{stock_no}_{period}.pkl")
+
+    def load(self, stock_no, period):
+        try:
+            return pd.read_pickle(self.path(stock_no, period))
+        except (FileNotFoundError, EOFError):
+            return None
+        except Exception as e:
+            print(f"Error loading indicator cache for {stock_no}: {e}")
+            return None
+
+    def save(self, stock_no, period, indicators):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(stock_no, period)
+        # Write to a temporary file first so an interrupted update never leaves a broken cache
+        indicators.to_pickle(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def update(self, stock_no, period, data):
+        """
+        Extend the cached indicators with the new bars of data and persist them
+        """
+        if data.empty:
+            return None
+        indicators = self.calculator.extend(self.load(stock_no, period), data)
+        self.save(stock_no, period, indicators)
+        return indicators
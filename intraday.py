@@ -0,0 +1,255 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+import numpy as np
+import requests
+import metrics
+
+# Quotes of listed stocks, updated about every 5 seconds during the session
+MIS_URL = "https://mis.twse.com.tw/stock/api/getStockInfo.jsp"
+POLL_INTERVAL = 5.0
+MARKET_CLOSE = "13:30:00"
+
+# Wall-clock time the watch ends at even without closing quotes, a halted or
+# untraded symbol never sends one
+WATCH_CUTOFF = "13:35:00"
+
+# MIS channel prefixes of the listed (TWSE) and OTC (TPEx) markets
+MARKETS = ('tse', 'otc')
+
+# Ticks kept per symbol, a session polled every 5 seconds has about 3,300
+RING_CAPACITY = 4096
+
+class QuoteRing:
+    """
+    Last ticks of one symbol as (epoch seconds, price, accumulated volume) in a
+    fixed numpy buffer, the oldest tick is overwritten once it is full
+    """
+    def __init__(self, capacity=RING_CAPACITY):
+        self.values = np.full((capacity, 3), np.nan)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, len(self.values))
+
+    def append(self, timestamp, price, volume):
+        self.values[self.count % len(self.values)] = (timestamp, price, volume)
+        self.count += 1
+
+    def last(self):
+        return self.values[(self.count - 1) % len(self.values)] if self.count else None
+
+    def ticks(self):
+        """
+        Ticks in time order, a copy
+        """
+        if self.count <= len(self.values):
+            return self.values[:self.count].copy()
+        start = self.count % len(self.values)
+        return np.concatenate((self.values[start:], self.values[:start]))
+
+class DailyBar:
+    """
+    Running OHLCV bar of the session, updated tick by tick
+    """
+    def __init__(self, date, previous_close=None):
+        self.date = date
+        self.previous_close = previous_close
+        self.open = self.high = self.low = self.close = None
+        self.volume = 0
+        self.turnover = 0.0
+        self.trades = 0
+
+    def update(self, price, volume, day_open=None, day_high=None, day_low=None):
+        """
+        price: last trade, volume: accumulated shares of the day.
+        The open/high/low of the feed cover the trades between two polls.
+        """
+        if self.open is None:
+            self.open = day_open or price
+            self.high = self.low = self.open
+        self.high = max(self.high, price, day_high or price)
+        self.low = min(self.low, price, day_low or price)
+        self.close = price
+        if volume > self.volume:
+            # Shares traded since the last tick, priced at the last trade
+            self.turnover += (volume - self.volume) * price
+            self.volume = volume
+            self.trades += 1
+
+    def to_record(self):
+        """
+        The bar as a STOCK_DAY row, the layout insert_data reads.
+        The transaction count is the number of ticks with new volume, a lower bound.
+        """
+        change = self.close - self.previous_close if self.previous_close else 0.0
+        return [
+            f"{self.date.year - 1911}/{self.date.month:02d}/{self.date.day:02d}",
+            f"{self.volume:,}",
+            f"{int(self.turnover):,}",
+            f"{self.open:.2f}",
+            f"{self.high:.2f}",
+            f"{self.low:.2f}",
+            f"{self.close:.2f}",
+            f"{change:+.2f}",
+            f"{self.trades:,}",
+        ]
+
+class LevelWatch:
+    """
+    Support/resistance of a symbol checked on every tick.
+    The levels come from StockPatternAnalyzer over the daily history, a tick only
+    compares against them, and an alert is raised when the price leaves or re-enters
+    the range between them.
+    """
+    def __init__(self, support, resistance):
+        self.support = support
+        self.resistance = resistance
+        self.state = 'inside'
+
+    def check(self, price):
+        """
+        'breakout', 'breakdown' or 'back inside' when the state changed, else None
+        """
+        if price > self.resistance:
+            state = 'breakout'
+        elif price < self.support:
+            state = 'breakdown'
+        else:
+            state = 'inside'
+        if state == self.state:
+            return None
+        self.state = state
+        return state if state != 'inside' else 'back inside'
+
+def _number(text):
+    try:
+        return float(text.replace(',', ''))
+    except (AttributeError, ValueError):
+        return None
+
+def parse_quote(quote):
+    """
+    (symbol, date, time, price, volume in shares, open, high, low, previous close) of
+    one msgArray entry, None when it has no trade yet
+    """
+    price = _number(quote.get('z'))
+    volume = _number(quote.get('v'))
+    if price is None or volume is None or not quote.get('d'):
+        return None
+    return (quote['c'], datetime.strptime(quote['d'], '%Y%m%d').date(), quote.get('t', ''),
+            price, int(volume) * 1000, _number(quote.get('o')), _number(quote.get('h')),
+            _number(quote.get('l')), _number(quote.get('y')))
+
+class IntradayWatcher:
+    """
+    Poll the quotes of a watchlist until the close, building the daily bar of every
+    symbol in memory and raising support/resistance alerts on the way.
+    The watch ends once every symbol that traded has its closing quote, or at the
+    first cutoff time after it started at the latest.
+    A symbol is asked for on both markets until one of them answers.
+    levels: {symbol: (support, resistance)}, symbols without levels get no alerts
+    on_alert: called with (symbol, event, price, quote time), prints by default
+    """
+    def __init__(self, symbols, levels=None, url=None, interval=POLL_INTERVAL, close_time=MARKET_CLOSE,
+                 on_alert=None, cutoff=WATCH_CUTOFF):
+        self.symbols = list(symbols)
+        self.url = url or os.environ.get('TWSE_MIS_URL', MIS_URL)
+        self.interval = interval
+        self.close_time = close_time
+        self.cutoff = cutoff
+        self.markets = {}
+        self.on_alert = on_alert or self.print_alert
+        self.rings = {symbol: QuoteRing() for symbol in self.symbols}
+        self.bars = {}
+        self.watches = {symbol: LevelWatch(*levels[symbol]) for symbol in self.symbols
+                        if levels and symbol in levels}
+        self.last_time = {}
+        self.polls = 0
+
+    @staticmethod
+    def print_alert(symbol, event, price, quote_time):
+        print(f"[{quote_time}] {symbol} {event} at {price:.2f}")
+
+    @property
+    def closed(self):
+        """
+        True once every symbol that traded has a quote from the close
+        """
+        return bool(self.last_time) and all(quote_time >= self.close_time for quote_time in self.last_time.values())
+
+    def deadline(self, started):
+        """
+        First cutoff after the start, the next day's when the watch starts after the session
+        """
+        cutoff = datetime.combine(started.date(), datetime.strptime(self.cutoff, '%H:%M:%S').time())
+        return cutoff if cutoff > started else cutoff + timedelta(days=1)
+
+    def channels(self):
+        """
+        MIS channels of the watchlist, on both markets for the symbols not seen yet
+        """
+        return '|'.join(f"{market}_{symbol}.tw" for symbol in self.symbols
+                        for market in ([self.markets[symbol]] if symbol in self.markets else MARKETS))
+
+    def fetch(self):
+        params = {
+            'ex_ch': self.channels(),
+            'json': '1',
+            'delay': '0',
+            '_': str(int(time.time() * 1000)),
+        }
+        with metrics.timed('http'):
+            response = requests.get(self.url, params=params, timeout=10)
+        metrics.count('http_requests')
+        response.raise_for_status()
+        return response.json().get('msgArray', [])
+
+    def on_quote(self, quote):
+        # Only the market a symbol is traded on answers, the other channel is dropped
+        if quote.get('c') in self.rings and quote.get('ex') in MARKETS:
+            self.markets.setdefault(quote['c'], quote['ex'])
+        parsed = parse_quote(quote)
+        if parsed is None or parsed[0] not in self.rings:
+            return
+        symbol, day, quote_time, price, volume, day_open, day_high, day_low, previous_close = parsed
+        # The feed repeats the last quote until the next trade
+        if self.last_time.get(symbol) == quote_time:
+            return
+        self.last_time[symbol] = quote_time
+        metrics.count('ticks')
+
+        self.rings[symbol].append(time.time(), price, volume)
+        bar = self.bars.get(symbol)
+        if bar is None or bar.date != day:
+            bar = self.bars[symbol] = DailyBar(day, previous_close)
+        bar.update(price, volume, day_open, day_high, day_low)
+
+        watch = self.watches.get(symbol)
+        event = watch.check(price) if watch else None
+        if event:
+            self.on_alert(symbol, event, price, quote_time)
+
+    async def run(self, stop=None):
+        """
+        Poll until the close, the cutoff or until the stop event is set, returns the bars of the day
+        """
+        deadline = self.deadline(datetime.now())
+        while not self.closed and not (stop and stop.is_set()):
+            if datetime.now() >= deadline:
+                missing = [symbol for symbol in self.symbols if self.last_time.get(symbol, '') < self.close_time]
+                print(f"Cutoff {self.cutoff} reached without a closing quote of {', '.join(missing)}")
+                break
+            started = time.perf_counter()
+            try:
+                quotes = await asyncio.to_thread(self.fetch)
+                self.polls += 1
+                for quote in quotes:
+                    self.on_quote(quote)
+            except Exception as e:
+                metrics.count('http_errors')
+                print(f"Quote request failed: {e}")
+            # Keep the poll rate steady whatever the request took
+            await asyncio.sleep(max(self.interval - (time.perf_counter() - started), 0))
+        return self.bars
@@ -1,5 +1,31 @@
+import sys
+import argparse
 from app import StockApp
 
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Stock Analysis App, starts the interactive shell when no command is given")
+    parser.add_argument('-c', '--command', action='append', default=[],
+                        help="run a command without the prompt, may be repeated or separated by ';'")
+    parser.add_argument('-f', '--file',
+                        help="run the commands of a script file, one per line, '-' reads stdin")
+    parser.add_argument('--metrics',
+                        help="write the metrics of the commands to a JSON file, or Prometheus text for .prom")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
+
+    lines = []
+    if args.file:
+        with (sys.stdin if args.file == '-' else open(args.file)) as script:
+            lines.extend(script.read().splitlines())
+    for command in args.command:
+        lines.extend(command.split(';'))
+
+    if lines:
+        app = StockApp(interactive=False)
+        sys.exit(app.run_batch(lines, metrics_path=args.metrics))
+
     app = StockApp()
-    app.run()
\ No newline at end of file
+    app.run()
@@ -0,0 +1,189 @@
+import json
+import time
+import bisect
+import functools
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency buckets, 1 ms doubling up to about 65 s
+BUCKETS = tuple(0.001 * 2 ** k for k in range(17))
+
+# Stages timed across the pipeline, shown in this order by the stats command
+STAGES = ('http', 'decode', 'throttle', 'db_write', 'query', 'aggregate', 'analyze', 'render')
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets, so the histograms of several processes add up
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        Estimate interpolated inside the bucket holding the q-th observation
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index > 0 else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def state(self):
+        return {'counts': self.counts, 'count': self.count, 'total': self.total, 'max': self.max}
+
+    def merge(self, state):
+        self.counts = [a + b for a, b in zip(self.counts, state['counts'])]
+        self.count += state['count']
+        self.total += state['total']
+        self.max = max(self.max, state['max'])
+
+class Metrics:
+    """
+    Counters and per-stage latency histograms of one process.
+    Workers drain theirs after every job and the shell merges them into its own.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        if stage not in self.histograms:
+            self.histograms[stage] = Histogram()
+        self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def drain(self):
+        """
+        Snapshot of everything recorded since the last drain, the recorded values are reset
+        """
+        snapshot = {
+            'counters': self.counters,
+            'histograms': {stage: histogram.state() for stage, histogram in self.histograms.items()},
+        }
+        self.counters, self.histograms = {}, {}
+        return snapshot if snapshot['counters'] or snapshot['histograms'] else None
+
+    def merge(self, snapshot):
+        for name, value in snapshot['counters'].items():
+            self.count(name, value)
+        for stage, state in snapshot['histograms'].items():
+            self.histograms.setdefault(stage, Histogram()).merge(state)
+
+    def reset(self):
+        self.__init__()
+
+    def stages(self):
+        """
+        Stage names, the known pipeline stages first
+        """
+        return [stage for stage in STAGES if stage in self.histograms] + \
+               sorted(stage for stage in self.histograms if stage not in STAGES)
+
+    def to_json(self):
+        return json.dumps({
+            'uptime': time.time() - self.started,
+            'counters': self.counters,
+            'stages': {stage: {
+                'count': histogram.count,
+                'total': histogram.total,
+                'p50': histogram.quantile(0.5),
+                'p99': histogram.quantile(0.99),
+                'max': histogram.max,
+                'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], histogram.counts)),
+            } for stage, histogram in self.histograms.items()},
+        }, indent=2)
+
+    def to_prometheus(self):
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE stock_{name}_total counter")
+            lines.append(f"stock_{name}_total {value}")
+        if self.histograms:
+            lines.append("# TYPE stock_stage_seconds histogram")
+        for stage in self.stages():
+            histogram = self.histograms[stage]
+            cumulative = 0
+            for bound, count in zip([f"{bound:g}" for bound in BUCKETS] + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f'stock_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'stock_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+            lines.append(f'stock_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        """
+        Write the metrics to path, Prometheus text for .prom/.txt files and JSON otherwise
+        """
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w') as f:
+            f.write(text)
+
+# Metrics of this process and the queue its snapshots are sent to
+REGISTRY = Metrics()
+_sink = {'queue': None}
+
+def count(name, value=1):
+    REGISTRY.count(name, value)
+
+def observe(stage, seconds):
+    REGISTRY.observe(stage, seconds)
+
+def timed(stage):
+    return REGISTRY.timed(stage)
+
+def measured(stage):
+    """
+    Decorator timing every call of a function as the stage
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with REGISTRY.timed(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def set_sink(queue):
+    _sink['queue'] = queue
+
+def get_sink():
+    return _sink['queue']
+
+def flush():
+    """
+    Send what this process recorded to the shell, called by workers after every job
+    """
+    if _sink['queue'] is None:
+        return
+    snapshot = REGISTRY.drain()
+    if snapshot is None:
+        return
+    try:
+        _sink['queue'].put_nowait((None, {'metrics': snapshot}))
+    except Exception:
+        pass
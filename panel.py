@@ -0,0 +1,209 @@
+import os
+import numpy as np
+import pandas as pd
+import mysql.connector
+from datetime import date
+from fetcher import SQLLoader
+
+CACHE_DIR = os.path.join('.cache', 'panel')
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+# Column of stock_prices behind each field
+COLUMNS = {'open': 'open_price', 'high': 'high_price', 'low': 'low_price', 'close': 'close_price', 'volume': 'volume'}
+
+class PricePanel:
+    """
+    OHLCV of many stocks as contiguous (stocks x trading days) matrices.
+    All stocks share one calendar, the days a stock did not trade are NaN.
+    Row i of every matrix belongs to symbols[i], column j to dates[j].
+    The loaders take the fields to build, a panel of the close only is a fifth of the full one.
+    """
+    def __init__(self, symbols, dates, fields):
+        self.symbols = np.asarray(symbols)
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.fields = fields
+        self._index = {symbol: i for i, symbol in enumerate(self.symbols.tolist())}
+
+    @property
+    def shape(self):
+        return (len(self.symbols), len(self.dates))
+
+    @property
+    def mask(self):
+        """
+        True where the stock has a bar on that day
+        """
+        return ~np.isnan(self.fields['close'])
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    @classmethod
+    def from_records(cls, stock_numbers, dates, values, dtype=np.float64, fields=FIELDS):
+        """
+        Scatter long-format rows (one per stock and day) into the matrices.
+        values: (rows x len(fields)) array in the order of fields
+        """
+        symbols, row = np.unique(np.asarray(stock_numbers), return_inverse=True)
+        calendar, column = np.unique(np.asarray(dates, dtype='datetime64[D]'), return_inverse=True)
+        values = np.asarray(values, dtype=dtype)
+
+        matrices = {}
+        for i, field in enumerate(fields):
+            matrix = np.full((len(symbols), len(calendar)), np.nan, dtype=dtype)
+            matrix[row, column] = values[:, i]
+            matrices[field] = matrix
+        return cls(symbols, calendar, matrices)
+
+    @classmethod
+    def from_db(cls, db_config, symbols=None, start_date=None, end_date=None, dtype=np.float64, chunk_size=100000,
+                fields=FIELDS):
+        """
+        Build the panel with one bulk query over stock_prices, the symbol set is
+        filtered in SQL. The stocks and the calendar are read first so the matrices
+        are allocated up front, then the rows are streamed in chunks and scattered
+        into them: only the matrices and one chunk are held in memory.
+        Only the columns of the given fields are selected.
+        """
+        queries = SQLLoader.load_query('basic.sql')
+        start_date = start_date or date(1900, 1, 1)
+        end_date = end_date or date.today()
+        stock_filter, params = '', (start_date, end_date)
+        if symbols is not None:
+            symbols = sorted(set(symbols))
+            if not symbols:
+                return cls.empty(dtype, fields)
+            stock_filter = f"AND stock_no IN ({', '.join(['%s'] * len(symbols))})"
+            params += tuple(symbols)
+
+        connection = mysql.connector.connect(**db_config)
+        try:
+            cursor = connection.cursor()
+            cursor.execute(queries['Get panel stocks'].format(stock_filter=stock_filter), params)
+            stocks = np.sort(np.array([row[0] for row in cursor.fetchall()], dtype=str))
+            cursor.execute(queries['Get panel dates'].format(stock_filter=stock_filter), params)
+            calendar = np.array([row[0] for row in cursor.fetchall()], dtype='datetime64[D]')
+            if len(stocks) == 0:
+                cursor.close()
+                return cls.empty(dtype, fields)
+
+            matrices = {field: np.full((len(stocks), len(calendar)), np.nan, dtype=dtype) for field in fields}
+            columns = ', '.join(f"CAST({COLUMNS[field]} AS DOUBLE)" for field in fields)
+            cursor.execute(queries['Get panel data'].format(columns=columns, stock_filter=stock_filter), params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                row = np.searchsorted(stocks, np.array(columns[0], dtype=str))
+                column = np.searchsorted(calendar, np.array(columns[1], dtype='datetime64[D]'))
+                for i, field in enumerate(fields):
+                    matrices[field][row, column] = np.array(columns[2 + i], dtype=dtype)
+            cursor.close()
+        finally:
+            connection.close()
+        return cls(stocks, calendar, matrices)
+
+    @classmethod
+    def empty(cls, dtype=np.float64, fields=FIELDS):
+        return cls(np.empty(0, dtype=str), np.empty(0, dtype='datetime64[D]'),
+                   {field: np.empty((0, 0), dtype=dtype) for field in fields})
+
+    @classmethod
+    def from_snapshot(cls, path, symbols=None, start_date=None, end_date=None, mmap=True, dtype=np.float64,
+                      manifest=None, fields=FIELDS):
+        """
+        Build the panel from an exported snapshot without the database.
+        A snapshot exported with its panel matrices is memory mapped unless mmap is False,
+        otherwise the price partitions of the wanted stocks and years are read.
+        """
+        from snapshot import read_manifest, read_prices
+        manifest = manifest or read_manifest(path)
+        if 'panel/symbols.npy' in manifest['files']:
+            panel = cls.load(os.path.join(path, 'panel'), mmap, fields)
+            if symbols is None and start_date is None and end_date is None:
+                return panel
+            return panel.select(symbols, start_date, end_date)
+
+        stock_numbers, dates, values = read_prices(path, symbols, start_date, end_date, manifest, fields)
+        if len(stock_numbers) == 0:
+            return cls.empty(dtype, fields)
+        return cls.from_records(stock_numbers, dates, values, dtype, fields)
+
+    def save(self, path=CACHE_DIR):
+        """
+        Write the panel as one .npy file per field, readable with memory mapping
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'symbols.npy'), self.symbols.astype(str))
+        np.save(os.path.join(path, 'dates.npy'), self.dates)
+        for field, matrix in self.fields.items():
+            np.save(os.path.join(path, f'{field}.npy'), np.ascontiguousarray(matrix))
+
+    @classmethod
+    def load(cls, path=CACHE_DIR, mmap=True, fields=FIELDS):
+        """
+        Open the given fields of a saved panel, the matrices are memory mapped unless mmap is False
+        """
+        mode = 'r' if mmap else None
+        symbols = np.load(os.path.join(path, 'symbols.npy'))
+        dates = np.load(os.path.join(path, 'dates.npy'))
+        matrices = {field: np.load(os.path.join(path, f'{field}.npy'), mmap_mode=mode) for field in fields}
+        return cls(symbols, dates, matrices)
+
+    def _rows(self, symbols):
+        """
+        Row selector for a symbol set: a slice when the rows are contiguous
+        """
+        if symbols is None:
+            return slice(None)
+        rows = np.sort([self._index[symbol] for symbol in symbols if symbol in self._index])
+        if len(rows) == 0:
+            return slice(0, 0)
+        if rows[-1] - rows[0] + 1 == len(rows):
+            return slice(int(rows[0]), int(rows[-1]) + 1)
+        return rows
+
+    def _columns(self, start_date=None, end_date=None):
+        start = 0 if start_date is None else np.searchsorted(self.dates, np.datetime64(start_date, 'D'), side='left')
+        end = len(self.dates) if end_date is None else np.searchsorted(self.dates, np.datetime64(end_date, 'D'), side='right')
+        return slice(int(start), int(end))
+
+    def select(self, symbols=None, start_date=None, end_date=None):
+        """
+        Sub-panel by symbol set and date range.
+        Date ranges and contiguous symbol runs are numpy views of this panel,
+        a scattered symbol set has to gather its rows into new matrices.
+        """
+        rows = self._rows(symbols)
+        columns = self._columns(start_date, end_date)
+        if isinstance(rows, slice):
+            fields = {field: matrix[rows, columns] for field, matrix in self.fields.items()}
+        else:
+            fields = {field: matrix[rows][:, columns] for field, matrix in self.fields.items()}
+        return PricePanel(self.symbols[rows], self.dates[columns], fields)
+
+    def returns(self, field='close', log=True):
+        """
+        Day over day returns, NaN where either day is missing
+        """
+        prices = self.fields[field]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if log:
+                return np.diff(np.log(prices), axis=1)
+            return prices[:, 1:] / prices[:, :-1] - 1.0
+
+    def frame(self, symbol):
+        """
+        One stock in the column layout of the fetcher frames
+        """
+        row = self._index[symbol]
+        data = pd.DataFrame({
+            'date': pd.to_datetime(self.dates),
+            'open_price': self.fields['open'][row],
+            'high_price': self.fields['high'][row],
+            'low_price': self.fields['low'][row],
+            'close_price': self.fields['close'][row],
+            'volume': self.fields['volume'][row],
+        })
+        return data[~np.isnan(data['close_price'].to_numpy())].reset_index(drop=True)
@@ -1,66 +1,290 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
 import pandas as pd
 import mplfinance as mpf
 import matplotlib.pyplot as plt
+import metrics
+from pyramid import to_arrays, downsample_bars, lttb
+
+# Render cost is bounded by the plot width: never draw more candles than fit in it
+FIGURE_WIDTH_PX = 1200
+PIXELS_PER_BAR = 4
+MAX_BARS = FIGURE_WIDTH_PX // PIXELS_PER_BAR
+
+CHART_CACHE_DIR = os.path.join('.cache', 'charts')
+CHART_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# A temporary chart this old was left by a render that died, a live one is never evicted
+STALE_TEMP_SECONDS = 3600
 
 class StockDataPlotter:
     @staticmethod
-    def plot_kline_with_volume(data, start_date=None, end_date=None, support=None, resistance=None, title=None):
-        # Ensure the data format is correct
-        data['date'] = pd.to_datetime(data['date'])
-        data.set_index('date', inplace=True)
-
-        # Filter data by date range
-        if start_date:
-            start_date = pd.to_datetime(start_date)
-            data = data[data.index >= start_date]
-        if end_date:
-            end_date = pd.to_datetime(end_date)
-            data = data[data.index <= end_date]
-
-        # Convert data to the required format for plotting
-        data['Open'] = pd.to_numeric(data['open_price'], errors='coerce')
-        data['High'] = pd.to_numeric(data['high_price'], errors='coerce')
-        data['Low'] = pd.to_numeric(data['low_price'], errors='coerce')
-        data['Close'] = pd.to_numeric(data['close_price'], errors='coerce')
-        data['Volume'] = pd.to_numeric(data['volume'], errors='coerce')
-        data.fillna(method='ffill', inplace=True)
+    def _prepare_kline(data, start_date=None, end_date=None, max_bars=MAX_BARS, pyramid=None):
+        """
+        Filter the date range, downsample to max_bars candles and build the frame of mplfinance.
+        pyramid: precomputed BarPyramid of data, saves aggregating the whole history
+        """
+        if pyramid is not None:
+            bars = pyramid.get(max_bars, start_date, end_date)
+        else:
+            bars = to_arrays(data)
+
+            # Filter data by date range
+            keep = np.ones(len(bars['date']), dtype=bool)
+            if start_date:
+                keep &= bars['date'] >= np.datetime64(pd.to_datetime(start_date))
+            if end_date:
+                keep &= bars['date'] <= np.datetime64(pd.to_datetime(end_date))
+            if not keep.all():
+                bars = {key: values[keep] for key, values in bars.items()}
+            bars = downsample_bars(bars, max_bars)
+
+        frame = pd.DataFrame({
+            'Open': bars['open'],
+            'High': bars['high'],
+            'Low': bars['low'],
+            'Close': bars['close'],
+            'Volume': bars['volume'],
+        }, index=pd.DatetimeIndex(bars['date'], name='date'))
+        return frame.ffill()
+
+    @staticmethod
+    @metrics.measured('render')
+    def plot_kline_with_volume(data, start_date=None, end_date=None, support=None, resistance=None, title=None,
+                               save_path=None, max_bars=MAX_BARS, pyramid=None):
+        """
+        save_path: write the chart to a PNG/SVG file instead of showing it (headless mode)
+        max_bars: longer ranges are merged into at most max_bars candles
+        pyramid: precomputed BarPyramid of data
+        """
+        data = StockDataPlotter._prepare_kline(data, start_date, end_date, max_bars, pyramid)
 
         # Set up additional plots (support/resistance lines)
+        # A level is either a single price or a series indexed by date (rolling analysis)
         ap = []
         if support is not None:
-            ap.append(mpf.make_addplot([float(support)] * len(data), color='green', linestyle='--', width=1))  # Convert to float
+            ap.append(mpf.make_addplot(StockDataPlotter._level_values(support, data), color='green', linestyle='--', width=1))
         if resistance is not None:
-            ap.append(mpf.make_addplot([float(resistance)] * len(data), color='red', linestyle='--', width=1))  # Convert to float
+            ap.append(mpf.make_addplot(StockDataPlotter._level_values(resistance, data), color='red', linestyle='--', width=1))
+
+        kwargs = {'savefig': save_path} if save_path else {}
 
         # Plot the K-line chart with volume
-        mpf.plot(data, type='candle', volume=True, 
+        mpf.plot(data, type='candle', volume=True,
                  title=title or 'K-Line and Volume with Support/Resistance',
-                 style='charles', ylabel='Price', ylabel_lower='Volume', 
-                 addplot=ap)
+                 style='charles', ylabel='Price', ylabel_lower='Volume',
+                 addplot=ap, **kwargs)
 
-    def plot_income_chart(self, data, start_date=None, end_date=None, title=None):
+    @staticmethod
+    def _level_values(level, data):
         """
-        Plot income and profit chart
+        Expand a support/resistance level to one float per plotted bar
         """
-        plt.figure(figsize=(15, 8))
-        
+        if isinstance(level, pd.Series):
+            return pd.to_numeric(level.reindex(data.index), errors='coerce').astype(float).values
+        return [float(level)] * len(data)
+
+    @staticmethod
+    def _draw_income(revenue_ax, profit_ax, data, title=None, max_points=MAX_BARS):
+        # Long histories keep only the points that shape the lines
+        x = pd.to_datetime(data['date']).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        revenue = lttb(x, pd.to_numeric(data['revenue'], errors='coerce'), max_points)
+        profit = lttb(x, pd.to_numeric(data['profit'], errors='coerce'), max_points)
+
         # Plot revenue
-        plt.subplot(2, 1, 1)
-        plt.plot(data['date'], data['revenue'], label='Revenue', color='blue')
-        plt.title(title or 'Monthly Revenue')
-        plt.xlabel('Date')
-        plt.ylabel('Revenue')
-        plt.grid(True)
-        plt.legend()
+        revenue_ax.plot(data['date'].iloc[revenue], data['revenue'].iloc[revenue], label='Revenue', color='blue')
+        revenue_ax.set_title(title or 'Monthly Revenue')
+        revenue_ax.set_xlabel('Date')
+        revenue_ax.set_ylabel('Revenue')
+        revenue_ax.grid(True)
+        revenue_ax.legend()
 
         # Plot profit
-        plt.subplot(2, 1, 2)
-        plt.plot(data['date'], data['profit'], label='Profit', color='green')
-        plt.title('Monthly Profit')
-        plt.xlabel('Date')
-        plt.ylabel('Profit')
-        plt.grid(True)
-        plt.legend()
-
-        plt.tight_layout()
+        profit_ax.plot(data['date'].iloc[profit], data['profit'].iloc[profit], label='Profit', color='green')
+        profit_ax.set_title('Monthly Profit')
+        profit_ax.set_xlabel('Date')
+        profit_ax.set_ylabel('Profit')
+        profit_ax.grid(True)
+        profit_ax.legend()
+
+    @staticmethod
+    def show_image(path, title=None):
+        """
+        Show an already rendered chart file in a window
+        """
+        image = plt.imread(path)
+        height, width = image.shape[:2]
+        figure = plt.figure(figsize=(width / 100, height / 100))
+        ax = figure.add_axes([0, 0, 1, 1])
+        ax.imshow(image)
+        ax.axis('off')
+        if title and figure.canvas.manager is not None:
+            figure.canvas.manager.set_window_title(title)
         plt.show()
+
+    @metrics.measured('render')
+    def plot_income_chart(self, data, start_date=None, end_date=None, title=None, save_path=None):
+        """
+        Plot income and profit chart
+        save_path: write the chart to a PNG/SVG file instead of showing it (headless mode)
+        """
+        figure, (revenue_ax, profit_ax) = plt.subplots(2, 1, figsize=(15, 8))
+        self._draw_income(revenue_ax, profit_ax, data, title)
+        figure.tight_layout()
+
+        if save_path:
+            figure.savefig(save_path)
+            plt.close(figure)
+        else:
+            plt.show()
+
+class ChartRenderer:
+    """
+    Headless renderer that draws every chart on the same figure objects.
+    Creating the figure, the axes and the style is the expensive part of a small
+    chart, so a batch worker keeps one renderer and only clears the axes in between.
+    """
+    def __init__(self, figsize=(12, 8), dpi=100, style='charles'):
+        # No window is ever opened, render with the Agg backend
+        plt.switch_backend('Agg')
+        self.dpi = dpi
+        self.max_bars = int(figsize[0] * dpi) // PIXELS_PER_BAR
+
+        self.kline_figure = mpf.figure(style=style, figsize=figsize)
+        self.price_ax = self.kline_figure.add_subplot(4, 1, (1, 3))
+        self.volume_ax = self.kline_figure.add_subplot(4, 1, 4, sharex=self.price_ax)
+
+        self.income_figure = plt.figure(figsize=figsize)
+        self.revenue_ax = self.income_figure.add_subplot(2, 1, 1)
+        self.profit_ax = self.income_figure.add_subplot(2, 1, 2)
+
+    @metrics.measured('render')
+    def render_kline(self, data, save_path, start_date=None, end_date=None, support=None, resistance=None, title=None,
+                     pyramid=None):
+        data = StockDataPlotter._prepare_kline(data, start_date, end_date, self.max_bars, pyramid)
+        if data.empty:
+            return False
+
+        self.price_ax.clear()
+        self.volume_ax.clear()
+
+        ap = []
+        if support is not None:
+            ap.append(mpf.make_addplot(StockDataPlotter._level_values(support, data), ax=self.price_ax,
+                                       color='green', linestyle='--', width=1))
+        if resistance is not None:
+            ap.append(mpf.make_addplot(StockDataPlotter._level_values(resistance, data), ax=self.price_ax,
+                                       color='red', linestyle='--', width=1))
+
+        mpf.plot(data, type='candle', ax=self.price_ax, volume=self.volume_ax,
+                 axtitle=title or 'K-Line and Volume', ylabel='Price', ylabel_lower='Volume',
+                 addplot=ap)
+        self.kline_figure.savefig(save_path, dpi=self.dpi)
+        return True
+
+    @metrics.measured('render')
+    def render_income(self, data, save_path, title=None):
+        if data.empty:
+            return False
+
+        self.revenue_ax.clear()
+        self.profit_ax.clear()
+        StockDataPlotter._draw_income(self.revenue_ax, self.profit_ax, data, title, self.max_bars)
+        self.income_figure.tight_layout()
+        self.income_figure.savefig(save_path, dpi=self.dpi)
+        return True
+
+class ChartCache:
+    """
+    Rendered chart files keyed by everything that changes the picture, including
+    the last update date of the stock, so new bars invalidate the old charts.
+    The least recently used files are evicted when the cache grows over max_bytes.
+    """
+    def __init__(self, cache_dir=CHART_CACHE_DIR, max_bytes=CHART_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(stock_no, period, start_date=None, end_date=None, overlays=None, last_update=None, image_format='png'):
+        parts = [stock_no, period, start_date, end_date, overlays, last_update, image_format]
+        text = json.dumps([str(part) if part is not None else None for part in parts])
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def path(self, key, image_format='png'):
+        return os.path.join(self.cache_dir, f"{key}.{image_format}")
+
+    def get(self, key, image_format='png'):
+        """
+        Path of the cached chart or None, a hit marks the file as recently used
+        """
+        path = self.path(key, image_format)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return path
+
+    def reserve(self, key, image_format='png'):
+        """
+        Path to render a new chart to
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return self.path(key, image_format)
+
+    def fetch(self, key, render, image_format='png'):
+        """
+        Path of the chart, render(path) draws it first when it is not cached yet
+        """
+        path = self.get(key, image_format)
+        if path is not None:
+            return path
+
+        path = self.reserve(key, image_format)
+        # Render under a temporary name so other workers never see a half written file
+        temporary = os.path.join(self.cache_dir, f"{key}.{os.getpid()}.tmp.{image_format}")
+        try:
+            render(temporary)
+            os.replace(temporary, path)
+        except Exception:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Remove the least recently used charts until the cache fits in max_bytes.
+        Charts still being rendered by another worker are left alone.
+        """
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.is_file()]
+        except FileNotFoundError:
+            return
+        now = time.time()
+        stats = []
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if '.tmp.' in entry.name:
+                if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                continue
+            stats.append((stat.st_mtime, stat.st_size, entry.path))
+        stats.sort()
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,95 @@
+import io
+import os
+import re
+import time
+import pstats
+import cProfile
+import tracemalloc
+from datetime import datetime
+from scheduler import report_progress
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILE_DIR = 'profiles'
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 15
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if os.uname().sysname == 'Darwin' else rss / 2**10
+
+def profile_job(label, target, args, output_dir=PROFILE_DIR, top=TOP_FUNCTIONS):
+    """
+    Run target(*args) under cProfile and tracemalloc and write two reports named
+    after the label: <name>.prof with the raw statistics (pstats, snakeviz) and
+    <name>.txt with the hot functions, the largest allocations and the peak memory.
+    Pools started by the target run in other processes and are not profiled.
+    """
+    name = f"{datetime.now():%Y%m%d-%H%M%S}-{re.sub(r'[^A-Za-z0-9_.-]+', '-', label)}-{os.getpid()}"
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    started, cpu_started = time.perf_counter(), time.process_time()
+    profiler.enable()
+    try:
+        return target(*args)
+    finally:
+        profiler.disable()
+        wall, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            path = os.path.join(output_dir, name)
+            profiler.dump_stats(path + '.prof')
+            with open(path + '.txt', 'w') as f:
+                f.write(_report(label, profiler, snapshot, wall, cpu, peak, top))
+            report_progress(profile=path + '.txt')
+            print(f"Profile of {label} written to {path}.txt")
+        except Exception as e:
+            print(f"Error writing profile of {label}: {e}")
+
+def _report(label, profiler, snapshot, wall, cpu, peak, top):
+    rss = _max_rss_mb()
+    lines = [f"{label}: wall {wall:.2f}s, cpu {cpu:.2f}s, peak {peak / 2**20:.1f} MB traced"
+             + (f", {rss:.0f} MB max RSS" if rss is not None else "")]
+
+    for order, title in (('cumulative', 'cumulative time'), ('tottime', 'own time')):
+        buffer = io.StringIO()
+        pstats.Stats(profiler, stream=buffer).strip_dirs().sort_stats(order).print_stats(top)
+        lines.append(f"\nHot functions by {title} (top {top}):")
+        # Skip the header pstats prints before the table
+        table = buffer.getvalue()
+        lines.append(table[table.find('   ncalls'):].rstrip() if '   ncalls' in table else table.rstrip())
+
+    lines.append(f"\nLargest allocations still alive at the end (top {TOP_ALLOCATIONS}):")
+    statistics = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics('lineno')
+    for statistic in statistics[:TOP_ALLOCATIONS]:
+        frame = statistic.traceback[0]
+        lines.append(f"{statistic.size / 2**10:10.1f} KiB {statistic.count:8d} blocks  "
+                     f"{os.path.basename(frame.filename)}:{frame.lineno}")
+    return '\n'.join(lines) + '\n'
+
+def list_reports(since=None, output_dir=PROFILE_DIR):
+    """
+    (path, summary line) of the text reports written after since, oldest first
+    """
+    try:
+        entries = [entry for entry in os.scandir(output_dir) if entry.name.endswith('.txt')]
+    except FileNotFoundError:
+        return []
+    cutoff = since.timestamp() if since else 0
+    reports = []
+    for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+        if entry.stat().st_mtime < cutoff:
+            continue
+        with open(entry.path) as f:
+            reports.append((entry.path, f.readline().strip()))
+    return reports
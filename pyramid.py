@@ -0,0 +1,191 @@
+import os
+import numpy as np
+import pandas as pd
+import metrics
+
+CACHE_DIR = os.path.join('.cache', 'pyramid')
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+def to_arrays(data: pd.DataFrame):
+    """
+    Date and float OHLCV arrays from a fetcher frame
+    """
+    return {
+        'date': pd.to_datetime(data['date']).to_numpy(dtype='datetime64[ns]'),
+        'open': pd.to_numeric(data['open_price'], errors='coerce').to_numpy(dtype=float),
+        'high': pd.to_numeric(data['high_price'], errors='coerce').to_numpy(dtype=float),
+        'low': pd.to_numeric(data['low_price'], errors='coerce').to_numpy(dtype=float),
+        'close': pd.to_numeric(data['close_price'], errors='coerce').to_numpy(dtype=float),
+        'volume': pd.to_numeric(data['volume'], errors='coerce').to_numpy(dtype=float),
+    }
+
+def to_frame(bars):
+    """
+    Arrays back to the column layout of the fetcher frames
+    """
+    return pd.DataFrame({
+        'date': bars['date'],
+        'open_price': bars['open'],
+        'high_price': bars['high'],
+        'low_price': bars['low'],
+        'close_price': bars['close'],
+        'volume': bars['volume'],
+    })
+
+@metrics.measured('aggregate')
+def aggregate_bars(bars, starts):
+    """
+    Merge consecutive bars into segments beginning at the indexes in starts.
+    Open/date are the first of a segment, high the max, low the min, close the last
+    and volume the sum, each one segment reduction over the whole array.
+    """
+    starts = np.asarray(starts, dtype=np.intp)
+    if len(starts) == 0:
+        return {key: values[:0] for key, values in bars.items()}
+    ends = np.append(starts[1:], len(bars['close'])) - 1
+    return {
+        'date': bars['date'][starts],
+        'open': bars['open'][starts],
+        'high': np.fmax.reduceat(bars['high'], starts),
+        'low': np.fmin.reduceat(bars['low'], starts),
+        'close': bars['close'][ends],
+        'volume': np.add.reduceat(np.nan_to_num(bars['volume']), starts),
+    }
+
+def downsample_bars(bars, max_bars):
+    """
+    At most max_bars candles covering the same range.
+    Buckets of equal size keep every extreme: a bucket's high/low are the max/min of its bars.
+    """
+    count = len(bars['close'])
+    if max_bars <= 0 or count <= max_bars:
+        return bars
+    factor = -(-count // max_bars)
+    return aggregate_bars(bars, np.arange(0, count, factor))
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a line to threshold points.
+    Keeps the points that shape the line visually (peaks, troughs, turns).
+    x must be numeric and increasing, returns the indexes of the kept points.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+
+    # First and last points are always kept, the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.intp)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = count - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket is the third corner of the triangle
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else count
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+
+        area = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(np.nanargmax(area)) if not np.isnan(area).all() else start
+        selected[bucket + 1] = previous
+    return selected
+
+class BarPyramid:
+    """
+    Precomputed levels of one bar history, level k merges 2**k bars of the base.
+    A chart of any range then starts from the level closest to its pixel budget
+    instead of aggregating the whole history on every render.
+    """
+    def __init__(self, levels):
+        self.levels = levels
+
+    @classmethod
+    def build(cls, data: pd.DataFrame, min_bars=64):
+        levels = [to_arrays(data)]
+        while len(levels[-1]['close']) > min_bars:
+            base = levels[-1]
+            levels.append(aggregate_bars(base, np.arange(0, len(base['close']), 2)))
+        return cls(levels)
+
+    @property
+    def last_date(self):
+        dates = self.levels[0]['date']
+        return dates[-1] if len(dates) else None
+
+    def matches(self, data: pd.DataFrame):
+        """
+        True when the pyramid was built from these bars: same count and same last bar.
+        The last bar of a week/month keeps its date while new days update its values.
+        """
+        base = self.levels[0]
+        if len(base['close']) != len(data):
+            return False
+        if data.empty:
+            return True
+        last = to_arrays(data.iloc[-1:])
+        return all(np.array_equal(base[key][-1:], last[key], equal_nan=key != 'date') for key in ('date',) + COLUMNS)
+
+    def get(self, max_bars, start_date=None, end_date=None):
+        """
+        Bars of the date range, at most max_bars of them
+        """
+        base_dates = self.levels[0]['date']
+        start = 0 if start_date is None else np.searchsorted(base_dates, np.datetime64(pd.to_datetime(start_date)), 'left')
+        end = len(base_dates) if end_date is None else np.searchsorted(base_dates, np.datetime64(pd.to_datetime(end_date)), 'right')
+        count = max(end - start, 0)
+
+        # Coarsest level that still has at least max_bars bars in the range
+        level = 0
+        while level + 1 < len(self.levels) and count // 2 ** (level + 1) >= max_bars:
+            level += 1
+        bars = self.levels[level]
+        first = np.searchsorted(bars['date'], base_dates[start], 'right') - 1 if count else 0
+        last = np.searchsorted(bars['date'], base_dates[end - 1], 'right') if count else 0
+        selected = {key: values[max(first, 0):last] for key, values in bars.items()}
+        return downsample_bars(selected, max_bars)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        arrays = {f'{level}_{key}': values for level, bars in enumerate(self.levels) for key, values in bars.items()}
+        # np.savez appends .npz to names without it, keep the temporary name ending with it
+        np.savez(path + '.tmp.npz', **arrays)
+        os.replace(path + '.tmp.npz', path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            count = len({name.split('_')[0] for name in stored.files})
+            levels = [{key: stored[f'{level}_{key}'] for key in ('date',) + COLUMNS} for level in range(count)]
+        return cls(levels)
+
+class PyramidCache:
+    """
+    Pyramids on disk per stock and period, rebuilt when the bars change
+    """
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def path(self, stock_no, period):
+        return os.path.join(self.cache_dir, f"{stock_no}_{period}.npz")
+
+    def get(self, stock_no, period, data: pd.DataFrame):
+        path = self.path(stock_no, period)
+        try:
+            pyramid = BarPyramid.load(path)
+            if pyramid.matches(data):
+                return pyramid
+        except (FileNotFoundError, KeyError, ValueError):
+            pass
+        except Exception as e:
+            print(f"Error loading bar pyramid for {stock_no}: {e}")
+
+        pyramid = BarPyramid.build(data)
+        try:
+            pyramid.save(path)
+        except Exception as e:
+            print(f"Error saving bar pyramid for {stock_no}: {e}")
+        return pyramid
@@ -0,0 +1,103 @@
+import re
+import numpy as np
+import pandas as pd
+from pyramid import to_arrays, to_frame, aggregate_bars
+
+# Calendar periods, any other period is a number of trading days like '5D'
+PERIOD_NAMES = {'D': 'Daily', 'W': 'Weekly', 'M': 'Monthly', 'Q': 'Quarterly', 'Y': 'Yearly'}
+
+def trading_days(period):
+    """
+    Bars per segment of an N-day period, None for the calendar periods
+    """
+    match = re.fullmatch(r'([1-9][0-9]*)D', period)
+    return int(match.group(1)) if match else None
+
+def period_text(period):
+    return PERIOD_NAMES.get(period) or f"{trading_days(period)}-Day"
+
+def date_format(period):
+    """
+    strftime format of the bar dates of a period
+    """
+    return '%Y-%m' if period in ('M', 'Q', 'Y') else '%Y-%m-%d'
+
+def period_end(day, period):
+    """
+    Last calendar day of the period holding day, None for N-day periods whose
+    bounds depend on the first bar of the history
+    """
+    day = pd.Timestamp(day).normalize()
+    if period == 'D':
+        return day.date()
+    if period == 'W':
+        return (day + pd.Timedelta(days=6 - day.weekday())).date()
+    offsets = {'M': pd.offsets.MonthEnd(0), 'Q': pd.offsets.QuarterEnd(0), 'Y': pd.offsets.YearEnd(0)}
+    if period in offsets:
+        return (day + offsets[period]).date()
+    return None
+
+def _period_keys(days, period):
+    """
+    Period number of every day, equal for the days of one week, month, quarter or year
+    """
+    if period == 'W':
+        # 1970-01-01 was a Thursday, shifting by 3 days makes weeks start on Monday
+        return (days.astype(np.int64) + 3) // 7
+    months = days.astype('datetime64[M]').astype(np.int64)
+    if period == 'M':
+        return months
+    if period == 'Q':
+        return months // 3
+    if period == 'Y':
+        return months // 12
+    raise ValueError(f"Unknown period {period}")
+
+def period_starts(dates, period):
+    """
+    Indexes of the first bar of every period in a sorted date array
+    """
+    count = len(dates)
+    days = trading_days(period)
+    if period == 'D' or days == 1:
+        return np.arange(count)
+    if days:
+        # N trading days counted from the first bar
+        return np.arange(0, count, days)
+    keys = _period_keys(np.asarray(dates).astype('datetime64[D]'), period)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if count else np.empty(0, dtype=np.intp)
+
+def period_labels(dates, period):
+    """
+    Date of the bar of each period: the Monday of a week, the first day of a month,
+    quarter or year, and the first trading day of an N-day period
+    """
+    days = np.asarray(dates).astype('datetime64[D]')
+    if period == 'W':
+        labels = days - (days.astype(np.int64) + 3) % 7
+    elif period in ('M', 'Q', 'Y'):
+        months = days.astype('datetime64[M]').astype(np.int64)
+        step = {'M': 1, 'Q': 3, 'Y': 12}[period]
+        labels = (months - months % step).astype('datetime64[M]').astype('datetime64[D]')
+    else:
+        labels = days
+    return labels.astype('datetime64[ns]')
+
+def resample(bars, period):
+    """
+    Bars of a period from daily arrays (see pyramid.to_arrays) in one pass:
+    one segment reduction per column over the period boundaries
+    """
+    if period == 'D':
+        return bars
+    result = aggregate_bars(bars, period_starts(bars['date'], period))
+    result['date'] = period_labels(result['date'], period)
+    return result
+
+def resample_frame(data: pd.DataFrame, period):
+    """
+    Daily fetcher frame to the bars of a period, in the same column layout
+    """
+    if period == 'D' or data.empty:
+        return data
+    return to_frame(resample(to_arrays(data), period))
@@ -0,0 +1,175 @@
+import mysql.connector
+import pandas as pd
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from analyzer import StockPatternAnalyzer, ANALYZER_VERSION
+from fetcher import StockDataFetcher
+from resample import period_end
+import metrics
+
+RESULT_FIELDS = ('support', 'resistance', 'is_consolidation', 'support_touches',
+                 'resistance_touches', 'is_breakout', 'is_breakdown')
+
+def _day(value):
+    if value is None:
+        return None
+    return value.date() if isinstance(value, datetime) else value
+
+def _result(row):
+    """
+    Analyzer result dict from the stored columns
+    """
+    support, resistance, consolidation, support_touches, resistance_touches, breakout, breakdown = row
+    return {
+        "support": float(support) if support is not None else float('nan'),
+        "resistance": float(resistance) if resistance is not None else float('nan'),
+        "is_consolidation": bool(consolidation),
+        "resistance_touches": int(resistance_touches or 0),
+        "support_touches": int(support_touches or 0),
+        "is_breakout": bool(breakout),
+        "is_breakdown": bool(breakdown)
+    }
+
+class AnalysisCache:
+    """
+    Results of StockPatternAnalyzer in the analysis_results table, keyed by stock,
+    period, date range and analyzer version.
+    A result stays valid while the last update date of the stock is the one it was
+    computed from, and for good once its range ended before that date.
+    """
+    def __init__(self, connection, queries, version=ANALYZER_VERSION):
+        self.connection = connection
+        self.queries = queries
+        self.version = version
+
+    @staticmethod
+    def range_key(start_date=None, end_date=None):
+        start, end = _day(start_date), _day(end_date)
+        return f"{start or ''}:{end or ''}"
+
+    @staticmethod
+    def is_fresh(stored_update, last_update, end_date=None, period='D'):
+        if stored_update is None:
+            return False
+        if stored_update == _day(last_update):
+            return True
+        if end_date is None:
+            return False
+        # Days after the end of the range cannot change its result once the period
+        # holding the end is over, until then they still move its last bar
+        end = period_end(end_date, period)
+        return end is not None and stored_update >= end
+
+    def get(self, stock_no, period, start_date, end_date, last_update):
+        """
+        Stored result or None when it is missing or stale
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(self.queries['Get analysis result'],
+                       (stock_no, period, self.range_key(start_date, end_date), self.version))
+        row = cursor.fetchone()
+        cursor.close()
+        if row is None or not self.is_fresh(row[0], last_update, end_date, period):
+            return None
+        return _result(row[1:])
+
+    def save(self, stock_no, period, start_date, end_date, last_update, result):
+        values = [None if pd.isna(result[field]) else result[field] for field in RESULT_FIELDS]
+        cursor = self.connection.cursor()
+        cursor.execute(self.queries['Save analysis result'],
+                       (stock_no, period, self.range_key(start_date, end_date), self.version, _day(last_update),
+                        *values))
+        self.connection.commit()
+        cursor.close()
+
+    def get_all(self, period, start_date=None, end_date=None):
+        """
+        Stored results of every stock as {stock_no: (last_update, result)}
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(self.queries['Get scan results'],
+                       (period, self.range_key(start_date, end_date), self.version))
+        rows = cursor.fetchall()
+        cursor.close()
+        return {row[0]: (row[1], _result(row[2:])) for row in rows}
+
+def analyze_cached(fetcher, cache, period='D', start_date=None, end_date=None, last_update=None, load=None):
+    """
+    Analyzer result of the fetcher's stock, computed and stored only when the cache has no fresh one.
+    load: function returning the prices, by default they are read with the fetcher
+    Returns the result and whether it came from the cache.
+    """
+    last_update = last_update or fetcher.get_last_update_date()
+    result = cache.get(fetcher.stock_no, period, start_date, end_date, last_update)
+    if result is not None:
+        return result, True
+
+    data = load() if load is not None else fetcher.get_aggregated_data_from_db(period)
+    result = StockPatternAnalyzer(data, start_date, end_date).analyze()
+    cache.save(fetcher.stock_no, period, start_date, end_date, last_update, result)
+    return result, False
+
+# Database connection of a pool worker, opened once by _init_worker
+_connection = None
+
+def _init_worker(db_config, metrics_sink=None):
+    global _connection
+    metrics.set_sink(metrics_sink)
+    _connection = mysql.connector.connect(**db_config)
+
+def scan_stock(stock_no, db_config, period, start_date, end_date, last_update):
+    """
+    Analyze one changed stock and store the result, runs inside a pool worker
+    """
+    global _connection
+    try:
+        if not _connection.is_connected():
+            _connection = mysql.connector.connect(**db_config)
+        fetcher = StockDataFetcher(db_config, stock_no, None, None)
+        fetcher.db_connection = _connection
+        cache = AnalysisCache(_connection, fetcher.queries['analysis'])
+        result, _ = analyze_cached(fetcher, cache, period, start_date, end_date, last_update)
+        return stock_no, result
+    except Exception as e:
+        print(f"Error scanning stock {stock_no}: {e}")
+        return stock_no, None
+    finally:
+        metrics.flush()
+
+def scan_universe(db_config, period='D', start_date=None, end_date=None, processes=None):
+    """
+    Analyzer results of every stock in the database. Only stocks updated since their
+    stored result are analyzed again, in a process pool.
+    Returns a frame of the results and the number of stocks recomputed.
+    """
+    fetcher = StockDataFetcher(db_config, "", None, None)
+    fetcher.connect_db()
+    try:
+        cursor = fetcher.db_connection.cursor()
+        cursor.execute(fetcher.queries['analysis']['List stock versions'])
+        versions = dict(cursor.fetchall())
+        cursor.close()
+        stored = AnalysisCache(fetcher.db_connection, fetcher.queries['analysis']).get_all(period, start_date, end_date)
+    finally:
+        fetcher.disconnect_db()
+
+    results = {}
+    stale = []
+    for stock_no, last_update in versions.items():
+        update, result = stored.get(stock_no, (None, None))
+        if AnalysisCache.is_fresh(update, last_update, end_date, period):
+            results[stock_no] = result
+        else:
+            stale.append((stock_no, db_config, period, start_date, end_date, last_update))
+
+    if stale:
+        processes = min(processes or cpu_count(), len(stale))
+        with Pool(processes=processes, initializer=_init_worker,
+                  initargs=(db_config, metrics.get_sink())) as pool:
+            for stock_no, result in pool.starmap(scan_stock, stale, chunksize=4):
+                if result is not None:
+                    results[stock_no] = result
+
+    frame = pd.DataFrame([dict(stock_no=stock_no, last_update=versions[stock_no], **result)
+                          for stock_no, result in sorted(results.items())])
+    return frame, len(stale)
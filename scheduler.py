@@ -0,0 +1,228 @@
+import heapq
+import queue
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import metrics
+
+# Lower runs first: interactive commands go ahead of bulk updates
+PRIORITY = {
+    'plot': 0,
+    'list': 0,
+    'analyze': 1,
+    'indicator': 1,
+    'update': 2,
+}
+DEFAULT_PRIORITY = 1
+
+# Jobs of one type running at the same time, TWSE throttles parallel downloads
+CONCURRENCY = {
+    'update': 2,
+}
+
+# Progress channel of the current pool worker, set by init_progress and run_job
+_progress = {'queue': None, 'job_id': None}
+
+def init_progress(progress_queue):
+    _progress['queue'] = progress_queue
+
+def report_progress(**values):
+    """
+    Send progress counters of the running job to the shell, e.g. months=3, rows=60
+    """
+    if _progress['queue'] is None or _progress['job_id'] is None:
+        return
+    try:
+        _progress['queue'].put_nowait((_progress['job_id'], values))
+    except Exception:
+        pass
+
+def run_job(job_id, target, args):
+    """
+    Entry point of a job inside a pool worker
+    """
+    _progress['job_id'] = job_id
+    try:
+        return target(*args)
+    finally:
+        _progress['job_id'] = None
+        metrics.flush()
+
+@dataclass(order=True)
+class Job:
+    priority: int
+    sequence: int
+    job_id: str = field(compare=False)
+    job_type: str = field(compare=False)
+    stock_no: str = field(compare=False)
+    target: Callable = field(compare=False, repr=False)
+    args: tuple = field(compare=False, repr=False)
+    key: Any = field(compare=False)
+    status: str = field(default='queued', compare=False)
+    submit_time: datetime = field(default_factory=datetime.now, compare=False)
+    start_time: Optional[datetime] = field(default=None, compare=False)
+    end_time: Optional[datetime] = field(default=None, compare=False)
+    progress: Dict[str, Any] = field(default_factory=dict, compare=False)
+    coalesced: int = field(default=0, compare=False)
+    result: Any = field(default=None, compare=False, repr=False)
+    # Arguments of a second run asked for while the job was already running
+    rerun_args: Optional[tuple] = field(default=None, compare=False, repr=False)
+
+    @property
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        return ((self.end_time or datetime.now()) - self.start_time).total_seconds()
+
+    def describe_progress(self):
+        """
+        Progress counters and the throughput of rows written
+        """
+        if not self.progress:
+            return ''
+        parts = [f"{name}={value}" for name, value in self.progress.items()]
+        rows = self.progress.get('rows')
+        if rows and self.elapsed > 0:
+            parts.append(f"{rows / self.elapsed:.1f} rows/s")
+        return ', '.join(parts)
+
+class JobScheduler:
+    """
+    Priority queue of jobs in front of the worker pool.
+    A job with the same key as a queued or running one is coalesced into it,
+    and each job type is capped to its number of concurrent jobs.
+    on_complete: called with every finished job in the result thread of the pool,
+    it must not raise
+    """
+    def __init__(self, pool, pool_size, progress_queue=None, concurrency=None, on_complete=None):
+        self.pool = pool
+        self.pool_size = pool_size
+        self.progress_queue = progress_queue
+        self.concurrency = dict(CONCURRENCY, **(concurrency or {}))
+        self.on_complete = on_complete
+
+        self.lock = threading.Lock()
+        self.pending: List[Job] = []
+        self.jobs: Dict[str, Job] = {}
+        self.active: Dict[Any, Job] = {}
+        self.running: Dict[str, int] = {}
+        self.finished: List[Job] = []
+        self.sequence = 0
+
+    def submit(self, job_type, stock_no, target, args, key=None, merge=None):
+        """
+        Queue a job, returns it and whether it was merged into an existing one
+        merge: called with the target and arguments of the job of the same key, returns the
+        arguments covering both requests. A queued job takes them over, a running one
+        runs once more with them when they differ from what it is running.
+        """
+        # Arguments hold dicts like the database config, compare them by their repr
+        key = key if key is not None else (job_type, stock_no, repr(args))
+        with self.lock:
+            existing = self.active.get(key)
+            if existing is not None:
+                existing.coalesced += 1
+                if merge is not None:
+                    self._merge(existing, merge)
+                return existing, True
+
+            job = self._queue(job_type, stock_no, target, args, key)
+            self._dispatch()
+        return job, False
+
+    def _queue(self, job_type, stock_no, target, args, key):
+        """
+        Add a new job to the queue, called with the lock held
+        """
+        self.sequence += 1
+        job = Job(PRIORITY.get(job_type, DEFAULT_PRIORITY), self.sequence, f"J{self.sequence}",
+                  job_type, stock_no, target, args, key)
+        self.jobs[job.job_id] = job
+        self.active[key] = job
+        heapq.heappush(self.pending, job)
+        return job
+
+    def _merge(self, job, merge):
+        """
+        Fold the arguments of a coalesced request into a job, called with the lock held
+        """
+        if job.status == 'queued':
+            job.args = merge(job.target, job.args)
+            return
+        args = merge(job.target, job.rerun_args or job.args)
+        if args != job.args:
+            job.rerun_args = args
+
+    def _dispatch(self):
+        """
+        Start the best queued jobs while workers and type slots are free, called with the lock held
+        """
+        busy = sum(self.running.values())
+        skipped = []
+        while self.pending and busy < self.pool_size:
+            job = heapq.heappop(self.pending)
+            limit = self.concurrency.get(job.job_type, self.pool_size)
+            if self.running.get(job.job_type, 0) >= limit:
+                skipped.append(job)
+                continue
+
+            job.status = 'running'
+            job.start_time = datetime.now()
+            self.running[job.job_type] = self.running.get(job.job_type, 0) + 1
+            busy += 1
+            # Workers return False when they caught an error of their own
+            self.pool.apply_async(run_job, (job.job_id, job.target, job.args),
+                                  callback=lambda result, job=job: self._complete(
+                                      job, 'failed' if result is False else 'completed', result),
+                                  error_callback=lambda _, job=job: self._complete(job, 'failed'))
+        for job in skipped:
+            heapq.heappush(self.pending, job)
+
+    def _complete(self, job, status, result=None):
+        """
+        Result callback of the pool, runs in its result handler thread
+        """
+        with self.lock:
+            job.status = status
+            job.result = result
+            job.end_time = datetime.now()
+            metrics.observe(f"job_{job.job_type}", job.elapsed)
+            metrics.count(f"jobs_{status}")
+            self.running[job.job_type] -= 1
+            self.active.pop(job.key, None)
+            self.finished.append(job)
+            if job.rerun_args is not None:
+                self._queue(job.job_type, job.stock_no, job.target, job.rerun_args, job.key)
+            self._dispatch()
+        if self.on_complete is not None:
+            self.on_complete(job)
+
+    def poll(self):
+        """
+        Collect the progress reports and return the jobs finished since the last poll
+        """
+        if self.progress_queue is not None:
+            while True:
+                try:
+                    job_id, values = self.progress_queue.get_nowait()
+                except (queue.Empty, EOFError, OSError):
+                    break
+                # Metrics sent by the workers after their jobs
+                if job_id is None:
+                    metrics.REGISTRY.merge(values['metrics'])
+                    continue
+                job = self.jobs.get(job_id)
+                if job is not None:
+                    job.progress.update(values)
+
+        with self.lock:
+            finished, self.finished = self.finished, []
+        return finished
+
+    def cancel_pending(self):
+        with self.lock:
+            for job in self.pending:
+                job.status = 'cancelled'
+                self.active.pop(job.key, None)
+            self.pending = []
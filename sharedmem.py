@@ -0,0 +1,193 @@
+import time
+import hashlib
+from multiprocessing import shared_memory, resource_tracker
+
+# numpy and pandas are imported by the methods the workers call,
+# the shell only creates the registry and must start without them
+
+SHARED_MEMORY_MAX_BYTES = 512 * 1024 * 1024
+PRICE_COLUMNS = ('open_price', 'high_price', 'low_price', 'close_price', 'volume')
+
+def _segment_name(key):
+    # macOS limits shared memory names to 31 characters
+    return 'sana_' + hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+def _open_segment(name, create=False, size=0):
+    """
+    Open a segment without handing it to the resource tracker of this process,
+    the shell owns the segments and unlinks them, not the worker that made them
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        # Python < 3.13 always tracks, undo the registration
+        segment = shared_memory.SharedMemory(name=name, create=create, size=size)
+        try:
+            resource_tracker.unregister(segment._name, 'shared_memory')
+        except Exception:
+            pass
+        return segment
+
+def _unlink(name):
+    try:
+        # Tracked on open and untracked again by unlink
+        segment = shared_memory.SharedMemory(name=name)
+        segment.close()
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+class SharedFrameStore:
+    """
+    Loaded OHLCV arrays published in named shared memory segments, keyed by
+    stock, period and data version (StockDataFetcher.get_data_version).
+    A segment holds the dates as int64 followed by a (5 x rows) float64 block.
+    The registry lives in a manager process shared by the shell and the workers:
+    it counts the workers attached to each segment and evicts the least recently
+    used unattached segments when the total goes over max_bytes.
+    """
+    def __init__(self, registry, settings, lock):
+        self.registry = registry
+        self.settings = settings
+        self.lock = lock
+        self.attached = []
+
+    @classmethod
+    def create(cls, manager, max_bytes=SHARED_MEMORY_MAX_BYTES):
+        store = cls(manager.dict(), manager.dict(), manager.Lock())
+        store.settings['max_bytes'] = max_bytes
+        return store
+
+    def __getstate__(self):
+        # Segments attached in one process are never handed to another one
+        return {'registry': self.registry, 'settings': self.settings, 'lock': self.lock}
+
+    def __setstate__(self, state):
+        self.__init__(state['registry'], state['settings'], state['lock'])
+
+    @property
+    def max_bytes(self):
+        return self.settings.get('max_bytes', SHARED_MEMORY_MAX_BYTES)
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        self.settings['max_bytes'] = value
+        with self.lock:
+            self._evict()
+
+    def attach(self, stock_no, period, version):
+        """
+        Frame backed by the shared segment without copying, None when not published
+        """
+        import numpy as np
+        import pandas as pd
+
+        key = (stock_no, period, str(version))
+        with self.lock:
+            entry = self.registry.get(key)
+            if entry is None:
+                return None
+            entry['refs'] += 1
+            entry['last_used'] = time.time()
+            self.registry[key] = entry
+
+        try:
+            segment = _open_segment(entry['name'])
+        except FileNotFoundError:
+            with self.lock:
+                self.registry.pop(key, None)
+            return None
+        self.attached.append((key, segment))
+
+        rows = entry['rows']
+        dates = np.ndarray((rows,), dtype=np.int64, buffer=segment.buf)
+        values = np.ndarray((len(PRICE_COLUMNS), rows), dtype=np.float64, buffer=segment.buf, offset=rows * 8)
+        # Other workers read the same pages, nothing may write through the frame
+        dates.flags.writeable = False
+        values.flags.writeable = False
+        data = pd.DataFrame(values.T, columns=list(PRICE_COLUMNS), copy=False)
+        data.insert(0, 'date', dates.view('datetime64[ns]'))
+        return data
+
+    def publish(self, stock_no, period, version, data):
+        """
+        Copy a loaded frame into a new segment for the next workers
+        """
+        import numpy as np
+        import pandas as pd
+
+        if data.empty:
+            return
+        key = (stock_no, period, str(version))
+        rows = len(data)
+        size = rows * 8 * (1 + len(PRICE_COLUMNS))
+        name = _segment_name(key)
+
+        try:
+            segment = _open_segment(name, create=True, size=size)
+        except FileExistsError:
+            # Published by another worker in the meantime
+            return
+        try:
+            dates = np.ndarray((rows,), dtype=np.int64, buffer=segment.buf)
+            dates[:] = pd.to_datetime(data['date']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+            values = np.ndarray((len(PRICE_COLUMNS), rows), dtype=np.float64, buffer=segment.buf, offset=rows * 8)
+            for i, column in enumerate(PRICE_COLUMNS):
+                values[i] = pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=float)
+            del dates, values
+        finally:
+            segment.close()
+
+        with self.lock:
+            self.registry[key] = {'name': name, 'rows': rows, 'bytes': size, 'refs': 0, 'last_used': time.time()}
+            # Older versions of the same stock and period are never read again
+            for other, entry in list(self.registry.items()):
+                if other[:2] == key[:2] and other != key and entry['refs'] <= 0:
+                    _unlink(entry['name'])
+                    self.registry.pop(other, None)
+            self._evict()
+
+    def release(self):
+        """
+        Detach every segment attached by this process since the last release
+        """
+        attached, self.attached = self.attached, []
+        for key, segment in attached:
+            with self.lock:
+                entry = self.registry.get(key)
+                if entry is not None:
+                    entry['refs'] = max(entry['refs'] - 1, 0)
+                    self.registry[key] = entry
+            try:
+                segment.close()
+            except BufferError:
+                # A frame still points into the segment, the mapping goes with it
+                pass
+
+    def _evict(self):
+        """
+        Unlink the least recently used unattached segments over the cap, called with the lock held
+        """
+        entries = list(self.registry.items())
+        total = sum(entry['bytes'] for _, entry in entries)
+        for key, entry in sorted(entries, key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if entry['refs'] > 0:
+                continue
+            _unlink(entry['name'])
+            self.registry.pop(key, None)
+            total -= entry['bytes']
+
+    def usage(self):
+        entries = list(self.registry.values())
+        return len(entries), sum(entry['bytes'] for entry in entries)
+
+    def clear(self):
+        """
+        Unlink every segment, used by the shell on exit
+        """
+        with self.lock:
+            for key, entry in list(self.registry.items()):
+                _unlink(entry['name'])
+                self.registry.pop(key, None)
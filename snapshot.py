@@ -0,0 +1,261 @@
+import io
+import os
+import json
+import hashlib
+import numpy as np
+import mysql.connector
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from fetcher import SQLLoader, StockDataFetcher
+import metrics
+
+SNAPSHOT_DIR = 'snapshot'
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+
+# Stored columns of each table and their array types, in the order of the export queries
+TABLES = {
+    'prices': (('date', 'datetime64[D]'), ('volume', 'int64'), ('turnover', 'int64'),
+               ('open_price', 'float64'), ('high_price', 'float64'), ('low_price', 'float64'),
+               ('close_price', 'float64'), ('price_change', 'str'), ('transaction_count', 'int64')),
+    'income': (('date', 'datetime64[D]'), ('revenue', 'int64'), ('profit', 'int64')),
+}
+
+# NULL of the integer columns, prices use NaN and price_change an empty string
+INT_NULL = np.iinfo(np.int64).min
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _to_arrays(table, rows):
+    """
+    Column arrays of the rows of one partition, the stock number column dropped
+    """
+    arrays = {}
+    for index, (name, dtype) in enumerate(TABLES[table], start=1):
+        values = [row[index] for row in rows]
+        if dtype == 'int64':
+            arrays[name] = np.array([INT_NULL if value is None else int(value) for value in values], dtype=np.int64)
+        elif dtype == 'float64':
+            arrays[name] = np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+        elif dtype == 'str':
+            arrays[name] = np.array(['' if value is None else str(value) for value in values])
+        else:
+            arrays[name] = np.array(values, dtype=dtype)
+    return arrays
+
+def _to_rows(table, stock_no, arrays):
+    """
+    Parameter tuples of the import query from the arrays of one partition
+    """
+    columns = []
+    for name, dtype in TABLES[table]:
+        values = arrays[name]
+        if dtype == 'int64':
+            columns.append([None if value == INT_NULL else value for value in values.tolist()])
+        elif dtype == 'float64':
+            columns.append([None if value != value else round(value, 2) for value in values.tolist()])
+        elif dtype == 'str':
+            columns.append([value or None for value in values.tolist()])
+        else:
+            columns.append(values.tolist())
+    return [(stock_no, *row) for row in zip(*columns)]
+
+def _write_partition(path, table, stock_no, year, rows):
+    """
+    One compressed file of a stock and year, returns its manifest entry
+    """
+    name = f"{table}/{stock_no}/{year}.npz"
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **_to_arrays(table, rows))
+    data = buffer.getvalue()
+    os.makedirs(os.path.join(path, table, stock_no), exist_ok=True)
+    with open(os.path.join(path, name), 'wb') as f:
+        f.write(data)
+    return name, {'table': table, 'stock_no': stock_no, 'year': year, 'rows': len(rows),
+                  'bytes': len(data), 'sha256': _sha256(data)}
+
+def export_snapshot(db_config, path=SNAPSHOT_DIR, mmap=False, chunk_size=50000):
+    """
+    Write stock_prices and stock_income as compressed column files, one per table,
+    stock and year, and a manifest with the checksum of every file.
+    The tables are streamed in key order, so only one partition is held in memory.
+    mmap: also write the price panel as .npy matrices that analytics can memory map
+    Returns the manifest.
+    """
+    queries = SQLLoader.load_query('snapshot.sql')
+    manifest = {'format': FORMAT_VERSION, 'created': datetime.now().isoformat(timespec='seconds'),
+                'files': {}}
+    os.makedirs(path, exist_ok=True)
+    # An existing manifest would vouch for a half written snapshot
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        os.remove(os.path.join(path, MANIFEST))
+
+    connection = mysql.connector.connect(**db_config)
+    try:
+        for table, query in (('prices', 'Export prices'), ('income', 'Export income')):
+            cursor = connection.cursor(buffered=False)
+            cursor.execute(queries[query])
+            key, rows = None, []
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                for row in chunk:
+                    row_key = (row[0], row[1].year)
+                    if row_key != key:
+                        if rows:
+                            name, entry = _write_partition(path, table, key[0], key[1], rows)
+                            manifest['files'][name] = entry
+                        key, rows = row_key, []
+                    rows.append(row)
+                if not chunk:
+                    break
+                metrics.count('rows_read', len(chunk))
+            if rows:
+                name, entry = _write_partition(path, table, key[0], key[1], rows)
+                manifest['files'][name] = entry
+            cursor.close()
+    finally:
+        connection.close()
+
+    if mmap:
+        from panel import PricePanel
+        panel = PricePanel.from_snapshot(path, mmap=False, manifest=manifest)
+        panel.save(os.path.join(path, 'panel'))
+        for field in ('symbols', 'dates') + tuple(panel.fields):
+            name = f"panel/{field}.npy"
+            with open(os.path.join(path, name), 'rb') as f:
+                data = f.read()
+            manifest['files'][name] = {'table': 'panel', 'bytes': len(data), 'sha256': _sha256(data)}
+
+    with open(os.path.join(path, MANIFEST + '.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(os.path.join(path, MANIFEST + '.tmp'), os.path.join(path, MANIFEST))
+    return manifest
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format')}")
+    return manifest
+
+def read_partition(path, name, entry=None):
+    """
+    Arrays of one partition file, checked against its manifest entry when given
+    """
+    with open(os.path.join(path, name), 'rb') as f:
+        data = f.read()
+    if entry is not None and _sha256(data) != entry['sha256']:
+        raise ValueError(f"Checksum mismatch in {name}")
+    with np.load(io.BytesIO(data)) as stored:
+        return {key: stored[key] for key in stored.files}
+
+def read_prices(path, symbols=None, start_date=None, end_date=None, manifest=None,
+                fields=('open', 'high', 'low', 'close', 'volume')):
+    """
+    Long-format prices of a snapshot as (stock numbers, dates, values) for PricePanel.from_records,
+    values in the order of fields. Only the partitions of the wanted stocks and years are read,
+    each checked against its manifest checksum.
+    """
+    manifest = manifest or read_manifest(path)
+    wanted = set(symbols) if symbols else None
+    start = np.datetime64(start_date, 'D') if start_date is not None else None
+    end = np.datetime64(end_date, 'D') if end_date is not None else None
+
+    stock_numbers, dates, values = [], [], []
+    for name, entry in sorted(manifest['files'].items()):
+        if entry['table'] != 'prices' or (wanted is not None and entry['stock_no'] not in wanted):
+            continue
+        if (start is not None and entry['year'] < start.astype(object).year) or \
+                (end is not None and entry['year'] > end.astype(object).year):
+            continue
+        arrays = read_partition(path, name, entry)
+        keep = np.ones(len(arrays['date']), dtype=bool)
+        if start is not None:
+            keep &= arrays['date'] >= start
+        if end is not None:
+            keep &= arrays['date'] <= end
+        columns = []
+        for field in fields:
+            if field == 'volume':
+                volume = arrays['volume'].astype(np.float64)
+                volume[arrays['volume'] == INT_NULL] = np.nan
+                columns.append(volume)
+            else:
+                columns.append(arrays[f'{field}_price'])
+        stock_numbers.append(np.full(keep.sum(), entry['stock_no']))
+        dates.append(arrays['date'][keep])
+        values.append(np.column_stack(columns)[keep])
+    if not stock_numbers:
+        return np.empty(0, dtype=str), np.empty(0, dtype='datetime64[D]'), np.empty((0, len(fields)))
+    return np.concatenate(stock_numbers), np.concatenate(dates), np.concatenate(values)
+
+# Database connection and import queries of a pool worker, opened once by _init_worker
+_connection = None
+_queries = None
+
+def _init_worker(db_config, metrics_sink=None):
+    global _connection, _queries
+    metrics.set_sink(metrics_sink)
+    _connection = mysql.connector.connect(**db_config)
+    _queries = {
+        'prices': SQLLoader.load_query('basic.sql')['Insert or update stock data'],
+        'income': SQLLoader.load_query('income.sql')['Insert or update income data'],
+    }
+
+def import_partition(path, name, entry, db_config, batch_size):
+    """
+    Verify and load one partition file, runs inside a pool worker.
+    Returns the file name, the rows written and the error, if any.
+    """
+    global _connection
+    try:
+        if not _connection.is_connected():
+            _connection = mysql.connector.connect(**db_config)
+        rows = _to_rows(entry['table'], entry['stock_no'], read_partition(path, name, entry))
+        cursor = _connection.cursor()
+        with metrics.timed('db_write'):
+            # executemany sends multi-row statements, batch_size rows each
+            for start in range(0, len(rows), batch_size):
+                cursor.executemany(_queries[entry['table']], rows[start:start + batch_size])
+            _connection.commit()
+        cursor.close()
+        metrics.count('rows_written', len(rows))
+        return name, len(rows), None
+    except Exception as e:
+        return name, 0, str(e)
+    finally:
+        metrics.flush()
+
+def _import_task(task):
+    return import_partition(*task)
+
+def import_snapshot(db_config, path=SNAPSHOT_DIR, processes=None, batch_size=5000):
+    """
+    Load a snapshot into the database, partitions in parallel in a process pool.
+    Every file is checked against the manifest before its rows are written,
+    rows already in the database are replaced.
+    Returns the rows written and the [(file, error)] of the files that failed.
+    """
+    manifest = read_manifest(path)
+    # Creates the database and the tables on a fresh node
+    fetcher = StockDataFetcher(db_config, "", None, None)
+    fetcher.connect_db()
+    fetcher.disconnect_db()
+
+    tasks = [(path, name, entry, db_config, batch_size) for name, entry in manifest['files'].items()
+             if entry['table'] in ('prices', 'income')]
+    written, failed = 0, []
+    if not tasks:
+        return written, failed
+
+    processes = min(processes or cpu_count(), len(tasks))
+    step = max(len(tasks) // 10, 1)
+    with Pool(processes=processes, initializer=_init_worker, initargs=(db_config, metrics.get_sink())) as pool:
+        for done, (name, rows, error) in enumerate(pool.imap_unordered(_import_task, tasks, chunksize=8), 1):
+            written += rows
+            if error:
+                failed.append((name, error))
+            if done % step == 0 or done == len(tasks):
+                print(f"Imported {done}/{len(tasks)} files, {written} rows")
+    return written, failed
@@ -0,0 +1,23 @@
+-- Get analysis result
+SELECT last_update, support, resistance, is_consolidation,
+       support_touches, resistance_touches, is_breakout, is_breakdown
+FROM analysis_results
+WHERE stock_no = %s AND period = %s AND range_key = %s AND analyzer_version = %s;
+
+-- Save analysis result
+REPLACE INTO analysis_results
+(stock_no, period, range_key, analyzer_version, last_update, support, resistance,
+ is_consolidation, support_touches, resistance_touches, is_breakout, is_breakdown)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+
+-- Get scan results
+SELECT stock_no, last_update, support, resistance, is_consolidation,
+       support_touches, resistance_touches, is_breakout, is_breakdown
+FROM analysis_results
+WHERE period = %s AND range_key = %s AND analyzer_version = %s;
+
+-- List stock versions
+SELECT stock_no, MAX(date) as last_update
+FROM stock_prices
+GROUP BY stock_no
+ORDER BY stock_no;
@@ -36,6 +36,14 @@ SELECT MAX(date)
 FROM stock_prices 
 WHERE stock_no = %s;
 
+-- Get data version
+SELECT date, open_price, high_price, low_price, close_price, volume,
+       (SELECT COUNT(*) FROM stock_prices WHERE stock_no = %s)
+FROM stock_prices
+WHERE stock_no = %s
+ORDER BY date DESC
+LIMIT 1;
+
 -- Get data from db
 SELECT date, open_price, high_price, low_price, close_price, volume 
 FROM stock_prices 
@@ -61,4 +69,42 @@ SELECT stock_no,
        MAX(close_price) as max_price
 FROM stock_prices
 GROUP BY stock_no
-ORDER BY stock_no; 
\ No newline at end of file
+ORDER BY stock_no; 
+
+-- Get panel data
+SELECT stock_no, date, {columns}
+FROM stock_prices
+WHERE date BETWEEN %s AND %s {stock_filter}
+ORDER BY stock_no, date;
+
+-- Get panel stocks
+SELECT DISTINCT stock_no
+FROM stock_prices
+WHERE date BETWEEN %s AND %s {stock_filter};
+
+-- Get panel dates
+SELECT DISTINCT date
+FROM stock_prices
+WHERE date BETWEEN %s AND %s {stock_filter}
+ORDER BY date;
+
+-- Get daily page
+SELECT date, open_price, high_price, low_price, close_price, volume
+FROM stock_prices
+WHERE stock_no = %s AND date >= %s AND date < %s
+ORDER BY date DESC
+LIMIT %s;
+
+-- List stocks summary page
+SELECT stock_no,
+       MIN(date) as first_date,
+       MAX(date) as last_date,
+       COUNT(*) as total_records,
+       MIN(close_price) as min_price,
+       MAX(close_price) as max_price
+FROM stock_prices
+WHERE stock_no > %s
+GROUP BY stock_no
+ORDER BY stock_no
+LIMIT %s;
+
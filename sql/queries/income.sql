@@ -4,6 +4,11 @@ FROM stock_income
 WHERE stock_no = %s
 ORDER BY date;
 
+-- Get all income data
+SELECT stock_no, date, revenue, profit
+FROM stock_income
+ORDER BY stock_no, date;
+
 -- Insert or update income data
 REPLACE INTO stock_income
 (stock_no, date, revenue, profit)
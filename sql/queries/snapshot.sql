@@ -0,0 +1,10 @@
+-- Export prices
+SELECT stock_no, date, volume, turnover, open_price, high_price,
+       low_price, close_price, price_change, transaction_count
+FROM stock_prices
+ORDER BY stock_no, date;
+
+-- Export income
+SELECT stock_no, date, revenue, profit
+FROM stock_income
+ORDER BY stock_no, date;
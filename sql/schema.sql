@@ -25,4 +25,22 @@ CREATE TABLE IF NOT EXISTS stock_income (
     profit BIGINT,            -- profit
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE KEY stock_income_date (stock_no, date)
-); 
\ No newline at end of file
+); 
+
+CREATE TABLE IF NOT EXISTS analysis_results (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    stock_no VARCHAR(10) NOT NULL,
+    period VARCHAR(8) NOT NULL,         -- D, W, M, Q, Y or N trading days like 5D
+    range_key VARCHAR(32) NOT NULL,     -- start:end of the analyzed range, empty for open ends
+    analyzer_version INT NOT NULL,
+    last_update DATE NOT NULL,          -- last price date the result was computed from
+    support DOUBLE,
+    resistance DOUBLE,
+    is_consolidation BOOLEAN,
+    support_touches INT,
+    resistance_touches INT,
+    is_breakout BOOLEAN,
+    is_breakdown BOOLEAN,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY analysis_key (stock_no, period, range_key, analyzer_version)
+);
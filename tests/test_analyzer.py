@@ -0,0 +1,36 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyzer import PatternDetector, PatternType
+
+def bars(lows, highs, closes):
+    return pd.DataFrame({
+        'date': pd.bdate_range('2024-01-01', periods=len(closes)),
+        'high_price': highs,
+        'low_price': lows,
+        'close_price': closes,
+    })
+
+def test_double_bottom_not_confirmed_before_second_bottom_is_known():
+    order = 3
+    # Bottoms at 5 and 15 with the neckline at 110 on bar 10, the close crosses it
+    # on bar 17 while bar 15 is a swing low only once bar 18 has closed
+    closes = np.array([100, 98, 96, 94, 92, 91, 94, 98, 102, 106, 108, 106, 102, 98, 94, 91.5,
+                       100, 112, 113, 114, 115, 116, 117, 118, 119], dtype=float)
+    lows = closes - 1
+    highs = closes + 1
+    highs[10] = 110
+    data = bars(lows, highs, closes)
+
+    patterns = PatternDetector(data, lookback=40, order=order).analyze()
+    bottoms = [pattern for pattern in patterns if pattern.pattern_type == PatternType.DOUBLE_BOTTOM]
+    assert len(bottoms) == 1
+    assert bottoms[0].second_bottom.date == data['date'][15]
+    # Not on the crossing bar, but on the first bar after the swing point is known
+    assert bottoms[0].end_time != data['date'][17]
+    assert bottoms[0].end_time == data['date'][15 + order + 1]
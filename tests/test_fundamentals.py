@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fundamentals import join_income, join_universe, extend_income
+
+def income_rows():
+    # Monthly reports dated on the first of their month
+    return pd.DataFrame({
+        'date': pd.to_datetime(['2024-01-01', '2024-02-01', '2024-03-01']),
+        'revenue': [100, 200, 300],
+        'profit': [10, 20, 30],
+    })
+
+def prices(dates):
+    return pd.DataFrame({'date': pd.to_datetime(dates), 'close_price': range(10, 10 + len(dates))})
+
+def test_revenue_known_from_the_tenth_of_the_next_month():
+    joined = join_income(prices(['2024-02-09', '2024-03-05', '2024-03-10', '2024-04-30']), income_rows())
+    # January is published on Feb 10th, February on Mar 10th
+    assert pd.isna(joined['revenue'][0])
+    assert joined['revenue'][1] == 100
+    assert joined['revenue'][2] == 200
+    assert joined['revenue'][3] == 300
+    assert joined['income_date'][1] == pd.Timestamp('2024-01-01')
+
+def test_publication_day_is_configurable():
+    joined = join_income(prices(['2024-03-05']), income_rows(), publication_day=1)
+    assert joined['revenue'][0] == 200
+
+def test_universe_uses_the_publication_date():
+    income = pd.concat([income_rows().assign(stock_no='2330'),
+                        income_rows().assign(stock_no='2317', revenue=[1, 2, 3])])
+    joined = join_universe(['2330', '2317', '2317'],
+                           pd.to_datetime(['2024-03-05', '2024-03-05', '2024-03-11']), income)
+    assert list(joined['revenue']) == [100, 1, 2]
+
+def test_cache_joined_without_lag_is_joined_again():
+    bars = prices(['2024-03-05', '2024-03-06', '2024-03-07'])
+    cached = join_income(bars, income_rows(), publication_day=1)
+    cached.attrs['income'] = ()
+    joined = extend_income(cached, bars, income_rows())
+    assert list(joined['revenue']) == [100, 100, 100]
@@ -0,0 +1,39 @@
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intraday import IntradayWatcher
+
+def quote(symbol, market, quote_time='09:00:05', price='100.00'):
+    return {'c': symbol, 'ex': market, 'z': price, 'v': '10', 'o': price, 'h': price, 'l': price,
+            'y': '99.00', 'd': '20240105', 't': quote_time}
+
+def test_symbols_are_asked_on_both_markets_until_one_answers():
+    watcher = IntradayWatcher(['2330', '6488'])
+    assert watcher.channels() == 'tse_2330.tw|otc_2330.tw|tse_6488.tw|otc_6488.tw'
+
+    watcher.on_quote(quote('2330', 'tse'))
+    watcher.on_quote(quote('6488', 'otc'))
+    assert watcher.channels() == 'tse_2330.tw|otc_6488.tw'
+    assert watcher.bars['6488'].close == 100.0
+
+def test_deadline_is_the_next_cutoff():
+    watcher = IntradayWatcher(['2330'], cutoff='13:35:00')
+    assert watcher.deadline(datetime(2024, 1, 5, 9, 0)) == datetime(2024, 1, 5, 13, 35)
+    assert watcher.deadline(datetime(2024, 1, 5, 20, 0)) == datetime(2024, 1, 6, 13, 35)
+
+def test_watch_ends_at_the_cutoff_without_closing_quotes():
+    cutoff = (datetime.now() + timedelta(seconds=2)).strftime('%H:%M:%S')
+    watcher = IntradayWatcher(['2330'], interval=0.05, cutoff=cutoff)
+    # A halted stock: the feed never sends a quote
+    watcher.fetch = lambda: []
+
+    started = time.perf_counter()
+    bars = asyncio.run(watcher.run())
+    assert bars == {}
+    assert watcher.polls > 0
+    assert time.perf_counter() - started < 5
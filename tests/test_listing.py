@@ -0,0 +1,35 @@
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import StockApp
+from workers import page_rows
+
+def test_after_is_a_date_for_a_stock_and_a_stock_number_for_all():
+    app = StockApp(interactive=False)
+    name, kwargs = app.parse_command('list 2330 --limit 5 --after 2024-03-01')
+    assert name == 'list'
+    assert kwargs['limit'] == 5
+    assert kwargs['after'] == datetime(2024, 3, 1)
+
+    _, kwargs = app.parse_command('list --after 2330')
+    assert kwargs['stock_no'] is None
+    assert kwargs['after'] == '2330'
+
+    assert app.parse_command('list 2330 --after 2330') is None
+
+def test_pages_continue_after_the_last_date_listed():
+    data = pd.DataFrame({'date': pd.bdate_range('2024-01-01', periods=23), 'close_price': range(23)})
+    listed, before = [], None
+    while True:
+        # One row more than the page tells if there is a next one
+        rows = list(page_rows(data, limit=5, before=before, columns=('date', 'close_price')))
+        listed.extend(rows[:5])
+        if len(rows) <= 5:
+            break
+        before = rows[4][0]
+    assert [close for _, close in listed] == list(range(22, -1, -1))
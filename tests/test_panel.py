@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+from datetime import date
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from panel import PricePanel
+from snapshot import _write_partition, MANIFEST, FORMAT_VERSION
+
+def price_row(stock_no, day, close):
+    # Columns of the 'Export prices' query
+    return (stock_no, day, 1000, close * 1000, close - 1, close + 1, close - 2, close, '+1.00', 10)
+
+def write_snapshot(path):
+    files = {}
+    for stock_no, closes in (('1101', (10.0, 11.0)), ('2330', (500.0, 505.0))):
+        rows = [price_row(stock_no, date(2024, 1, 2 + i), close) for i, close in enumerate(closes)]
+        name, entry = _write_partition(str(path), 'prices', stock_no, 2024, rows)
+        files[name] = entry
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump({'format': FORMAT_VERSION, 'files': files}, f)
+
+def test_close_only_panel_from_snapshot(tmp_path):
+    write_snapshot(tmp_path)
+    panel = PricePanel.from_snapshot(str(tmp_path), fields=('close',), dtype=np.float32)
+
+    assert list(panel.fields) == ['close']
+    assert panel['close'].dtype == np.float32
+    assert panel.symbols.tolist() == ['1101', '2330']
+    np.testing.assert_allclose(panel['close'], [[10.0, 11.0], [500.0, 505.0]])
+    assert panel.returns('close').dtype == np.float32
+
+def test_full_panel_from_snapshot(tmp_path):
+    write_snapshot(tmp_path)
+    panel = PricePanel.from_snapshot(str(tmp_path))
+
+    assert list(panel.fields) == ['open', 'high', 'low', 'close', 'volume']
+    np.testing.assert_allclose(panel['open'][1], [499.0, 504.0])
+    np.testing.assert_allclose(panel['volume'][0], [1000, 1000])
+
+def test_corrupted_partition_is_refused(tmp_path):
+    write_snapshot(tmp_path)
+    partition = tmp_path / 'prices' / '2330' / '2024.npz'
+    data = bytearray(partition.read_bytes())
+    data[-1] ^= 0xFF
+    partition.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        PricePanel.from_snapshot(str(tmp_path))
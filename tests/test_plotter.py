@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plotter import ChartCache, STALE_TEMP_SECONDS
+
+def write(path, size, age=0):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    modified = time.time() - age
+    os.utime(path, (modified, modified))
+
+def test_evict_leaves_charts_being_rendered(tmp_path):
+    cache = ChartCache(str(tmp_path), max_bytes=100)
+    write(tmp_path / 'old.png', 80, age=60)
+    write(tmp_path / 'new.png', 80, age=30)
+    # Oldest of all, but another worker is still rendering it
+    write(tmp_path / 'next.1234.tmp.png', 80, age=90)
+
+    cache.evict()
+    assert sorted(os.listdir(tmp_path)) == ['new.png', 'next.1234.tmp.png']
+
+def test_evict_removes_temporary_charts_of_dead_renders(tmp_path):
+    cache = ChartCache(str(tmp_path))
+    write(tmp_path / 'chart.png', 10)
+    write(tmp_path / 'dead.1234.tmp.png', 10, age=STALE_TEMP_SECONDS + 60)
+
+    cache.evict()
+    assert os.listdir(tmp_path) == ['chart.png']
+
+def test_failed_render_leaves_no_temporary_chart(tmp_path):
+    cache = ChartCache(str(tmp_path))
+
+    def render(path):
+        write(path, 10)
+        raise RuntimeError('render failed')
+
+    try:
+        cache.fetch('key', render)
+    except RuntimeError:
+        pass
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,99 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+from app import StockApp
+from scheduler import JobScheduler
+from workers import update_worker
+
+class RecordingPool:
+    """
+    Pool that records the jobs handed to it, they finish when the test calls finish
+    """
+    def __init__(self):
+        self.started = []
+
+    def apply_async(self, func, args, callback=None, error_callback=None):
+        self.started.append((args, callback))
+
+    def finish(self, index, result=None):
+        self.started[index][1](result)
+
+def make_app(pool_size):
+    app = StockApp(interactive=False)
+    app.pool = RecordingPool()
+    app.scheduler = JobScheduler(app.pool, pool_size, on_complete=app.job_finished)
+    return app
+
+def started_updates(pool):
+    return [args for args in pool.started if args[0][1] is update_worker]
+
+def test_income_update_merged_into_queued_update():
+    app = make_app(pool_size=1)
+    # A plot holds the only worker so that the updates stay queued
+    app.submit_job('plot', '2330', print, ())
+    first = app.update_stock('2330')
+    second = app.update_stock('2330', include_income=True)
+    assert second is first
+    assert first.status == 'queued'
+
+    app.pool.finish(0)
+    updates = started_updates(app.pool)
+    assert len(updates) == 1
+    assert updates[0][0][2][-1] is True
+
+def test_plain_update_keeps_queued_income():
+    app = make_app(pool_size=1)
+    app.submit_job('plot', '2330', print, ())
+    app.update_stock('2330', include_income=True)
+    app.update_stock('2330')
+
+    app.pool.finish(0)
+    updates = started_updates(app.pool)
+    assert len(updates) == 1
+    assert updates[0][0][2][-1] is True
+
+def test_income_update_reruns_after_running_update():
+    app = make_app(pool_size=2)
+    running = app.update_stock('2330')
+    assert running.status == 'running'
+    app.update_stock('2330', include_income=True)
+    # Never two updates of one stock at the same time
+    assert len(started_updates(app.pool)) == 1
+
+    app.pool.finish(0)
+    updates = started_updates(app.pool)
+    assert len(updates) == 2
+    assert updates[1][0][2][-1] is True
+
+    # Nothing more to run once the update with income is done
+    app.pool.finish(1)
+    assert len(started_updates(app.pool)) == 2
+    assert not app.scheduler.active
+
+def test_profiled_update_merged():
+    app = make_app(pool_size=1)
+    app.profile_mode = True
+    app.submit_job('plot', '2330', print, ())
+    app.update_stock('2330')
+    app.update_stock('2330', include_income=True)
+
+    app.pool.finish(0)
+    assert len(app.pool.started) == 2
+    label, worker, worker_args = app.pool.started[1][0][2]
+    assert worker is update_worker
+    assert worker_args[-1] is True
+
+def test_chart_of_a_worker_is_opened_by_the_shell(monkeypatch):
+    opened = []
+    monkeypatch.setattr(app_module, 'open_chart', lambda path, title=None: opened.append((path, title)))
+    app = make_app(pool_size=2)
+    app.submit_job('plot', '2330', print, ())
+    app.submit_job('list', 'all', print, ())
+
+    app.pool.finish(0, {'chart': 'charts/2330.png', 'title': 'K-Line Chart - 2330'})
+    app.pool.finish(1)
+    assert opened == [('charts/2330.png', 'K-Line Chart - 2330')]
+    assert app.scheduler.jobs['J1'].status == 'completed'
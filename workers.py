@@ -0,0 +1,915 @@
+import sys
+import signal
+import asyncio
+import traceback
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import mysql.connector
+from fetcher import StockDataFetcher
+from analyzer import StockPatternAnalyzer, RollingPatternAnalyzer
+from plotter import StockDataPlotter, ChartCache
+from backtester import PatternBacktester, backtest_universe
+from indicators import IndicatorCache
+from fundamentals import FundamentalsCache, load_income_universe, join_universe
+from panel import PricePanel
+from correlation import CorrelationMatrix
+from chartpack import render_chart_pack
+from scanner import AnalysisCache, analyze_cached, scan_universe
+from snapshot import export_snapshot, import_snapshot
+from intraday import IntradayWatcher, POLL_INTERVAL
+from pyramid import PyramidCache
+import resample
+from scheduler import init_progress, report_progress
+import metrics
+
+# Rows of a listing without date range, and per page when only --after is given
+LIST_LATEST_ROWS = 10
+LIST_PAGE_SIZE = 50
+
+# Daily bars the support/resistance of a watched stock are taken from
+WATCH_LOOKBACK = 60
+
+# State of a pre-warmed pool worker, filled by warm_worker
+_worker_state = {}
+
+def warm_worker(db_config, progress_queue=None, frame_store=None):
+    """
+    Pool initializer: load the queries and open the database connection once,
+    so every job sent to this worker starts with them in place
+    frame_store: SharedFrameStore the workers hand loaded prices over with
+    """
+    # Ctrl+C is handled by the shell, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_progress(progress_queue)
+    metrics.set_sink(progress_queue)
+    _worker_state['frames'] = frame_store
+    try:
+        fetcher = StockDataFetcher(db_config, "", None, None)
+        fetcher.connect_db()
+        _worker_state['db_config'] = db_config
+        _worker_state['connection'] = fetcher.db_connection
+    except Exception as e:
+        print(f"Error warming worker: {e}")
+
+def open_fetcher(db_config, stock_no, start_date, end_date):
+    """
+    Fetcher on the warm connection of this worker, or on a new one outside the pool
+    """
+    # The previous job of this worker is done with its shared frames
+    if _worker_state.get('frames') is not None:
+        _worker_state['frames'].release()
+
+    fetcher = StockDataFetcher(db_config, stock_no, start_date, end_date)
+    connection = _worker_state.get('connection')
+    if connection is not None and _worker_state.get('db_config') == db_config:
+        try:
+            connection.ping(reconnect=True, attempts=2, delay=1)
+            fetcher.db_connection = connection
+            return fetcher
+        except mysql.connector.Error:
+            _worker_state.pop('connection', None)
+    fetcher.connect_db()
+    return fetcher
+
+def release_fetcher(fetcher):
+    """
+    Close the connection of the fetcher unless it is the warm one of the worker
+    """
+    if fetcher.db_connection is not _worker_state.get('connection'):
+        fetcher.disconnect_db()
+
+def load_daily(fetcher):
+    """
+    Daily prices of the fetcher's stock, attached from shared memory when
+    another worker already loaded the same version, else loaded and published
+    """
+    store = _worker_state.get('frames')
+    if store is None:
+        return fetcher.get_aggregated_data_from_db('D')
+
+    version = fetcher.get_data_version()
+    if version is not None:
+        try:
+            data = store.attach(fetcher.stock_no, 'D', version)
+            if data is not None:
+                return data
+        except Exception as e:
+            print(f"Error attaching shared prices of {fetcher.stock_no}: {e}")
+
+    data = fetcher.get_aggregated_data_from_db('D')
+    if version is not None:
+        try:
+            store.publish(fetcher.stock_no, 'D', version, data)
+        except Exception as e:
+            print(f"Error sharing prices of {fetcher.stock_no}: {e}")
+    return data
+
+def load_prices(fetcher, period='D'):
+    """
+    Prices of the fetcher's stock in any period, resampled from the daily bars
+    so every period shares one load
+    """
+    return resample.resample_frame(load_daily(fetcher), period)
+
+def load_fundamentals(fetcher, period='D'):
+    """
+    Prices of the fetcher's stock with the latest income known on every bar,
+    extended from the cached join
+    """
+    return FundamentalsCache().update(fetcher.stock_no, period, load_prices(fetcher, period),
+                                      fetcher.get_income_data_from_db())
+
+def show_chart(path, title, show=True):
+    """
+    The chart for the shell to open when show is set, a pool worker never opens
+    a window itself as it would be held until the window is closed
+    """
+    if not show:
+        print(f"Chart saved to {path}")
+        return None
+    return {'chart': path, 'title': title}
+
+def update_worker(stock_no: str, db_config, debug_mode=False, include_income=False):
+    """
+    Worker for updating stock data
+    """
+    def log(message):
+        if debug_mode:
+            print(message)
+            
+    succeeded = True
+    try:
+        start_date = datetime(2010, 1, 1)
+        end_date = datetime.now()
+        fetcher = open_fetcher(db_config, stock_no, start_date, end_date)
+        fetcher.progress_callback = report_progress
+
+        try:
+            cursor = fetcher.db_connection.cursor()
+            cursor.execute(fetcher.queries['basic']['Check stock exists'], (stock_no,))
+            count = cursor.fetchone()[0]
+            cursor.close()
+
+            if count == 0:
+                log(f"No data found for stock {stock_no}, fetching from TWSE...")
+                fetcher.update_stock_data()
+            else:
+                cursor = fetcher.db_connection.cursor()
+                cursor.execute(fetcher.queries['basic']['Get last update date for stock'], (stock_no,))
+                last_update = cursor.fetchone()[0]
+                cursor.close()
+
+                current_date = datetime.now().date()
+                if last_update and last_update < current_date:
+                    print(f"Updating price data for stock {stock_no} from {last_update}")
+                    fetcher.start_date = datetime.combine(last_update, datetime.min.time()) + timedelta(days=1)
+                    fetcher.update_stock_data()
+
+        except mysql.connector.Error as e:
+            print(f"Database error: {e}")
+            succeeded = False
+
+        # Extend the cached indicators with the bars appended by the update
+        daily = None
+        try:
+            cache = IndicatorCache()
+            daily = load_daily(fetcher)
+            for period in ['D', 'W', 'M']:
+                cache.update(stock_no, period, resample.resample_frame(daily, period))
+            log(f"Indicators updated for stock {stock_no}")
+        except Exception as e:
+            print(f"Error updating indicators: {e}")
+            succeeded = False
+
+        if include_income:
+            try:
+                cursor = fetcher.db_connection.cursor()
+                cursor.execute(fetcher.queries['income']['Check income exists'], (stock_no,))
+                count = cursor.fetchone()[0]
+                cursor.close()
+
+                if count == 0:
+                    log(f"No income data found for stock {stock_no}, fetching from MOPS...")
+                    fetcher.update_income_data()
+                else:
+                    cursor = fetcher.db_connection.cursor()
+                    cursor.execute(fetcher.queries['income']['Get last income update'], (stock_no,))
+                    last_update = cursor.fetchone()[0]
+                    cursor.close()
+
+                    current_date = datetime.now().date()
+                    if last_update and last_update < current_date:
+                        print(f"Updating income data for stock {stock_no} from {last_update}")
+                        fetcher.start_date = datetime.combine(last_update, datetime.min.time()) + timedelta(days=1)
+                        fetcher.update_income_data()
+
+            except mysql.connector.Error as e:
+                print(f"Database error when updating income: {e}")
+                succeeded = False
+
+        # Extend the as-of join of the income with the new bars and income rows
+        try:
+            daily = daily if daily is not None else load_daily(fetcher)
+            FundamentalsCache().update(stock_no, 'D', daily, fetcher.get_income_data_from_db())
+            log(f"Income join updated for stock {stock_no}")
+        except Exception as e:
+            print(f"Error joining income: {e}")
+            succeeded = False
+        
+        release_fetcher(fetcher)
+        print()
+        sys.stdout.flush()
+        return succeeded
+    except Exception as e:
+        print(f"Error updating stock {stock_no}: {e}")
+        traceback.print_exc()
+        sys.stdout.flush()
+        return False
+
+def plot_worker(stock_no, start_date, end_date, db_config, period='D', plot_income=False, show=True):
+    """
+    show: open the chart in a window, else only print the path of the chart file
+    """
+    try:
+        fetcher = open_fetcher(db_config, stock_no, start_date, end_date)
+        plotter = StockDataPlotter()
+        cache = ChartCache()
+
+        # Charts are cached until the next update of the stock
+        if plot_income:
+            last_update = fetcher.get_last_income_update()
+            title = f'Monthly Income Chart - {stock_no}'
+        else:
+            last_update = fetcher.get_last_update_date()
+            period_text = resample.period_text(period)
+            title = f'{period_text} K-Line Chart - {stock_no}'
+
+        if last_update is None:
+            print(f"No {'income ' if plot_income else ''}data found for stock {stock_no}")
+            release_fetcher(fetcher)
+            return
+
+        key = ChartCache.key(stock_no, 'I' if plot_income else period, start_date, end_date, None, last_update)
+        path = cache.get(key)
+        if path is None:
+            if plot_income:
+                data = fetcher.get_income_data_from_db()
+                path = cache.fetch(key, lambda target: plotter.plot_income_chart(
+                    data, start_date, end_date, title=title, save_path=target))
+            else:
+                data = load_prices(fetcher, period)
+                pyramid = PyramidCache().get(stock_no, period, data)
+                path = cache.fetch(key, lambda target: plotter.plot_kline_with_volume(
+                    data, start_date, end_date, title=title, save_path=target, pyramid=pyramid))
+
+        release_fetcher(fetcher)
+        chart = show_chart(path, title, show)
+        sys.stdout.flush()
+        return chart
+    except Exception as e:
+        print(f"Error plotting stock {stock_no}: {e}")
+        sys.stdout.flush()
+        return False
+
+def analyze_worker(stock_no, start_date, end_date, db_config, period='D', lookback=None, show=True,
+                   valuation=False):
+    """
+    Worker for analyzing stock patterns
+    period: 'D', 'W', 'M', 'Q', 'Y' or a number of trading days like '5D'
+    lookback: number of bars of the rolling window, None analyzes the whole range at once
+    show: open the chart in a window, else only print the path of the chart file
+    valuation: also print the latest income known at the end of the range
+    """
+    try:
+        fetcher = open_fetcher(db_config, stock_no, start_date, end_date)
+        period_text = resample.period_text(period)
+
+        if lookback:
+            data = load_prices(fetcher, period)
+            # The label of a weekly/monthly bar stays the same while its days come in
+            last_update = fetcher.get_last_update_date()
+            release_fetcher(fetcher)
+            print(f"\n{period_text} Rolling Analysis result for {stock_no} (lookback: {lookback}):")
+
+            signals = RollingPatternAnalyzer(data, start_date, end_date, lookback).analyze()
+            if signals.empty:
+                print(f"No data found for stock {stock_no}")
+                return
+
+            print("\nDate       | Close   | Support | Resist. | S.Touch | R.Touch | Signal")
+            print("-" * 75)
+            for row in signals.tail(10).itertuples():
+                signal = 'breakout' if row.is_breakout else 'breakdown' if row.is_breakdown else ''
+                print(f"{row.date.strftime('%Y-%m-%d')} | {row.close_price:7.2f} | {row.support:7.2f} | "
+                      f"{row.resistance:7.2f} | {row.support_touches:7d} | {row.resistance_touches:7d} | {signal}")
+
+            print(f"\nBreakouts: {int(signals['is_breakout'].sum())}")
+            print(f"Breakdowns: {int(signals['is_breakdown'].sum())}")
+
+            levels = signals.set_index('date')
+            title = f'{period_text} K-Line Chart with Rolling Analysis - {stock_no}'
+            key = ChartCache.key(stock_no, period, start_date, end_date, ('rolling', lookback), last_update)
+            plotter = StockDataPlotter()
+            path = ChartCache().fetch(key, lambda target: plotter.plot_kline_with_volume(
+                data, start_date, end_date,
+                support=levels['support'],
+                resistance=levels['resistance'],
+                title=title, save_path=target
+            ))
+            chart = show_chart(path, title, show)
+            sys.stdout.flush()
+            return chart
+
+        last_update = fetcher.get_last_update_date()
+        if last_update is None:
+            print(f"No data found for stock {stock_no}")
+            release_fetcher(fetcher)
+            return
+
+        # An unchanged stock is answered from the stored result and chart without loading prices
+        cache = AnalysisCache(fetcher.db_connection, fetcher.queries['analysis'])
+        analysis_result, cached = analyze_cached(fetcher, cache, period, start_date, end_date, last_update,
+                                                 load=lambda: load_prices(fetcher, period))
+
+        print(f"\n{period_text} Analysis result for {stock_no}{' (cached)' if cached else ''}:")
+        print(f"Support: {analysis_result['support']:.2f}")
+        print(f"Resistance: {analysis_result['resistance']:.2f}")
+        print(f"Is consolidation: {analysis_result['is_consolidation']}")
+        print(f"Support touches: {analysis_result['support_touches']}")
+        print(f"Resistance touches: {analysis_result['resistance_touches']}")
+        print(f"Is breakout: {analysis_result['is_breakout']}")
+        print(f"Is breakdown: {analysis_result['is_breakdown']}")
+        if valuation:
+            income = StockPatternAnalyzer(load_fundamentals(fetcher, period), start_date, end_date).income()
+            if income is None or pd.isna(income['income_date']):
+                print("Income: no data")
+            else:
+                print(f"Income as of {income['income_date']:%Y-%m}: revenue {format_amount(income['revenue'], 0)}, "
+                      f"profit {format_amount(income['profit'], 0)}, margin {format_ratio(income['margin'], 0)}, "
+                      f"revenue change {format_ratio(income['revenue_change'], 0)}")
+
+        title = f'{period_text} K-Line Chart with Analysis - {stock_no}'
+        overlays = (analysis_result['support'], analysis_result['resistance'])
+        key = ChartCache.key(stock_no, period, start_date, end_date, overlays, last_update)
+        plotter = StockDataPlotter()
+        path = ChartCache().fetch(key, lambda target: plotter.plot_kline_with_volume(
+            load_prices(fetcher, period), start_date, end_date,
+            support=analysis_result['support'],
+            resistance=analysis_result['resistance'],
+            title=title, save_path=target
+        ))
+        release_fetcher(fetcher)
+        chart = show_chart(path, title, show)
+
+        sys.stdout.flush()
+        return chart
+    except Exception as e:
+        print(f"Error analyzing stock {stock_no}: {e}")
+        sys.stdout.flush()
+        return False
+
+def format_ratio(value, width=7):
+    return f"{value:+{width}.1%}" if pd.notna(value) else 'n/a'.rjust(width)
+
+def format_amount(value, width=17):
+    return f"{value:{width},.0f}" if pd.notna(value) else 'n/a'.rjust(width)
+
+def page_rows(data, start_date=None, end_date=None, limit=None, before=None,
+              columns=('date', 'open_price', 'high_price', 'low_price', 'close_price', 'volume')):
+    """
+    Rows of an aggregated frame in the date range, newest first, older than before when given
+    """
+    if data.empty:
+        return iter(())
+    dates = data['date'].to_numpy(dtype='datetime64[ns]')
+    first = np.searchsorted(dates, np.datetime64(pd.to_datetime(start_date)), 'left') if start_date else 0
+    last = np.searchsorted(dates, np.datetime64(pd.to_datetime(end_date)), 'right') if end_date else len(dates)
+    if before is not None:
+        last = min(last, np.searchsorted(dates, np.datetime64(pd.to_datetime(before)), 'left'))
+    first = max(first, last - limit - 1) if limit else first
+    # The row before the page is read too, it tells if a next page exists
+    selected = data.iloc[first:max(last, first)][::-1]
+    return zip(*(selected[column] for column in columns))
+
+def list_worker(db_config, stock_no=None, start_date=None, end_date=None, period='D', include_income=False,
+                limit=None, after=None, valuation=False):
+    """
+    limit: rows per page, newest first
+    after: keyset cursor of the previous page, the last date it listed for a stock
+    or the last stock number for all stocks
+    valuation: list the bars with the latest revenue and profit known on each of them
+    """
+    try:
+        fetcher = open_fetcher(db_config, stock_no or "", None, None)
+        
+        if stock_no:
+            if include_income:
+                income_data = fetcher.get_income_data_from_db()
+                
+                if income_data.empty:
+                    print(f"\nNo income data found for stock {stock_no}")
+                    return
+
+                if start_date:
+                    income_data = income_data[income_data['date'] >= pd.to_datetime(start_date)]
+                if end_date:
+                    income_data = income_data[income_data['date'] <= pd.to_datetime(end_date)]
+                
+                print(f"\nMonthly Income Records for Stock {stock_no}:")
+                if start_date and end_date:
+                    print(f"Period: {start_date} to {end_date}")
+                
+                print("\nDate       | Revenue      | Profit")
+                print("-" * 50)
+                
+                for _, row in income_data.iterrows():
+                    date_str = row['date'].strftime('%Y-%m')
+                    print(f"{date_str:10} | {row['revenue']:12,d} | {row['profit']:12,d}")
+                
+                print("\nSummary Statistics:")
+                print("-" * 40)
+                print(f"Total Months: {len(income_data)}")
+                print(f"Average Revenue: {income_data['revenue'].mean():,.0f}")
+                print(f"Average Profit: {income_data['profit'].mean():,.0f}")
+                print(f"Total Revenue: {income_data['revenue'].sum():,.0f}")
+                print(f"Total Profit: {income_data['profit'].sum():,.0f}")
+            elif valuation:
+                if limit is None and not (start_date and end_date):
+                    limit = LIST_LATEST_ROWS
+                elif limit is None and after is not None:
+                    limit = LIST_PAGE_SIZE
+
+                joined = load_fundamentals(fetcher, period)
+                if joined is None:
+                    print(f"\nNo data found for stock {stock_no}")
+                    release_fetcher(fetcher)
+                    return
+                rows = list(page_rows(joined, start_date, end_date, limit, after,
+                                      ('date', 'close_price', 'income_date', 'revenue', 'profit', 'margin',
+                                       'revenue_change')))
+                more = bool(limit) and len(rows) > limit
+                rows = rows[:limit] if limit else rows
+                if not rows:
+                    print(f"\nNo data found for stock {stock_no}")
+                    release_fetcher(fetcher)
+                    return
+
+                date_format = resample.date_format(period)
+                print(f"\n{resample.period_text(period)} Prices and Income for Stock {stock_no}:")
+                if after is not None:
+                    print(f"Before {after:%Y-%m-%d}")
+                print("\nDate       | Close   | Income  | Revenue           | Profit            | Margin  | Rev. Chg")
+                print("-" * 100)
+                for date, close_price, income_date, revenue, profit, margin, revenue_change in rows:
+                    income_str = income_date.strftime('%Y-%m') if pd.notna(income_date) else 'n/a'
+                    print(f"{date.strftime(date_format).ljust(10)} | {float(close_price):7.2f} | {income_str:7} | "
+                          f"{format_amount(revenue)} | {format_amount(profit)} | "
+                          f"{format_ratio(margin)} | {format_ratio(revenue_change)}")
+                if more:
+                    print(f"\nMore records: add --after {rows[-1][0]:%Y-%m-%d}")
+            else:
+                # Latest records only, unless a range or a page is asked for
+                if limit is None and not (start_date and end_date):
+                    limit = LIST_LATEST_ROWS
+                elif limit is None and after is not None:
+                    limit = LIST_PAGE_SIZE
+
+                if period == 'D':
+                    # Streamed from the database newest first, one more row tells if a next page exists
+                    rows = fetcher.stream_daily_data(start_date, end_date, limit + 1 if limit else None, after)
+                else:
+                    rows = page_rows(load_prices(fetcher, period), start_date, end_date, limit, after)
+
+                period_text = resample.period_text(period)
+                date_format = resample.date_format(period)
+                count, more = 0, False
+                low, high, close_total, volume_total = float('inf'), float('-inf'), 0.0, 0.0
+
+                for row in rows:
+                    if limit and count == limit:
+                        more = True
+                        break
+                    if count == 0:
+                        # Display header
+                        print(f"\n{period_text} Trading Records for Stock {stock_no}:")
+                        if start_date and end_date:
+                            print(f"Period: {start_date} to {end_date}")
+                        else:
+                            print("Latest records:")
+                        if after is not None:
+                            print(f"Before {after:%Y-%m-%d}")
+                        print("\nDate       | Volume      | Open  | High  | Low   | Close")
+                        print("-" * 65)
+
+                    date, open_price, high_price, low_price, close_price, volume = row
+                    # Padded to the header for the month formats
+                    date_str = date.strftime(date_format).ljust(10)
+                    print(f"{date_str} | {float(volume):11,.0f} | "
+                          f"{float(open_price):5.2f} | {float(high_price):5.2f} | "
+                          f"{float(low_price):5.2f} | {float(close_price):5.2f}")
+
+                    # Summary statistics are accumulated while streaming
+                    count += 1
+                    low = min(low, float(low_price))
+                    high = max(high, float(high_price))
+                    close_total += float(close_price)
+                    volume_total += float(volume or 0)
+
+                if count == 0:
+                    print(f"\nNo data found for stock {stock_no}")
+                    release_fetcher(fetcher)
+                    return
+
+                # Display summary statistics
+                print(f"\n{period_text} Summary Statistics:")
+                print("-" * 40)
+
+                print(f"Total {period_text} Periods: {count}")
+                print(f"Price Range: {low:.2f} - {high:.2f}")
+                print(f"Average Closing Price: {close_total / count:.2f}")
+                print(f"Total Volume: {volume_total:,.0f}")
+                print(f"Average {period_text} Volume: {volume_total / count:,.0f}")
+                if more:
+                    print(f"\nMore records: add --after {date:%Y-%m-%d}")
+                
+        else:
+            if include_income:
+                cursor = fetcher.db_connection.cursor()
+                cursor.execute(fetcher.queries['income']['List all income summary'])
+                results = cursor.fetchall()
+                cursor.close()
+
+                if not results:
+                    print("\nNo income data in database")
+                    return
+                    
+                print("\nStock Income Summary:")
+                print("Stock No | First Date | Last Date  | Records | Avg Revenue  | Avg Profit")
+                print("-" * 75)
+                for row in results:
+                    print(f"{row[0]:<8} | {row[1]} | {row[2]} | {row[3]:>7} | "
+                          f"{row[4]:>11,.0f} | {row[5]:>10,.0f}")
+            else:
+                count = 0
+                rows = fetcher.stream_stock_summaries(limit + 1 if limit else None, after)
+                if valuation:
+                    # Income of the listed stocks at their last date, one query and one join for the page
+                    rows = list(rows)
+                    income = join_universe([row[0] for row in rows], [row[2] for row in rows],
+                                           load_income_universe(db_config))
+                for row in rows:
+                    if limit and count == limit:
+                        print(f"\nMore stocks: add --after {stock}")
+                        break
+                    if count == 0:
+                        print("\nStock data in database:" if after is None else f"\nStock data in database after {after}:")
+                        print("Stock No | First Date  | Last Date   | Records | Price Range"
+                              + ("     | Margin  | Rev. Chg" if valuation else ""))
+                        print("-" * (65 + (24 if valuation else 0)))
+                    line = f"{row[0]:<8} | {row[1]} | {row[2]} | {row[3]:>7} | {row[4]:6.2f} - {row[5]:6.2f}"
+                    if valuation:
+                        line += (f" | {format_ratio(income['margin'].iloc[count])}"
+                                 f" | {format_ratio(income['revenue_change'].iloc[count])}")
+                    print(line)
+                    stock = row[0]
+                    count += 1
+
+                if count == 0:
+                    print("\nNo data in database")
+                    release_fetcher(fetcher)
+                    return
+                
+        release_fetcher(fetcher)
+        sys.stdout.flush()
+            
+    except Exception as e:
+        print(f"Error listing stocks: {e}")
+        traceback.print_exc()
+        sys.stdout.flush()
+        return False
+
+def indicator_worker(stock_no, start_date, end_date, db_config, period='D'):
+    """
+    Worker for showing the technical indicators of a stock
+    """
+    try:
+        fetcher = open_fetcher(db_config, stock_no, start_date, end_date)
+        data = load_prices(fetcher, period)
+        release_fetcher(fetcher)
+
+        if data.empty:
+            print(f"\nNo data found for stock {stock_no}")
+            return
+
+        # Only the bars added since the last run are computed
+        indicators = IndicatorCache().update(stock_no, period, data)
+        if start_date:
+            indicators = indicators[indicators['date'] >= pd.to_datetime(start_date)]
+        if end_date:
+            indicators = indicators[indicators['date'] <= pd.to_datetime(end_date)]
+        if not (start_date and end_date):
+            indicators = indicators.tail(10)
+
+        period_text = resample.period_text(period)
+        print(f"\n{period_text} Indicators for Stock {stock_no}:")
+        print("\nDate       | Close   | MA20    | EMA12   | RSI14 | MACD    | Signal  | BB Lower | BB Upper")
+        print("-" * 95)
+        date_format = resample.date_format(period)
+        for row in indicators.itertuples():
+            date_str = row.date.strftime(date_format).ljust(10)
+            print(f"{date_str} | {row.close:7.2f} | {row.ma_20:7.2f} | {row.ema_12:7.2f} | {row.rsi_14:5.1f} | "
+                  f"{row.macd:7.2f} | {row.macd_signal:7.2f} | {row.bb_lower:8.2f} | {row.bb_upper:8.2f}")
+
+        sys.stdout.flush()
+    except Exception as e:
+        print(f"Error calculating indicators for stock {stock_no}: {e}")
+        sys.stdout.flush()
+        return False
+
+def load_panel(db_config, start_date=None, end_date=None, snapshot=None, **options):
+    """
+    Price panel from the database, or from an exported snapshot directory
+    options: fields and dtype of the matrices, see PricePanel.from_db
+    """
+    if snapshot:
+        return PricePanel.from_snapshot(snapshot, start_date=start_date, end_date=end_date, **options)
+    return PricePanel.from_db(db_config, start_date=start_date, end_date=end_date, **options)
+
+def panel_worker(db_config, start_date=None, end_date=None, snapshot=None):
+    """
+    Worker for building the cross-sectional price panel and its columnar cache
+    """
+    try:
+        panel = load_panel(db_config, start_date, end_date, snapshot)
+        if panel.shape[0] == 0:
+            print("\nNo data in database")
+            return
+        panel.save()
+
+        mask = panel.mask
+        print("\nPrice panel built:")
+        print("-" * 40)
+        print(f"Stocks: {panel.shape[0]}")
+        print(f"Trading days: {panel.shape[1]} ({panel.dates[0]} to {panel.dates[-1]})")
+        print(f"Coverage: {mask.mean():.1%}")
+
+        # Market breadth of the last day: stocks closing above their 20 day average
+        close = panel['close'][:, -20:]
+        with np.errstate(invalid='ignore'):
+            above = close[:, -1] > np.nanmean(close, axis=1)
+        traded = ~np.isnan(close[:, -1])
+        if traded.any():
+            print(f"Above 20-day average on {panel.dates[-1]}: {above[traded].mean():.1%} of {traded.sum()} stocks")
+
+        sys.stdout.flush()
+    except Exception as e:
+        print(f"Error building price panel: {e}")
+        traceback.print_exc()
+        sys.stdout.flush()
+        return False
+
+def correlation_worker(db_config, start_date=None, end_date=None, snapshot=None):
+    """
+    Worker for the pairwise return correlation and beta of every stock
+    """
+    try:
+        # The returns only need the close, held in the float32 of the returns file
+        panel = load_panel(db_config, start_date, end_date, snapshot, fields=('close',), dtype=np.float32)
+        if panel.shape[0] < 2:
+            print("\nNot enough stocks in database")
+            return
+
+        matrix = CorrelationMatrix()
+        result = matrix.compute(panel)
+
+        print(f"\nCorrelation matrix of {len(result['symbols'])} stocks written to {matrix.output_dir}/")
+        print("\nMost correlated pairs:")
+        print("Stock A  | Stock B  | Correlation | Beta")
+        print("-" * 45)
+        index = {symbol: i for i, symbol in enumerate(result['symbols'].tolist())}
+        for stock_a, stock_b, corr in CorrelationMatrix.top_pairs(result):
+            beta = result['beta'][index[stock_a], index[stock_b]]
+            print(f"{stock_a:<8} | {stock_b:<8} | {corr:11.3f} | {beta:5.2f}")
+
+        sys.stdout.flush()
+    except Exception as e:
+        print(f"Error computing correlation: {e}")
+        traceback.print_exc()
+        sys.stdout.flush()
+        return False
+
+def render_worker(db_config, stock_numbers=None, periods=('D',), image_format='png', start_date=None, end_date=None):
+    """
+    Worker for rendering chart files of many stocks without a GUI
+    stock_numbers: None renders every stock in the database
+    """
+    try:
+        if not stock_numbers:
+            fetcher = open_fetcher(db_config, "", None, None)
+            cursor = fetcher.db_connection.cursor()
+            cursor.execute(fetcher.queries['basic']['List all stocks summary'])
+            stock_numbers = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+            release_fetcher(fetcher)
+
+        if not stock_numbers:
+            print("\nNo data in database")
+            return
+
+        started = datetime.now()
+        output_dir, results = render_chart_pack(stock_numbers, periods, db_config, None, image_format,
+                                                start_date, end_date)
+        rendered = [path for _, _, path in results if path]
+        elapsed = (datetime.now() - started).total_seconds()
+        print(f"\nRendered {len(rendered)} of {len(results)} charts to {output_dir}/ in {elapsed:.1f}s")
+        for stock_no, period, path in results:
+            if not path:
+                print(f"No chart for stock {stock_no} ({period})")
+
+        sys.stdout.flush()
+    except Exception as e:
+        print(f"Error rendering charts: {e}")
+        traceback.print_exc()
+        sys.stdout.flush()
+        return False
+
+def backtest_worker(db_config, stock_no=None, period='D', horizon=20):
+    """
+    Worker for backtesting detected patterns against their target and stop loss
+    stock_no: None replays the patterns of every stock in the database
+    """
+    try:
+        if stock_no:
+            stock_numbers = [stock_no]
+        else:
+            fetcher = open_fetcher(db_config, "", None, None)
+            cursor = fetcher.db_connection.cursor()
+            cursor.execute(fetcher.queries['basic']['List all stocks summary'])
+            stock_numbers = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+            release_fetcher(fetcher)
+
+        if not stock_numbers:
+            print("\nNo data in database")
+            return
+
+        results = backtest_universe(stock_numbers, db_config, period, horizon)
+        if results.empty:
+            print("\nNo patterns found")
+            return
+
+        period_text = resample.period_text(period)
+        print(f"\n{period_text} Pattern Backtest ({len(stock_numbers)} stocks, timeout: {horizon} bars):")
+        print("Pattern               | Trades | Win   | Loss  | Timeout | Win Rate | Expectancy")
+        print("-" * 85)
+        summary = PatternBacktester.summarize(results)
+        for row in summary.itertuples():
+            print(f"{row.Index:<21} | {row.trades:6d} | {row.wins:5d} | {row.losses:5d} | "
+                  f"{row.timeouts:7d} | {row.win_rate:7.1%} | {row.expectancy:+9.2%}")
+
+        sys.stdout.flush()
+    except Exception as e:
+        print(f"Error backtesting: {e}")
+        traceback.print_exc()
+        sys.stdout.flush()
+        return False
+
+def scan_worker(db_config, period='D', start_date=None, end_date=None, valuation=False):
+    """
+    Worker for the analysis of every stock, only stocks updated since the last scan are analyzed again
+    valuation: add the latest income known at the last bar of every stock
+    """
+    try:
+        started = datetime.now()
+        results, recomputed = scan_universe(db_config, period, start_date, end_date)
+        if results.empty:
+            print("\nNo data in database")
+            return
+
+        elapsed = (datetime.now() - started).total_seconds()
+        period_text = resample.period_text(period)
+        print(f"\n{period_text} Scan of {len(results)} stocks ({recomputed} analyzed, "
+              f"{len(results) - recomputed} unchanged) in {elapsed:.1f}s:")
+        print(f"Consolidating: {int(results['is_consolidation'].sum())}")
+        print(f"Breakouts: {int(results['is_breakout'].sum())}")
+        print(f"Breakdowns: {int(results['is_breakdown'].sum())}")
+
+        if valuation:
+            # One query and one as-of join for the whole universe
+            as_of = [min(last_update, end_date.date()) if end_date else last_update
+                     for last_update in results['last_update']]
+            income = join_universe(results['stock_no'], as_of, load_income_universe(db_config))
+            results = pd.concat([results, income[['margin', 'revenue_change']]], axis=1)
+            print(f"With income: {int(income['income_date'].notna().sum())}")
+
+        signals = results[results['is_breakout'] | results['is_breakdown']]
+        if not signals.empty:
+            print("\nStock No | Last Date  | Support | Resist. | S.Touch | R.Touch | Signal"
+                  + ("    | Margin  | Rev. Chg" if valuation else ""))
+            print("-" * (75 + (20 if valuation else 0)))
+            for row in signals.itertuples():
+                signal = 'breakout' if row.is_breakout else 'breakdown'
+                line = (f"{row.stock_no:<8} | {row.last_update} | {row.support:7.2f} | {row.resistance:7.2f} | "
+                        f"{row.support_touches:7d} | {row.resistance_touches:7d} | {signal}")
+                if valuation:
+                    line = f"{line:<73} | {format_ratio(row.margin)} | {format_ratio(row.revenue_change)}"
+                print(line)
+
+        sys.stdout.flush()
+    except Exception as e:
+        print(f"Error scanning stocks: {e}")
+        traceback.print_exc()
+        sys.stdout.flush()
+        return False
+
+def export_worker(db_config, path, mmap=False):
+    """
+    Worker for writing the database to a snapshot directory
+    """
+    try:
+        started = datetime.now()
+        manifest = export_snapshot(db_config, path, mmap)
+        files = manifest['files'].values()
+        prices = [entry for entry in files if entry['table'] == 'prices']
+        income = [entry for entry in files if entry['table'] == 'income']
+        size = sum(entry['bytes'] for entry in files)
+        print(f"\nSnapshot written to {path}/ in {(datetime.now() - started).total_seconds():.1f}s:")
+        print(f"Prices: {sum(entry['rows'] for entry in prices)} rows of "
+              f"{len({entry['stock_no'] for entry in prices})} stocks in {len(prices)} files")
+        print(f"Income: {sum(entry['rows'] for entry in income)} rows in {len(income)} files")
+        print(f"Size: {size / 2**20:.1f} MB{', with memory mapped panel' if mmap else ''}")
+        sys.stdout.flush()
+    except Exception as e:
+        print(f"Error exporting snapshot: {e}")
+        traceback.print_exc()
+        sys.stdout.flush()
+        return False
+
+def import_worker(db_config, path):
+    """
+    Worker for loading a snapshot directory into the database
+    """
+    try:
+        started = datetime.now()
+        written, failed = import_snapshot(db_config, path)
+        print(f"\nSnapshot {path}/ imported in {(datetime.now() - started).total_seconds():.1f}s: {written} rows")
+        for name, error in failed:
+            print(f"Failed {name}: {error}")
+        sys.stdout.flush()
+        if failed:
+            return False
+    except Exception as e:
+        print(f"Error importing snapshot: {e}")
+        traceback.print_exc()
+        sys.stdout.flush()
+        return False
+
+def watch_worker(db_config, stock_numbers, interval=POLL_INTERVAL, lookback=WATCH_LOOKBACK):
+    """
+    Worker for watching the intraday quotes of stocks until the close.
+    Alerts are printed when a price crosses the support/resistance of the last
+    lookback daily bars, the bars of the day are written at the close.
+    """
+    fetcher = None
+    try:
+        fetcher = open_fetcher(db_config, "", None, None)
+        today = pd.Timestamp(datetime.now().date())
+        levels = {}
+        print(f"\nWatching {', '.join(stock_numbers)}:")
+        for stock_no in stock_numbers:
+            fetcher.stock_no = stock_no
+            data = fetcher.get_aggregated_data_from_db('D')
+            if not data.empty:
+                data = data[data['date'] < today]
+            if data.empty:
+                print(f"{stock_no}: no history, no alerts")
+                continue
+            result = StockPatternAnalyzer(data.tail(lookback), None, None).analyze()
+            levels[stock_no] = (result['support'], result['resistance'])
+            print(f"{stock_no}: support {result['support']:.2f}, resistance {result['resistance']:.2f}")
+        sys.stdout.flush()
+
+        watcher = IntradayWatcher(stock_numbers, levels, interval=interval)
+        try:
+            bars = asyncio.run(watcher.run())
+        except KeyboardInterrupt:
+            print("Watch stopped before the close, the bars of the day are not written")
+            return False
+
+        fetcher.db_connection.ping(reconnect=True, attempts=2, delay=1)
+        print(f"\nClose after {watcher.polls} polls:")
+        for stock_no, bar in sorted(bars.items()):
+            fetcher.stock_no = stock_no
+            fetcher.insert_data([bar.to_record()])
+            print(f"{stock_no} {bar.date}: O {bar.open:.2f} H {bar.high:.2f} L {bar.low:.2f} "
+                  f"C {bar.close:.2f} V {bar.volume} ({len(watcher.rings[stock_no])} ticks)")
+        sys.stdout.flush()
+    except Exception as e:
+        print(f"Error watching stocks: {e}")
+        traceback.print_exc()
+        sys.stdout.flush()
+        return False
+    finally:
+        if fetcher is not None and fetcher.db_connection is not None:
+            release_fetcher(fetcher)